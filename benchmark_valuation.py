@@ -0,0 +1,268 @@
+"""
+Benchmark of the contract valuation stages on synthetic contracts, from 10 to 1 million days.
+
+generate_synthetic_contract makes a contract (same inputs as contract_pricing.value_contract) with a chosen number of
+days, number of client actions, volume/rate ratio and capacity pressure:
+
+    - the injections are spread evenly over the first half of the dates and the withdrawals over the second half,
+    - every client action moves on average volume_to_rate_ratio times what the facility can move until the next one
+      (volumes vary by +/-50%), so a ratio of 1 or more forces the client_action_overlap path (the daily schedule) and
+      a ratio below 2/3 the cumulative check,
+    - the maximum capacity is the peak of the inventory divided by capacity_pressure, so a pressure above 1 makes the
+      contract break its capacity (the stages are still timed, the error is kept in the results).
+
+Dates are %d/%m/%y strings, which only go until 2068, so past MAX_DATE_SPAN_DAYS the dates are squeezed together and
+the extra days come from the volumes: the daily schedule of a 1 million day contract is 1 million days long.
+
+Every stage of the valuation is timed on its own (best and median of a few repeats): parsing and sorting the dates,
+overlap detection, the contract length, the daily schedule (vectorised, and the original divide_into_list/
+add_into_larger_array loops up to max_legacy_days), the inventory walk, pricing with one price_prediction call per
+client action (the original way) and with the forward curve, and value_contract end to end. The results are written as
+JSON, and two result files (e.g. before and after a change) can be compared stage by stage.
+
+Usage: python benchmark_valuation.py [--sizes 10 100 ...] [--output results.json] [--compare baseline.json]
+"""
+
+# All imported and files/scripts libraries here.
+from datetime import datetime, timedelta
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+import contract_pricing as cp
+import daily_schedule as ds
+import forward_curve as fc
+
+# Contract lengths (in days) benchmarked by default.
+BENCHMARK_SIZES = (10, 100, 1000, 10000, 100000, 1000000)
+# Date of the first client action of every synthetic contract.
+FIRST_SYNTHETIC_DATE = datetime(2022, 1, 1)
+# Longest span of client action dates, so every date stays before the end of the %y years (2068).
+MAX_DATE_SPAN_DAYS = 17000
+# The original schedule loops are only timed up to this contract length, past it they take minutes.
+MAX_LEGACY_DAYS = 100000
+# Largest number of client actions of a synthetic contract when not chosen.
+MAX_DEFAULT_EVENTS = 2000
+# A stage is reported as a regression by compare_benchmarks when it is this much slower than the baseline.
+REGRESSION_THRESHOLD = 1.2
+
+
+def generate_synthetic_contract(contract_days, number_of_events=None, volume_to_rate_ratio=2.0, capacity_pressure=0.9,
+                                rate_of_injection_or_withdrawal=50000, seed=None):
+    # Returns a dictionary with the inputs of contract_pricing.value_contract (client actions and facility parameters).
+    # number_of_events defaults to one client action every 10 days, at least 2 and at most MAX_DEFAULT_EVENTS.
+    random_generator = np.random.default_rng(seed)
+    if number_of_events is None:
+        number_of_events = min(max(2, contract_days // 10), MAX_DEFAULT_EVENTS)
+    number_of_injections = max(1, number_of_events // 2)
+    number_of_withdrawals = max(1, number_of_events - number_of_injections)
+
+    # Evenly spread dates, injections in the first half and withdrawals in the second half of the span.
+    date_span = min(contract_days, MAX_DATE_SPAN_DAYS)
+    half_span = max(1, date_span // 2)
+    injection_days = np.arange(number_of_injections) * half_span // number_of_injections
+    withdrawal_days = (half_span + np.arange(number_of_withdrawals) * max(1, date_span - half_span) //
+                       number_of_withdrawals)
+
+    # The volumes: with a ratio of 1, the injections need exactly the first half of contract_days and the withdrawals
+    # the second half. Whole MMBtu, the withdrawals split the total injected volume so the contract is balanced.
+    mean_volume = volume_to_rate_ratio * rate_of_injection_or_withdrawal * contract_days / 2 / number_of_injections
+    injected_volumes = np.maximum(1, np.round(mean_volume * random_generator.uniform(0.5, 1.5, number_of_injections)))
+    withdrawal_shares = random_generator.uniform(0.5, 1.5, number_of_withdrawals)
+    withdrawn_volumes = np.floor(injected_volumes.sum() * withdrawal_shares / withdrawal_shares.sum())
+    withdrawn_volumes[-1] += injected_volumes.sum() - withdrawn_volumes.sum()
+
+    contract = {
+        'injection_dates': [(FIRST_SYNTHETIC_DATE + timedelta(days=int(day))).strftime(cp.DATE_FORMAT)
+                            for day in injection_days],
+        'withdrawal_dates': [(FIRST_SYNTHETIC_DATE + timedelta(days=int(day))).strftime(cp.DATE_FORMAT)
+                             for day in withdrawal_days],
+        'injected_natural_gas_volumes': [int(volume) for volume in injected_volumes],
+        'withdrawn_natural_gas_volumes': [int(volume) for volume in withdrawn_volumes],
+        'rate_of_injection_or_withdrawal': rate_of_injection_or_withdrawal,
+        'storage_max_capacity': None,
+        'storage_facility_usage_cost': cp.storage_facility_usage_cost,
+        'injection_withdrawal_cost': cp.injection_withdrawal_cost,
+        'cost_of_transport': cp.cost_of_transport,
+    }
+    contract['storage_max_capacity'] = float(np.floor(peak_inventory(contract) / capacity_pressure))
+    return contract
+
+
+def peak_inventory(contract):
+    # Highest volume in the storage over the contract, daily if the client actions overlap and per client action if not.
+    sorted_dates, sorted_volumes = cp.sort_client_actions(contract['injection_dates'], contract['withdrawal_dates'],
+                                                          contract['injected_natural_gas_volumes'],
+                                                          contract['withdrawn_natural_gas_volumes'])
+    rate = contract['rate_of_injection_or_withdrawal']
+    if not cp.detect_client_action_overlap(sorted_dates, sorted_volumes, rate):
+        return float(np.max(np.cumsum(sorted_volumes)))
+    daily_schedule = schedule_inputs(contract, sorted_dates, sorted_volumes)
+    return float(np.max(ds.daily_inventory(*cp.build_daily_schedule(*daily_schedule))))
+
+
+def schedule_inputs(contract, sorted_dates, sorted_volumes):
+    # The arguments of contract_pricing.build_daily_schedule for an overlapping contract.
+    rate = contract['rate_of_injection_or_withdrawal']
+    sorted_injection_dates, sorted_injection_volumes = cp.sort_dates_and_volumes(
+        contract['injection_dates'], contract['injected_natural_gas_volumes'])
+    sorted_withdraw_dates, sorted_withdraw_volumes = cp.sort_dates_and_volumes(
+        contract['withdrawal_dates'], [-volume for volume in contract['withdrawn_natural_gas_volumes']])
+    contract_length_in_days = cp.overlap_contract_length(sorted_dates, sorted_volumes, sorted_withdraw_dates,
+                                                         sorted_withdraw_volumes, rate)
+    return (sorted_injection_dates, sorted_injection_volumes, sorted_withdraw_dates, sorted_withdraw_volumes,
+            contract_length_in_days, rate)
+
+
+def time_stage(stage, repeats):
+    # Runs stage() repeats times. Returns the wall times (best and median, in seconds) and the result of the last run.
+    wall_times = []
+    result = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = stage()
+        wall_times.append(time.perf_counter() - start_time)
+    return {'best_seconds': min(wall_times), 'median_seconds': statistics.median(wall_times),
+            'repeats': repeats}, result
+
+
+def check_inventory_stage(contract, daily_schedule, sorted_dates, sorted_volumes, client_action_overlap):
+    # The inventory walk of contract_pricing. Returns the message of the capacity error, '' if there is none.
+    try:
+        if client_action_overlap:
+            cp.check_daily_inventory(*daily_schedule, sorted_dates[0], contract['storage_max_capacity'])
+        else:
+            cp.check_cumulative_inventory(sorted_volumes, contract['storage_max_capacity'])
+    except cp.ContractValidationError as error:
+        return str(error)
+    return ''
+
+
+def benchmark_contract(contract, forward_curve, repeats=3, max_legacy_days=MAX_LEGACY_DAYS):
+    # Times every stage of the valuation of one contract. Returns a dictionary with the contract size and the timings.
+    rate = contract['rate_of_injection_or_withdrawal']
+    stages = {}
+
+    stages['parsing_sorting'], (sorted_dates, sorted_volumes) = time_stage(
+        lambda: cp.sort_client_actions(contract['injection_dates'], contract['withdrawal_dates'],
+                                       contract['injected_natural_gas_volumes'],
+                                       contract['withdrawn_natural_gas_volumes']), repeats)
+    stages['overlap_detection'], client_action_overlap = time_stage(
+        lambda: cp.detect_client_action_overlap(sorted_dates, sorted_volumes, rate), repeats)
+
+    daily_schedule = None
+    if client_action_overlap:
+        stages['contract_length'], inputs = time_stage(
+            lambda: schedule_inputs(contract, sorted_dates, sorted_volumes), repeats)
+        contract_length_in_days = inputs[4]
+        stages['schedule_build'], daily_schedule = time_stage(lambda: cp.build_daily_schedule(*inputs), repeats)
+        if contract_length_in_days <= max_legacy_days:
+            # The original loops, run with the same inputs as the vectorised version.
+            stages['schedule_build_legacy'], _ = time_stage(lambda: cp.build_daily_schedule_loops(*inputs), repeats)
+    else:
+        contract_length_in_days = (sorted_dates[-1] - sorted_dates[0]).days + abs(sorted_volumes[-1]) / rate
+    stages['inventory_walk'], capacity_error = time_stage(
+        lambda: check_inventory_stage(contract, daily_schedule, sorted_dates, sorted_volumes, client_action_overlap),
+        repeats)
+
+    # Pricing the original way, one pricing model call per client action, then with the (already made) forward curve.
+    price_model = forward_curve.price_model
+    if price_model is not None:
+        stages['pricing_model_calls'], _ = time_stage(
+            lambda: [price_model(cp.date_month_index(date)) for date in sorted_dates], repeats)
+    forward_curve.prices_at(np.array(sorted_dates, dtype='datetime64[D]'))  # Grows the curve outside of the timing.
+    stages['pricing_forward_curve'], _ = time_stage(
+        lambda: -np.dot(forward_curve.prices_at(np.array(sorted_dates, dtype='datetime64[D]')), sorted_volumes),
+        repeats)
+    if not capacity_error:
+        stages['value_contract'], _ = time_stage(lambda: cp.value_contract(**contract, forward_curve=forward_curve),
+                                                 repeats)
+
+    return {
+        'contract_length_in_days': float(contract_length_in_days),
+        'number_of_client_actions': len(sorted_volumes),
+        'client_action_overlap': bool(client_action_overlap),
+        'capacity_error': capacity_error,
+        'stages': stages,
+    }
+
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, number_of_events=None, volume_to_rate_ratio=2.0, capacity_pressure=0.9,
+                   repeats=3, max_legacy_days=MAX_LEGACY_DAYS, seed=0, forward_curve=None, label=''):
+    # Benchmarks one synthetic contract per size (contract days). Returns the JSON-ready results with the settings and
+    # the environment they were measured in.
+    if forward_curve is None:
+        forward_curve = fc.load_forward_curve()
+    results = {
+        'label': label,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'settings': {'number_of_events': number_of_events, 'volume_to_rate_ratio': volume_to_rate_ratio,
+                     'capacity_pressure': capacity_pressure, 'repeats': repeats, 'max_legacy_days': max_legacy_days,
+                     'seed': seed},
+        'benchmarks': [],
+    }
+    for contract_days in sizes:
+        contract = generate_synthetic_contract(contract_days, number_of_events, volume_to_rate_ratio,
+                                               capacity_pressure, seed=seed)
+        benchmark = benchmark_contract(contract, forward_curve, repeats, max_legacy_days)
+        benchmark['contract_days'] = contract_days
+        results['benchmarks'].append(benchmark)
+    return results
+
+
+def compare_benchmarks(baseline, current, threshold=REGRESSION_THRESHOLD):
+    # Ratio of the best times (current / baseline) of every stage benchmarked in both results, per contract size.
+    # Returns a list of (contract days, stage, baseline seconds, current seconds, ratio, regression).
+    baseline_by_size = {benchmark['contract_days']: benchmark for benchmark in baseline['benchmarks']}
+    comparison = []
+    for benchmark in current['benchmarks']:
+        baseline_benchmark = baseline_by_size.get(benchmark['contract_days'])
+        if baseline_benchmark is None:
+            continue
+        for stage, timing in benchmark['stages'].items():
+            if stage not in baseline_benchmark['stages']:
+                continue
+            baseline_seconds = baseline_benchmark['stages'][stage]['best_seconds']
+            ratio = timing['best_seconds'] / baseline_seconds if baseline_seconds > 0 else float('inf')
+            comparison.append((benchmark['contract_days'], stage, baseline_seconds, timing['best_seconds'], ratio,
+                               ratio > threshold))
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the stages of the contract valuation on synthetic contracts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(BENCHMARK_SIZES), help='contract lengths in days')
+    parser.add_argument('--events', type=int, default=None, help='client actions per contract')
+    parser.add_argument('--volume-to-rate-ratio', type=float, default=2.0, help='1 or more forces overlapping actions')
+    parser.add_argument('--capacity-pressure', type=float, default=0.9, help='peak inventory / maximum capacity')
+    parser.add_argument('--repeats', type=int, default=3, help='runs of every stage')
+    parser.add_argument('--max-legacy-days', type=int, default=MAX_LEGACY_DAYS, help='longest contract for the loops')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic contracts')
+    parser.add_argument('--label', default='', help='name of this run, e.g. a version')
+    parser.add_argument('--output', default=None, help='JSON results file (default: printed)')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with')
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(arguments.sizes, arguments.events, arguments.volume_to_rate_ratio,
+                                       arguments.capacity_pressure, arguments.repeats, arguments.max_legacy_days,
+                                       arguments.seed, label=arguments.label)
+    if arguments.output:
+        with open(arguments.output, 'w') as results_file:
+            json.dump(benchmark_results, results_file, indent=2)
+    else:
+        json.dump(benchmark_results, sys.stdout, indent=2)
+        print()
+
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            baseline_results = json.load(baseline_file)
+        for days, stage_name, baseline_time, current_time, time_ratio, regression in compare_benchmarks(
+                baseline_results, benchmark_results):
+            print(f'{days:>8} days {stage_name:<22} {baseline_time:.6f}s -> {current_time:.6f}s '
+                  f'({time_ratio:.2f}x){"  REGRESSION" if regression else ""}', file=sys.stderr)
@@ -0,0 +1,79 @@
+"""
+Shared test fixtures: a forward curve of a made-up pricing model (so the tests do not need price_predict) and a set of
+random contracts, as contract_pricing inputs and as a portfolio_valuation contract table.
+"""
+
+# All imported and files/scripts libraries here.
+from datetime import date, timedelta
+import math
+import random
+import pytest
+import contract_pricing as cp
+import forward_curve as fc
+
+NUMBER_OF_RANDOM_CONTRACTS = 300
+RATE_OF_INJECTION_OR_WITHDRAWAL = 50000
+# The contract parameters the tests value with, apart from the maximum capacity which every random contract has its own.
+PARAMETERS = {'rate_of_injection_or_withdrawal': RATE_OF_INJECTION_OR_WITHDRAWAL, 'storage_facility_usage_cost': 100000,
+              'injection_withdrawal_cost': 10000, 'cost_of_transport': 50000}
+
+
+def sine_price_model(month_index):
+    # A trend with a yearly season, in $/MMBtu, standing in for price_predict.price_prediction.
+    return 11 + 0.08 * month_index + 0.9 * math.sin(2 * math.pi * (month_index - 1.5) / 12)
+
+
+def random_contract(rng, contract_id):
+    # One contract with injections in the first half of its horizon and withdrawals in the second half. Depending on
+    # the draw it overlaps or not, and breaks its capacity, withdraws gas it does not have or is unbalanced.
+    horizon = rng.choice([10, 60, 200])
+    start = date(2021, 1, 1) + timedelta(days=rng.randint(0, 700))
+    injection_days = [rng.randint(0, horizon // 2) for _ in range(rng.randint(1, 4))]
+    withdrawal_days = sorted(rng.randint(horizon // 2, horizon) for _ in range(rng.randint(1, 4)))
+    injected_volumes = [rng.randint(1, 3 * RATE_OF_INJECTION_OR_WITHDRAWAL) for _ in injection_days]
+    total_volume = sum(injected_volumes)
+    cuts = sorted(rng.randint(1, total_volume - 1) for _ in withdrawal_days[1:])
+    withdrawn_volumes = [end - begin for begin, end in zip([0] + cuts, cuts + [total_volume])]
+    if rng.random() < 0.1:
+        withdrawn_volumes[0] += 1
+    return {
+        'contract_id': f'contract_{contract_id:04d}',
+        'injection_dates': [(start + timedelta(days=day)).strftime(cp.DATE_FORMAT) for day in injection_days],
+        'withdrawal_dates': [(start + timedelta(days=day)).strftime(cp.DATE_FORMAT) for day in withdrawal_days],
+        'injected_natural_gas_volumes': injected_volumes,
+        'withdrawn_natural_gas_volumes': withdrawn_volumes,
+        'storage_max_capacity': rng.choice([2000000, 200000, 100000]),
+    }
+
+
+def contract_table(contracts):
+    # The contract table of portfolio_valuation (one row per client action) for a list of random contracts.
+    table = {'contract_id': [], 'action': [], 'date': [], 'volume': [], 'storage_max_capacity': []}
+    for contract in contracts:
+        for action, dates, volumes in (('injection', contract['injection_dates'],
+                                        contract['injected_natural_gas_volumes']),
+                                       ('withdrawal', contract['withdrawal_dates'],
+                                        contract['withdrawn_natural_gas_volumes'])):
+            for action_date, volume in zip(dates, volumes):
+                table['contract_id'].append(contract['contract_id'])
+                table['action'].append(action)
+                table['date'].append(action_date)
+                table['volume'].append(volume)
+                table['storage_max_capacity'].append(contract['storage_max_capacity'])
+    return table
+
+
+@pytest.fixture(scope='session')
+def forward_curve():
+    return fc.ForwardCurve(sine_price_model, name='sine_price_model')
+
+
+@pytest.fixture(scope='session')
+def random_contracts():
+    rng = random.Random(161123)
+    return [random_contract(rng, contract_id) for contract_id in range(NUMBER_OF_RANDOM_CONTRACTS)]
+
+
+@pytest.fixture(scope='session')
+def random_contract_table(random_contracts):
+    return contract_table(random_contracts)
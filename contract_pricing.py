@@ -7,15 +7,17 @@ From: https://github.com/kweterings/Trader_Contract_Valuation_Script
 
 # All imported and files/scripts libraries here.
 from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
 import calendar
 import math as mt
 import numpy as np
-import price_predict as pp
+import daily_schedule as ds
+import forward_curve as fc
+import instrumentation as inst
 
 # This is a contract valuation automated program for clients interested in the market for natural gas. This valuation is
-# based on price values determined by another pricing model program (import price_predict as pp). Please be aware that
-# if the file has different name or isn't in the same working directory as this file, this script will not work.
+# based on price values determined by another pricing model program (price_predict, evaluated once over a daily grid by
+# forward_curve). Please be aware that if the file has different name or isn't in the same working directory as this
+# file, this script will not work.
 
 # NOTE: Two key assumptions were made whilst writing this program;
 #   1. When a client decides to perform an action (inject or withdraw), the total cost/earning is of the entire volume
@@ -52,55 +54,98 @@ cost_of_transport = 50000
 # These meaning of these variables can be modified accordingly if not totally accurate for the type of contract this
 # program is being used for.
 
-# Altering the list values so they go chronologically.
-all_original_dates = injection_dates + withdrawal_dates
-withdrawn_natural_gas_volumes_negative = [- + elem for elem in withdrawn_natural_gas_volumes]  # - for removing volume.
-all_original_volumes = injected_natural_gas_volumes + withdrawn_natural_gas_volumes_negative
-all_dates = [datetime.strptime(date, '%d/%m/%y') for date in all_original_dates]
-sorted_dates = sorted(all_dates)
-sorted_dates_indices = sorted(range(len(all_dates)), key=lambda i: all_dates[i])  # Same order change as date list.
-sorted_volumes = [all_original_volumes[i] for i in sorted_dates_indices]
-
-# Checking if all provided dates have a corresponding volume value.
-if len(sorted_volumes) != len(sorted_dates):
-    print('The number of dates (injection or withdrawal) does not correspond to the number of volumes (injected or '
-          'withdrawn) provided. Please fix this issue.')
-    quit()
-
-# Checking if some volume of natural gas is remaining after contract end, this should be 0 at contract end.
-if mt.fsum(sorted_volumes) != 0:
-    print('The client still has natural gas in the storage after the final contract date. This must be changed.')
-    quit()
-
-# Creating 2 lists: one for action duration and another for time between actions (dates).
-action_durations = []  # In days.
-number_of_days_between_successive_dates = []
-for volume, date1, date2 in zip(sorted_volumes[:-1], sorted_dates[:-1], sorted_dates[1:]):
-    days_until_completed_action = np.ceil(volume / rate_of_injection_or_withdrawal)
-    days_between_actions = (date2 - date1).days
-    action_durations.append(days_until_completed_action)
-    number_of_days_between_successive_dates.append(days_between_actions)
-
-# Checking if actions overlap, hence pushing back that action due to the injection/withdraw rate limit.
-client_action_overlap = any(needed_days >= allowed_days for needed_days, allowed_days in
-                            zip(action_durations, number_of_days_between_successive_dates))
-
-if client_action_overlap:  # The volumes in the storage will be different over time if overlapped vs. not overlapped.
-    # Sorting both injection and withdraw dates separately, chronologically, alongside corresponding volumes like above.
-    injection_dates_formatted = [datetime.strptime(date, '%d/%m/%y') for date in injection_dates]
-    sorted_injection_dates = sorted(injection_dates_formatted)
-    sorted_injection_dates_indices = sorted(range(len(injection_dates_formatted)),
-                                            key=lambda i: injection_dates_formatted[i])
-    sorted_injection_volumes = [injected_natural_gas_volumes[i] for i in sorted_injection_dates_indices]
-
-    withdrawal_dates_formatted = [datetime.strptime(date, '%d/%m/%y') for date in withdrawal_dates]
-    sorted_withdraw_dates = sorted(withdrawal_dates_formatted)
-    sorted_withdraw_dates_indices = sorted(range(len(withdrawal_dates_formatted)),
-                                           key=lambda i: withdrawal_dates_formatted[i])
-    sorted_withdraw_volumes = [withdrawn_natural_gas_volumes_negative[i] for i in sorted_withdraw_dates_indices]
-
-    # Same 2 lists as above but for withdraw dates and volumes. Will be used to determine the days past the final
-    # provided date at which the contract actually ends.
+# The format every client action date is given in, e.g. '11/12/21' for the 11th of December 2021.
+DATE_FORMAT = '%d/%m/%y'
+
+
+class ContractValidationError(ValueError):
+    # Raised when a contract breaks one of its rules (volume balance, storage capacity, etc...). The message is the same
+    # text that is shown to the user, so a batch run can store it next to the contract instead of stopping altogether.
+    pass
+
+
+# The messages shown to the user when a contract breaks one of its rules.
+UNBALANCED_VOLUME_MESSAGE = ('The client still has natural gas in the storage after the final contract date. This must '
+                             'be changed.')
+
+
+def too_large_injection_message(too_large_injection, storage_max_capacity):
+    return (f'The injected volume of {too_large_injection} MMBtu made the clients total owned natural gas volume '
+            f'larger than the maximum storage capacity of {storage_max_capacity} MMBtu. Please adapt the values for '
+            f'this to no longer be the case.')
+
+
+def too_large_withdraw_message(too_large_withdraw):
+    return (f'The withdrawn volume of {too_large_withdraw} MMBtu is more than the client has stored at the time of '
+            f'withdrawal. Please adapt the values for this to no longer be the case.')
+
+
+def storage_overflow_message(date_of_overflow):
+    return (f"On the contract date of {date_of_overflow} (dd/mm/yy) the storage capacity was exceeded. Hence the "
+            f"client has bought natural gas at this time than the storage can handle.\nPlease adjust the values so "
+            f"this is no longer the case.")
+
+
+def storage_empty_message(date_of_empty):
+    return (f"On the contract date of {date_of_empty} (dd/mm/yy) there was no more natural gas to withdraw. Hence the "
+            f"client attempted to withdraw more than they had available in the storage facility.\nPlease adjust the "
+            f"values so this is no longer the case.")
+
+
+def sort_client_actions(injection_dates, withdrawal_dates, injected_natural_gas_volumes,
+                        withdrawn_natural_gas_volumes):
+    # Altering the list values so they go chronologically. Returns the sorted dates and the sorted volumes, where
+    # withdrawals are made negative (- for removing volume).
+    all_original_dates = injection_dates + withdrawal_dates
+    withdrawn_natural_gas_volumes_negative = [- + elem for elem in withdrawn_natural_gas_volumes]
+    all_original_volumes = injected_natural_gas_volumes + withdrawn_natural_gas_volumes_negative
+    all_dates = [datetime.strptime(date, DATE_FORMAT) for date in all_original_dates]
+    sorted_dates = sorted(all_dates)
+    sorted_dates_indices = sorted(range(len(all_dates)), key=lambda i: all_dates[i])  # Same order change as date list.
+
+    # Checking if all provided dates have a corresponding volume value.
+    if len(all_original_volumes) != len(all_dates):
+        raise ContractValidationError('The number of dates (injection or withdrawal) does not correspond to the number '
+                                      'of volumes (injected or withdrawn) provided. Please fix this issue.')
+
+    sorted_volumes = [all_original_volumes[i] for i in sorted_dates_indices]
+    return sorted_dates, sorted_volumes
+
+
+def sort_dates_and_volumes(dates, volumes):
+    # Sorting one type of client action (injections or withdrawals) chronologically, alongside corresponding volumes.
+    dates_formatted = [datetime.strptime(date, DATE_FORMAT) for date in dates]
+    sorted_action_dates = sorted(dates_formatted)
+    sorted_action_dates_indices = sorted(range(len(dates_formatted)), key=lambda i: dates_formatted[i])
+    sorted_action_volumes = [volumes[i] for i in sorted_action_dates_indices]
+    return sorted_action_dates, sorted_action_volumes
+
+
+def check_volume_balance(sorted_volumes):
+    # Checking if some volume of natural gas is remaining after contract end, this should be 0 at contract end.
+    if mt.fsum(sorted_volumes) != 0:
+        raise ContractValidationError(UNBALANCED_VOLUME_MESSAGE)
+
+
+def detect_client_action_overlap(sorted_dates, sorted_volumes, rate_of_injection_or_withdrawal):
+    # Creating 2 lists: one for action duration and another for time between actions (dates).
+    action_durations = []  # In days.
+    number_of_days_between_successive_dates = []
+    for volume, date1, date2 in zip(sorted_volumes[:-1], sorted_dates[:-1], sorted_dates[1:]):
+        days_until_completed_action = np.ceil(volume / rate_of_injection_or_withdrawal)
+        days_between_actions = (date2 - date1).days
+        action_durations.append(days_until_completed_action)
+        number_of_days_between_successive_dates.append(days_between_actions)
+
+    # Checking if actions overlap, hence pushing back that action due to the injection/withdraw rate limit.
+    return any(needed_days >= allowed_days for needed_days, allowed_days in
+               zip(action_durations, number_of_days_between_successive_dates))
+
+
+def overlap_contract_length(sorted_dates, sorted_volumes, sorted_withdraw_dates, sorted_withdraw_volumes,
+                            rate_of_injection_or_withdrawal):
+    # Same 2 lists as in detect_client_action_overlap but for withdraw dates and volumes. Will be used to determine the
+    # days past the final provided date at which the contract actually ends.
     withdraw_action_durations = []
     withdraw_number_of_days_between_successive_dates = []
     for volume, date1, date2 in zip(sorted_withdraw_volumes[:-1], sorted_withdraw_dates[:-1],
@@ -111,21 +156,17 @@ if client_action_overlap:  # The volumes in the storage will be different over t
         withdraw_number_of_days_between_successive_dates.append(days_between_actions)
 
     # Determining the extra days to the end of the contract beyond the first and last provided date.
-    volume_left_to_withdraw = 0
     extra_needed_days = 0
-    for needed_days, allowed_days, volume, date1, date2 in zip(withdraw_action_durations,
-                                                               withdraw_number_of_days_between_successive_dates,
-                                                               sorted_withdraw_volumes[:-1], sorted_withdraw_dates[:-1],
-                                                               sorted_withdraw_dates[1:]):
+    for needed_days, allowed_days, volume in zip(withdraw_action_durations,
+                                                 withdraw_number_of_days_between_successive_dates,
+                                                 sorted_withdraw_volumes[:-1]):
         # Effective as if action days carry over it will take longer for all actions to be finished.
         effective_needed_days = abs(needed_days) + extra_needed_days
         if effective_needed_days >= allowed_days:
             extra_volume = abs(volume) - allowed_days * rate_of_injection_or_withdrawal  # Volume left after time of 2
             # adjacent dates.
             extra_needed_days += extra_volume / rate_of_injection_or_withdrawal  # Topping up other extra action days.
-            last_date = date2
         else:
-            volume_left_to_withdraw = 0
             extra_needed_days = 0
 
     # Making sure the last action was a withdrawal, it should be but this is simply validation.
@@ -136,194 +177,297 @@ if client_action_overlap:  # The volumes in the storage will be different over t
     # During of the contract in days. Np.ceil if a float, simple making sure it doesn't affect rest of code.
     contract_length_in_days = int(np.ceil((sorted_dates[-1] - sorted_dates[0]).days + extra_needed_days))
 
-    # Arrays 'injections' and 'withdrawals' will end up being made up of 0s and 1s: 0 being no action (volume moved) on
-    # that day and 1 being an action is occurring on that day.
-    injections = np.zeros(contract_length_in_days)
-    injection_volumes_per_day = np.zeros(contract_length_in_days)
-    withdrawals = np.zeros(contract_length_in_days)
-    withdrawal_volumes_per_day = np.zeros(contract_length_in_days)
-    day_index_array = np.arange(0, contract_length_in_days)
-
-    date_of_first_action = sorted_injection_dates[0]
-
-    # Will be used to create lists of the volume injected or withdrawn, every element being the volume per day.
-    def divide_into_list(number, divisor):
-        result = []
-        while number >= divisor:
-            result.append(divisor)
-            number -= divisor
-
-        if number != 0:
-            result.append(number)
-
-        return result
-
-    # When using the lists of 0s and 1s (0s no action and 1s there being action on a given days' element), this function
-    # will help pile action days on top of already present 1s instead of replace them.
-    def find_next_zero(index_of_one, array):
-        # Find the index of the next 0 after the first 1
-        index_of_next_zero = index_of_one + np.argmax(array[index_of_one:] == 0)
-        return index_of_next_zero
-
-    # Necessary for when adding together volume_per_day arrays, so values less than the daily rate don't end up between
-    # larger daily rate values for volumes moved in a day.
-    def add_into_larger_array(larger_array, smaller_array, start_index):
-        # Add smaller array values to larger array, with max value constraint
-        remainder = 0
-        for i in range(len(smaller_array)):
-            temp_sum = larger_array[i + start_index] + smaller_array[i] + remainder
-            larger_array[i + start_index] = min(temp_sum, rate_of_injection_or_withdrawal)
+    # The contract lasts at least until the volume of every queued injection and withdrawal has been moved, which the
+    # extra days above miss when the last client action is an injection still waiting behind earlier ones. Only then
+    # is it made longer, every other contract keeps the length above.
+    injection_days = [(date - sorted_dates[0]).days for date, volume in zip(sorted_dates, sorted_volumes) if volume > 0]
+    injection_volumes = [volume for volume in sorted_volumes if volume > 0]
+    withdrawal_days = [(date - sorted_dates[0]).days for date in sorted_withdraw_dates]
+    return max(contract_length_in_days,
+               ds.queue_end_day(injection_days, injection_volumes, rate_of_injection_or_withdrawal),
+               ds.queue_end_day(withdrawal_days, sorted_withdraw_volumes, rate_of_injection_or_withdrawal))
+
+
+# Will be used to create lists of the volume injected or withdrawn, every element being the volume per day.
+def divide_into_list(number, divisor):
+    result = []
+    while number >= divisor:
+        result.append(divisor)
+        number -= divisor
+
+    if number != 0:
+        result.append(number)
+
+    return result
+
+
+# When using the lists of 0s and 1s (0s no action and 1s there being action on a given days' element), this function
+# will help pile action days on top of already present 1s instead of replace them.
+def find_next_zero(index_of_one, array):
+    # Find the index of the next 0 after the first 1
+    index_of_next_zero = index_of_one + np.argmax(array[index_of_one:] == 0)
+    return index_of_next_zero
+
+
+# Necessary for when adding together volume_per_day arrays, so values less than the daily rate don't end up between
+# larger daily rate values for volumes moved in a day.
+def add_into_larger_array(larger_array, smaller_array, start_index, rate_of_injection_or_withdrawal):
+    # Add smaller array values to larger array, with max value constraint
+    remainder = 0
+    for i in range(len(smaller_array)):
+        temp_sum = larger_array[i + start_index] + smaller_array[i] + remainder
+        larger_array[i + start_index] = min(temp_sum, rate_of_injection_or_withdrawal)
+        remainder = max(0, temp_sum - rate_of_injection_or_withdrawal)
+
+    # Add remaining remainder to the next element in the larger array
+    if remainder > 0:
+        inst.count('remainder_spills')
+        for i in range(start_index + len(smaller_array), len(larger_array)):
+            temp_sum = larger_array[i] + remainder
+            larger_array[i] = min(temp_sum, rate_of_injection_or_withdrawal)
             remainder = max(0, temp_sum - rate_of_injection_or_withdrawal)
+            if remainder == 0:
+                break
 
-        # Add remaining remainder to the next element in the larger array
-        if remainder > 0:
-            for i in range(start_index + len(smaller_array), len(larger_array)):
-                temp_sum = larger_array[i] + remainder
-                larger_array[i] = min(temp_sum, rate_of_injection_or_withdrawal)
-                remainder = max(0, temp_sum - rate_of_injection_or_withdrawal)
-                if remainder == 0:
-                    break
-
-    # Will turn the above pre-made arrays for injections into the corresponding patterns for this contract. 0s and 1s
-    # and volumes per day in each element.
-    for date, volume in zip(sorted_injection_dates, sorted_injection_volumes):
+
+def fill_action_schedule(actions, action_volumes_per_day, sorted_action_dates, sorted_action_volumes,
+                         date_of_first_action, rate_of_injection_or_withdrawal):
+    # Will turn the pre-made arrays for injections (or withdrawals) into the corresponding patterns for this contract.
+    # 0s and 1s and volumes per day in each element.
+    for date, volume in zip(sorted_action_dates, sorted_action_volumes):
         index1 = (date - date_of_first_action).days
         index2 = int(np.ceil(abs(volume) / rate_of_injection_or_withdrawal)) + index1  # np.ceil in case of decimal.
         # This will mean that there are no underestimations of the time taken to inject the total volume.
         divided_volumes_to_add = divide_into_list(abs(volume), rate_of_injection_or_withdrawal)
-        if injections[index1] == 1:
-            new_index1 = find_next_zero(index1, injections)
+        if actions[index1] == 1:
+            new_index1 = find_next_zero(index1, actions)
             new_index2 = index2 + (new_index1 - index1)
-            injections[new_index1:new_index2] = 1
-            add_into_larger_array(injection_volumes_per_day, divided_volumes_to_add, index1)
+            actions[new_index1:new_index2] = 1
+            add_into_larger_array(action_volumes_per_day, divided_volumes_to_add, index1,
+                                  rate_of_injection_or_withdrawal)
         else:
-            injections[index1:index2] = 1
-            injection_volumes_per_day[index1:index1 + len(divided_volumes_to_add)] = divided_volumes_to_add
+            actions[index1:index2] = 1
+            action_volumes_per_day[index1:index1 + len(divided_volumes_to_add)] = divided_volumes_to_add
 
-    # Same as above but for withdrawals.
-    for date, volume in zip(sorted_withdraw_dates, sorted_withdraw_volumes):
-        index1 = (date - date_of_first_action).days
-        index2 = int(np.ceil(abs(volume) / rate_of_injection_or_withdrawal)) + index1
-        divided_volumes_to_add = divide_into_list(abs(volume), rate_of_injection_or_withdrawal)
-        if withdrawals[index1] == 1:
-            new_index1 = find_next_zero(index1, withdrawals)
-            new_index2 = index2 + (new_index1 - index1)
-            withdrawals[new_index1:new_index2] = 1
-            add_into_larger_array(withdrawal_volumes_per_day, divided_volumes_to_add, index1)
-        else:
-            withdrawals[index1:index2] = 1
-            withdrawal_volumes_per_day[index1:index1 + len(divided_volumes_to_add)] = divided_volumes_to_add
 
-    current_volume_stored_to_date = 0  # Pre-set variable.
+def build_daily_schedule_loops(sorted_injection_dates, sorted_injection_volumes, sorted_withdraw_dates,
+                               sorted_withdraw_volumes, contract_length_in_days, rate_of_injection_or_withdrawal):
+    # The original way of building the daily schedule, one rate-sized chunk at a time. Kept as the reference the
+    # vectorised daily_schedule.build_daily_schedule is checked and benchmarked against.
+    # Arrays 'injections' and 'withdrawals' will end up being made up of 0s and 1s: 0 being no action (volume moved) on
+    # that day and 1 being an action is occurring on that day.
+    injections = np.zeros(contract_length_in_days)
+    injection_volumes_per_day = np.zeros(contract_length_in_days)
+    withdrawals = np.zeros(contract_length_in_days)
+    withdrawal_volumes_per_day = np.zeros(contract_length_in_days)
+
+    date_of_first_action = sorted_injection_dates[0]
+
+    fill_action_schedule(injections, injection_volumes_per_day, sorted_injection_dates, sorted_injection_volumes,
+                         date_of_first_action, rate_of_injection_or_withdrawal)
+    # Same as above but for withdrawals.
+    fill_action_schedule(withdrawals, withdrawal_volumes_per_day, sorted_withdraw_dates, sorted_withdraw_volumes,
+                         date_of_first_action, rate_of_injection_or_withdrawal)
+
+    return injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day
+
+
+def build_daily_schedule(sorted_injection_dates, sorted_injection_volumes, sorted_withdraw_dates,
+                         sorted_withdraw_volumes, contract_length_in_days, rate_of_injection_or_withdrawal):
+    # Arrays 'injections' and 'withdrawals' are made up of 0s and 1s: 0 being no action (volume moved) on that day and
+    # 1 being an action is occurring on that day. The volumes per day arrays hold the volume moved on every day. Built
+    # with the vectorised queues of daily_schedule, days counted from the first client action.
+    date_of_first_action = min(sorted_injection_dates[:1] + sorted_withdraw_dates[:1])
+    injection_days = [(date - date_of_first_action).days for date in sorted_injection_dates]
+    withdrawal_days = [(date - date_of_first_action).days for date in sorted_withdraw_dates]
+    daily_schedule = ds.build_daily_schedule(injection_days, sorted_injection_volumes, withdrawal_days,
+                                             sorted_withdraw_volumes, contract_length_in_days,
+                                             rate_of_injection_or_withdrawal)
+    if inst.recording():
+        # Client actions added on top of volume still being moved, where the loops go through add_into_larger_array.
+        inst.count('queued_client_actions', ds.queued_actions(injection_days, sorted_injection_volumes,
+                                                              daily_schedule[1]) +
+                   ds.queued_actions(withdrawal_days, sorted_withdraw_volumes, daily_schedule[3]))
+    return daily_schedule
+
+
+def check_daily_inventory(injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day,
+                          contract_start, storage_max_capacity):
     # The final step for the if client_action_overlap condition, monitoring the daily evolution of the volume in the
     # storage. This will help check if any limits are surpassed, i.e. more than max capacity or withdrawing more than is
     # in the storage facility.
-    for injection, withdrawal, injection_volume, withdraw_volume, delta_day in zip(injections, withdrawals,
-                                                                                   injection_volumes_per_day,
-                                                                                   withdrawal_volumes_per_day,
-                                                                                   day_index_array):
-        if injection == 1 and withdrawal == 1:  # On given day, injection and withdrawal. However, possible differed
-            # amounts.
-            current_volume_stored_to_date += injection_volume - withdraw_volume
-        elif injection == 1 and withdrawal == 0:  # On given day, injection but no withdrawal.
-            current_volume_stored_to_date += injection_volume
-        elif injection == 0 and withdrawal == 1:  # On given day, withdrawal but no injection.
-            current_volume_stored_to_date -= withdraw_volume
-
-        if current_volume_stored_to_date > storage_max_capacity:  # If injecting more than possible.
-            date_of_overflow = (sorted_dates[0] + timedelta(days=delta_day)).strftime('%d/%m/%y')
-            print(f"On the contract date of {date_of_overflow} (dd/mm/yy) the storage capacity was exceeded. "
-                  f"Hence the client has bought natural gas at this time than the storage can handle.\n"
-                  f"Please adjust the values so this is no longer the case.")
-            quit()
-        elif current_volume_stored_to_date < 0:  # If withdrawing more than the client has.
-            date_of_empty = (sorted_dates[0] + timedelta(days=delta_day)).strftime('%d/%m/%y')
-            print(f"On the contract date of {date_of_empty} (dd/mm/yy) there was no more natural gas to withdraw. "
-                  f"Hence the client attempted to withdraw more than they had available in the storage facility.\n"
-                  f"Please adjust the values so this is no longer the case.")
-            quit()
-
-else:  # If client action does not overlap, this simple monitoring will suffice, i.e. same checks as above.
+    inventory = ds.daily_inventory(injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day)
+    check_inventory(inventory, contract_start, storage_max_capacity)
+
+
+def check_inventory(inventory, contract_start, storage_max_capacity):
+    # Raises ContractValidationError on the first day the volume in the storage (one value per day since contract_start)
+    # is more than max capacity or less than nothing.
+    delta_day, violation = ds.first_inventory_violation(inventory, storage_max_capacity)
+
+    if violation == 'overflow':  # If injecting more than possible.
+        date_of_overflow = (contract_start + timedelta(days=delta_day)).strftime(DATE_FORMAT)
+        raise ContractValidationError(storage_overflow_message(date_of_overflow))
+    elif violation == 'empty':  # If withdrawing more than the client has.
+        date_of_empty = (contract_start + timedelta(days=delta_day)).strftime(DATE_FORMAT)
+        raise ContractValidationError(storage_empty_message(date_of_empty))
+
+
+def check_cumulative_inventory(sorted_volumes, storage_max_capacity):
+    # If client action does not overlap, this simple monitoring will suffice, i.e. same checks as the daily inventory.
     for elem_index in range(len(sorted_volumes) + 1):
         total_volume = mt.fsum(sorted_volumes[:elem_index])
         if total_volume > storage_max_capacity:  # If injecting more than possible.
             too_large_injection = sorted_volumes[elem_index - 1]
-            print(f'The injected volume of {too_large_injection} MMBtu made the clients total owned natural gas volume '
-                  f'larger than the maximum storage capacity of {storage_max_capacity} MMBtu. '
-                  f'Please adapt the values for this to no longer be the case.')
-            quit()
+            raise ContractValidationError(too_large_injection_message(too_large_injection, storage_max_capacity))
         elif total_volume < 0:  # If withdrawing more than the client has.
             too_large_withdraw = str(sorted_volumes[elem_index - 1]).strip('-')
-            print(f'The withdrawn volume of {too_large_withdraw} MMBtu is more than the client has stored at the time '
-                  f'of withdrawal. Please adapt the values for this to no longer be the case.')
-            quit()
-
-    # Contract length is necessary later so will also need to be defined in the else: condition it is in.
-    contract_length_in_days = ((sorted_dates[-1] - sorted_dates[0]).days +
-                               (abs(sorted_volumes[-1]) / rate_of_injection_or_withdrawal))
-
-# Preamble, intro to program for user.
-print('Welcome to this contract valuation program for clients interested in the market for natural gas. Below will '
-      'be the necessary information.\n')
-
-total_prices = []
-month_indices = []
-# Looping through every date of client action to determine the cost or earnings of the client, whether injecting or
-# withdrawing.
-for date, volume in zip(sorted_dates, sorted_volumes):
-
-    date_day = date.day
-    date_month = date.month
-    date_year = date.year
-    days_in_injection_month = calendar.monthrange(date_year, date_month)[1]  # To be more precise, exact days in month.
-
-    date_month_index = (date_day / days_in_injection_month) + (date_year - 2020) * 12 + (date_month - 1)
-    month_indices.append(date_month_index)  # A month index to be used in the price prediction program. Will act as 'x'
-    # variable in regression model based on data. January 1st 2020 has date_month_index 0.
-
-    # Prices $/MMBtu for this pricing model used.
-    price_at_date = pp.price_prediction(date_month_index)
-
-    total_price_of_volume = price_at_date * volume  # Since price from model is dollar per MMBtu.
-    total_prices.append(total_price_of_volume)
-
-    # Formatting the price data into a readable way for the user to understand the cost and earnings of the client.
-    original_date_format = date.strftime('%d/%m/%y')
-    if original_date_format in injection_dates and volume > 0:  # Two conditions in case date occurs in both injections
-        # and withdrawals dates list.
-        print(f'The total price (amount client pays) of natural gas when INJECTING on the {original_date_format} is: '
-              f'{str(round(total_price_of_volume, 2)).strip("-")}$ ({round(price_at_date, 2)}$ per MMBtu).')
-    elif original_date_format in withdrawal_dates and volume < 0:  # Same reasoning as above for two conditions.
-        print(f'The total price (amount client earns) of natural gas when WITHDRAWING on the {original_date_format} is:'
-              f' {str(round(total_price_of_volume, 2)).strip("-")}$ ({round(price_at_date, 2)}$ per MMBtu).')
-
-final_difference_in_price = round(mt.fsum(total_prices) * -1, 2)  # Total earnings of client pre extra cost inclusion.
-
-print(f'\nThe final price difference (total withdraw price - total injection price), i.e. the money earned by the '
-      f'client, is: {final_difference_in_price}$.')
-
-# Used for part of the storage costs.
-total_handled_natural_gas_by_facility = mt.fsum(injected_natural_gas_volumes + withdrawn_natural_gas_volumes)
-
-# Finding contract length in months to determine the rental price of using storage facility, where any roll-over to
-# another month will lead to another monthly rental payment to the facility.
-date_difference = relativedelta(sorted_dates[-1], sorted_dates[0])
-months_difference = date_difference.years * 12 + date_difference.months + 1
-
-# This cost is calculated based on the variable defined at the beginning for given costs.
-storage_cost = ((storage_facility_usage_cost * months_difference) +  # Storage usage cost, per month.
-                (injection_withdrawal_cost * total_handled_natural_gas_by_facility / 1000000) +  # Cost per 1m MMBtu.
-                (cost_of_transport * len(sorted_volumes)))  # Logistics cost per each time a client action occurs.
-
-# Final contract valuation based on values calculated above.
-contract_valuation = round(final_difference_in_price - storage_cost, 2)
-
-# Final prints to show contract valuation and other information about the contract (length, start and end dates, etc...)
-print(f'The total storage and logistics cost during the period of the contract is: {round(storage_cost, 2)}$.')
-print('---------------------------')
-print(f'After careful valuation, the contract valuation with all extra costs taken into account is: '
-      f'{contract_valuation}$.')
-print(f'This contract will span from the {sorted_dates[0].strftime("%d/%m/%y")} until the '
-      f'{(sorted_dates[0] + timedelta(days=contract_length_in_days)).strftime("%d/%m/%y")} (contract ends when no '
-      f'gas is left in the storage).')
-print('Note: This valuation is based on price predictions of natural gas from a pricing model.')
+            raise ContractValidationError(too_large_withdraw_message(too_large_withdraw))
+
+
+def date_month_index(date):
+    # A month index to be used in the price prediction program. Will act as 'x' variable in regression model based on
+    # data. January 1st 2020 has date_month_index 0.
+    days_in_injection_month = calendar.monthrange(date.year, date.month)[1]  # To be more precise, exact days in month.
+    return (date.day / days_in_injection_month) + (date.year - 2020) * 12 + (date.month - 1)
+
+
+def contract_months(first_date, last_date):
+    # Finding contract length in months to determine the rental price of using storage facility, where any roll-over to
+    # another month will lead to another monthly rental payment to the facility.
+    from dateutil.relativedelta import relativedelta  # Imported on first use, so importing this file stays fast.
+    date_difference = relativedelta(last_date, first_date)
+    return date_difference.years * 12 + date_difference.months + 1
+
+
+def contract_storage_cost(months_difference, total_handled_natural_gas_by_facility, number_of_client_actions,
+                          storage_facility_usage_cost, injection_withdrawal_cost, cost_of_transport):
+    # This cost is calculated based on the variable defined at the beginning for given costs.
+    return ((storage_facility_usage_cost * months_difference) +  # Storage usage cost, per month.
+            (injection_withdrawal_cost * total_handled_natural_gas_by_facility / 1000000) +  # Cost per 1m MMBtu.
+            (cost_of_transport * number_of_client_actions))  # Logistics cost per each time a client action occurs.
+
+
+def value_contract(injection_dates, withdrawal_dates, injected_natural_gas_volumes, withdrawn_natural_gas_volumes,
+                   rate_of_injection_or_withdrawal, storage_max_capacity, storage_facility_usage_cost,
+                   injection_withdrawal_cost, cost_of_transport, forward_curve=None):
+    # Values a single contract. Raises ContractValidationError if the contract breaks any of its rules, otherwise
+    # returns a dictionary with the valuation, the storage cost, the contract dates and the priced client actions.
+    # Prices come from forward_curve, by default the curve of the price_predict model.
+    with inst.stage('parsing_sorting'):
+        sorted_dates, sorted_volumes = sort_client_actions(injection_dates, withdrawal_dates,
+                                                           injected_natural_gas_volumes, withdrawn_natural_gas_volumes)
+    inst.count('events_processed', len(sorted_volumes))
+    check_volume_balance(sorted_volumes)
+
+    with inst.stage('overlap_detection'):
+        client_action_overlap = detect_client_action_overlap(sorted_dates, sorted_volumes,
+                                                             rate_of_injection_or_withdrawal)
+
+    # The volumes in the storage will be different over time if overlapped vs. not overlapped.
+    if client_action_overlap:
+        with inst.stage('parsing_sorting'):
+            sorted_injection_dates, sorted_injection_volumes = sort_dates_and_volumes(injection_dates,
+                                                                                      injected_natural_gas_volumes)
+            sorted_withdraw_dates, sorted_withdraw_volumes = sort_dates_and_volumes(
+                withdrawal_dates, [- + elem for elem in withdrawn_natural_gas_volumes])
+
+        with inst.stage('contract_length'):
+            contract_length_in_days = overlap_contract_length(sorted_dates, sorted_volumes, sorted_withdraw_dates,
+                                                              sorted_withdraw_volumes, rate_of_injection_or_withdrawal)
+        with inst.stage('schedule_build'):
+            daily_schedule = build_daily_schedule(sorted_injection_dates, sorted_injection_volumes,
+                                                  sorted_withdraw_dates, sorted_withdraw_volumes,
+                                                  contract_length_in_days, rate_of_injection_or_withdrawal)
+        inst.count('schedule_days', contract_length_in_days)
+        with inst.stage('inventory_walk'):
+            check_daily_inventory(*daily_schedule, sorted_dates[0], storage_max_capacity)
+
+    else:
+        with inst.stage('inventory_walk'):
+            check_cumulative_inventory(sorted_volumes, storage_max_capacity)
+
+        # Contract length is necessary later so will also need to be defined in the else: condition it is in.
+        contract_length_in_days = ((sorted_dates[-1] - sorted_dates[0]).days +
+                                   (abs(sorted_volumes[-1]) / rate_of_injection_or_withdrawal))
+
+    # Prices $/MMBtu for this pricing model used, for every date of client action, looked up on the forward curve
+    # instead of asking the pricing model one date at a time.
+    with inst.stage('pricing'):
+        if forward_curve is None:
+            forward_curve = fc.load_forward_curve()
+        prices_at_dates = forward_curve.prices_at(np.array(sorted_dates, dtype='datetime64[D]')).tolist()
+        # The cost or earnings of the client, whether injecting or withdrawing. Since price from model is $ per MMBtu.
+        total_prices = [price_at_date * volume for price_at_date, volume in zip(prices_at_dates, sorted_volumes)]
+
+        # Total earnings of client pre extra cost inclusion.
+        final_difference_in_price = round(mt.fsum(total_prices) * -1, 2)
+
+    with inst.stage('storage_cost'):
+        # Used for part of the storage costs.
+        total_handled_natural_gas_by_facility = mt.fsum(injected_natural_gas_volumes + withdrawn_natural_gas_volumes)
+        storage_cost = contract_storage_cost(contract_months(sorted_dates[0], sorted_dates[-1]),
+                                             total_handled_natural_gas_by_facility, len(sorted_volumes),
+                                             storage_facility_usage_cost, injection_withdrawal_cost, cost_of_transport)
+
+    return {
+        'sorted_dates': sorted_dates,
+        'sorted_volumes': sorted_volumes,
+        'prices_at_dates': prices_at_dates,
+        'total_prices': total_prices,
+        'final_difference_in_price': final_difference_in_price,
+        'storage_cost': storage_cost,
+        # Final contract valuation based on values calculated above.
+        'contract_valuation': round(final_difference_in_price - storage_cost, 2),
+        'contract_length_in_days': contract_length_in_days,
+        'contract_start': sorted_dates[0],
+        'contract_end': sorted_dates[0] + timedelta(days=contract_length_in_days),
+    }
+
+
+def print_contract_valuation(valuation, injection_dates, withdrawal_dates):
+    # Preamble, intro to program for user.
+    print('Welcome to this contract valuation program for clients interested in the market for natural gas. Below will '
+          'be the necessary information.\n')
+
+    for date, volume, price_at_date, total_price_of_volume in zip(valuation['sorted_dates'],
+                                                                  valuation['sorted_volumes'],
+                                                                  valuation['prices_at_dates'],
+                                                                  valuation['total_prices']):
+        # Formatting the price data into a readable way for the user to understand the cost and earnings of the client.
+        original_date_format = date.strftime(DATE_FORMAT)
+        if original_date_format in injection_dates and volume > 0:  # Two conditions in case date occurs in both
+            # injections and withdrawals dates list.
+            print(f'The total price (amount client pays) of natural gas when INJECTING on the {original_date_format} '
+                  f'is: {str(round(total_price_of_volume, 2)).strip("-")}$ ({round(price_at_date, 2)}$ per MMBtu).')
+        elif original_date_format in withdrawal_dates and volume < 0:  # Same reasoning as above for two conditions.
+            print(f'The total price (amount client earns) of natural gas when WITHDRAWING on the '
+                  f'{original_date_format} is: {str(round(total_price_of_volume, 2)).strip("-")}$ '
+                  f'({round(price_at_date, 2)}$ per MMBtu).')
+
+    print(f'\nThe final price difference (total withdraw price - total injection price), i.e. the money earned by the '
+          f'client, is: {valuation["final_difference_in_price"]}$.')
+
+    # Final prints to show contract valuation and other information about the contract (length, start and end dates,
+    # etc...)
+    print(f'The total storage and logistics cost during the period of the contract is: '
+          f'{round(valuation["storage_cost"], 2)}$.')
+    print('---------------------------')
+    print(f'After careful valuation, the contract valuation with all extra costs taken into account is: '
+          f'{valuation["contract_valuation"]}$.')
+    print(f'This contract will span from the {valuation["contract_start"].strftime(DATE_FORMAT)} until the '
+          f'{valuation["contract_end"].strftime(DATE_FORMAT)} (contract ends when no gas is left in the storage).')
+    print('Note: This valuation is based on price predictions of natural gas from a pricing model.')
+
+
+if __name__ == '__main__':
+    try:
+        contract_valuation = value_contract(injection_dates, withdrawal_dates, injected_natural_gas_volumes,
+                                            withdrawn_natural_gas_volumes, rate_of_injection_or_withdrawal,
+                                            storage_max_capacity, storage_facility_usage_cost,
+                                            injection_withdrawal_cost, cost_of_transport)
+    except ContractValidationError as error:
+        print(error)
+        quit()
+
+    print_contract_valuation(contract_valuation, injection_dates, withdrawal_dates)
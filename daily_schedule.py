@@ -0,0 +1,141 @@
+"""
+Vectorised daily injection/withdrawal schedule for contracts with overlapping client actions.
+
+When client actions overlap, contract_pricing needs the volume moved on every day of the contract to follow the volume
+in the storage. The original loops (contract_pricing.build_daily_schedule_loops) build it one rate-sized chunk at a time
+and then walk every day in Python, which gets slow for long contracts with large volumes and low rates.
+
+Here injections and withdrawals are each modelled as a queue served at the daily rate: every client action adds its
+volume to the queue on its date, and every day the facility moves the daily rate or whatever is left in the queue. The
+cumulative volume moved up to day t is then
+
+    moved(t) = min over s <= t + 1 of (arrived(s - 1) + rate * (t - s + 1))
+
+i.e. a running minimum over cumulative sums, which NumPy computes in a single pass. The 0/1 action days are the same
+queue with a rate of one day per day, each client action adding the number of days it needs. This gives exactly the
+same schedules as the loops (see test_daily_schedule.py) in time linear in the contract length.
+"""
+
+# All imported and files/scripts libraries here.
+import numpy as np
+
+
+def rate_limited_queue(arrived_volumes_per_day, rate, queue=None, first_changed_day=0):
+    # The state of a queue served at the given daily rate, as a dictionary of arrays: 'arrived_before_day' (volume
+    # arrived before every day), 'lowest_backlog_start' (its running minimum, see above) and 'volumes_moved' (cumulative
+    # volume moved up to and including every day). Given the queue of the same days before some arrivals changed, only
+    # the days from first_changed_day onwards are recomputed, giving exactly the same arrays as starting over.
+    number_of_days = len(arrived_volumes_per_day)
+    day_numbers = np.arange(number_of_days + 1)
+    if queue is None:
+        queue = {'arrived_before_day': np.zeros(number_of_days + 1),
+                 'lowest_backlog_start': np.zeros(number_of_days + 1),
+                 'volumes_moved': np.zeros(number_of_days)}
+        first_changed_day = 0
+    day = first_changed_day
+
+    # Volume arrived before day s minus the volume the facility could have moved from day 0 until day s.
+    queue['arrived_before_day'][day + 1:] = np.cumsum(np.concatenate(([queue['arrived_before_day'][day]],
+                                                                      arrived_volumes_per_day[day:])))[1:]
+    backlog_start = queue['arrived_before_day'][day + 1:] - rate * day_numbers[day + 1:]
+    queue['lowest_backlog_start'][day + 1:] = np.minimum.accumulate(np.concatenate((
+        [queue['lowest_backlog_start'][day]], backlog_start)))[1:]
+    queue['volumes_moved'][day:] = rate * day_numbers[day + 1:] + queue['lowest_backlog_start'][day + 1:]
+    return queue
+
+
+def rate_limited_cumulative_volumes(arrived_volumes_per_day, rate):
+    # Cumulative volume moved up to and including every day, for a queue served at the given daily rate.
+    return rate_limited_queue(arrived_volumes_per_day, rate)['volumes_moved']
+
+
+def action_arrivals(action_days, action_volumes, contract_length_in_days, rate_of_injection_or_withdrawal):
+    # Volume and number of action days arriving on every day of the contract for one type of client action.
+    action_days = np.asarray(action_days, dtype=np.int64)
+    action_volumes = np.abs(np.asarray(action_volumes, dtype=float))
+    # Actions starting after the contract length can never be moved within the contract, like in the loops.
+    in_contract = (action_days >= 0) & (action_days < contract_length_in_days)
+    action_days = action_days[in_contract]
+    action_volumes = action_volumes[in_contract]
+
+    arrived_volumes_per_day = np.bincount(action_days, weights=action_volumes, minlength=contract_length_in_days)
+    # np.ceil in case of decimal, so there are no underestimations of the time taken to move the total volume.
+    days_needed = np.ceil(action_volumes / rate_of_injection_or_withdrawal)
+    arrived_days_per_day = np.bincount(action_days, weights=days_needed, minlength=contract_length_in_days)
+    return arrived_volumes_per_day, arrived_days_per_day
+
+
+def queue_end_day(action_days, action_volumes, rate_of_injection_or_withdrawal):
+    # The number of days from day 0 until the volume queue of one type of client action is empty, i.e. the shortest
+    # contract length in which all of its volume is moved. From the day of any action j on, the facility still has to
+    # move the volume of j and of every later action at the daily rate, so the queue ends at the latest of
+    # (day of j + ceil(volume arriving from that day on / rate)).
+    action_days = np.asarray(action_days, dtype=np.int64)
+    action_volumes = np.abs(np.asarray(action_volumes, dtype=float))
+    action_days, action_volumes = action_days[action_volumes > 0], action_volumes[action_volumes > 0]
+    if len(action_days) == 0:
+        return 0
+    order = np.argsort(action_days, kind='stable')
+    action_days, action_volumes = action_days[order], action_volumes[order]
+    volume_from_day = np.cumsum(action_volumes[::-1])[::-1]
+    return int(np.max(action_days + np.ceil(volume_from_day / rate_of_injection_or_withdrawal)))
+
+
+def rate_limited_actions(action_days, action_volumes, contract_length_in_days, rate_of_injection_or_withdrawal):
+    # The 0s and 1s (1 being an action occurring on that day) and the volume moved per day for one type of client
+    # action (injections or withdrawals). action_days are the days since the start of the contract. Raises ValueError
+    # if the contract is too short for all the volume to be moved, instead of leaving some of it out.
+    if queue_end_day(action_days, action_volumes, rate_of_injection_or_withdrawal) > contract_length_in_days:
+        raise ValueError(f'A contract length of {contract_length_in_days} days is too short to move every client '
+                         f'action volume at the daily rate of {rate_of_injection_or_withdrawal}.')
+    arrived_volumes_per_day, arrived_days_per_day = action_arrivals(action_days, action_volumes,
+                                                                    contract_length_in_days,
+                                                                    rate_of_injection_or_withdrawal)
+    volumes_moved = rate_limited_cumulative_volumes(arrived_volumes_per_day, rate_of_injection_or_withdrawal)
+    action_volumes_per_day = np.diff(volumes_moved, prepend=0.)
+    actions = np.diff(rate_limited_cumulative_volumes(arrived_days_per_day, 1), prepend=0.)
+    return actions, action_volumes_per_day
+
+
+def build_daily_schedule(injection_days, injection_volumes, withdrawal_days, withdrawal_volumes,
+                         contract_length_in_days, rate_of_injection_or_withdrawal):
+    # Same 4 arrays as contract_pricing.build_daily_schedule_loops: injections (0s and 1s), injection volumes per day,
+    # withdrawals (0s and 1s) and withdrawal volumes per day. The injection and withdrawal rates are mutually exclusive,
+    # so they are two separate queues.
+    injections, injection_volumes_per_day = rate_limited_actions(injection_days, injection_volumes,
+                                                                 contract_length_in_days,
+                                                                 rate_of_injection_or_withdrawal)
+    withdrawals, withdrawal_volumes_per_day = rate_limited_actions(withdrawal_days, withdrawal_volumes,
+                                                                   contract_length_in_days,
+                                                                   rate_of_injection_or_withdrawal)
+    return injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day
+
+
+def queued_actions(action_days, action_volumes, action_volumes_per_day):
+    # Number of client actions (sorted by day) arriving while volume of earlier ones is still being moved, or on the
+    # same day as an earlier one. These are the actions the loops add on top of busy days with add_into_larger_array.
+    action_days = np.asarray(action_days, dtype=np.int64)
+    in_contract = (action_days >= 0) & (action_days < len(action_volumes_per_day))
+    action_days = action_days[in_contract]
+    action_volumes = np.abs(np.asarray(action_volumes, dtype=float))[in_contract]
+    arrived_volumes_per_day = np.bincount(action_days, weights=action_volumes, minlength=len(action_volumes_per_day))
+    arrived_before_day = np.concatenate(([0.], np.cumsum(arrived_volumes_per_day)))
+    moved_before_day = np.concatenate(([0.], np.cumsum(action_volumes_per_day)))
+    backlog_before_action = arrived_before_day[action_days] - moved_before_day[action_days]
+    same_day_as_previous = np.concatenate(([False], action_days[1:] == action_days[:-1]))
+    return int(np.count_nonzero((backlog_before_action > 0) | same_day_as_previous))
+
+
+def daily_inventory(injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day):
+    # The volume in the storage at the end of every day of the contract. Volumes only count on days with an action.
+    return np.cumsum(injections * injection_volumes_per_day - withdrawals * withdrawal_volumes_per_day)
+
+
+def first_inventory_violation(inventory, storage_max_capacity):
+    # The first day the storage is over its maximum capacity or below empty, and which of the two ('overflow' or
+    # 'empty'). Returns (None, None) if the inventory stays within the limits for the entire contract.
+    violating_days = np.flatnonzero((inventory > storage_max_capacity) | (inventory < 0))
+    if len(violating_days) == 0:
+        return None, None
+    first_violating_day = int(violating_days[0])
+    return first_violating_day, 'overflow' if inventory[first_violating_day] > storage_max_capacity else 'empty'
@@ -0,0 +1,203 @@
+"""
+Facility-level capacity check: the combined inventory and daily flow of all contracts sharing one storage site.
+
+contract_pricing checks every contract on its own against storage_max_capacity and the daily rate, as if it had the
+facility to itself. Here the daily schedules of all contracts of a site are put on one timeline and the limits are
+checked on the totals:
+
+    - the combined inventory must stay within the facility's maximum capacity,
+    - the combined injections (and, separately, withdrawals) of a day must stay within the facility's daily rate, the
+      rates being mutually exclusive like in contract_pricing.
+
+Every contract's daily schedule is built once (daily_schedule, days counted from its first client action), then all
+contract days of a site are added together per calendar day with np.bincount and the combined inventory is a single
+cumulative sum. Every day breaking a limit is reported with the contracts contributing to it on that day (holding gas
+for the capacity, injecting or withdrawing for the rates), found with one sort of the contract days on the violating
+days, so years of days across thousands of contracts are checked in one pass without stopping at the first problem.
+
+Contracts are grouped by an optional 'site' column of the contract table (one site for the whole table without it).
+Contracts that can not be scheduled on their own (unreadable, unbalanced, or withdrawing gas they do not have) are left
+out and listed with their error.
+
+Usage: python facility_capacity.py contracts.csv [--capacity N] [--rate N] [--output violations.csv]
+"""
+
+# All imported and files/scripts libraries here.
+import argparse
+import csv
+import numpy as np
+import contract_pricing as cp
+import daily_schedule as ds
+import portfolio_valuation as pv
+
+VIOLATION_COLUMNS = ('site', 'date', 'violation', 'volume', 'limit', 'contract_ids', 'message')
+
+
+def facility_violation_message(violation, date, volume, limit, number_of_contracts):
+    # The text shown for one violating day.
+    volume = pv.format_volume(round(float(volume), 2))
+    limit = pv.format_volume(limit)
+    if violation == 'capacity':
+        return (f'On the {date} (dd/mm/yy) the {number_of_contracts} contracts in the storage hold {volume} MMBtu '
+                f'together, more than the facility maximum capacity of {limit} MMBtu.')
+    action = 'inject' if violation == 'injection_rate' else 'withdraw'
+    return (f'On the {date} (dd/mm/yy) {number_of_contracts} contracts {action} {volume} MMBtu together, more than the '
+            f'facility daily rate of {limit} MMBtu.')
+
+
+def site_limit(limit, site):
+    # A facility limit given either once for every site or as a dictionary per site.
+    return limit[site] if isinstance(limit, dict) else limit
+
+
+def schedule_site_contracts(events, contract_starts, contract_ends, contract_codes, rate, errors):
+    # Builds the daily schedule of every contract of a site. Returns the contract days one after the other as arrays:
+    # contract code, day since the first date of the site, inventory of the contract and the volume it injects and
+    # withdraws. Contracts withdrawing more gas than they hold get their error in errors and are left out, so do
+    # contracts whose schedule does not end empty, as their gas would stay on the site's inventory for good.
+    first_date = events['dates'][contract_starts[contract_codes]].min() if len(contract_codes) else None
+    contract_days = {'codes': [], 'days': [], 'inventory': [], 'injected': [], 'withdrawn': []}
+    for contract_code in contract_codes:
+        contract_slice = slice(contract_starts[contract_code], contract_ends[contract_code])
+        _, daily_schedule = pv.contract_daily_schedule(events, contract_slice, rate[contract_code])
+        injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day = daily_schedule
+        inventory = ds.daily_inventory(*daily_schedule)
+        delta_day, violation = ds.first_inventory_violation(inventory, np.inf)
+        if violation is not None:
+            contract_start = events['dates'][contract_slice][0]
+            errors[contract_code] = cp.storage_empty_message(
+                (contract_start + delta_day).astype(object).strftime(cp.DATE_FORMAT))
+            continue
+        if not np.isclose(inventory[-1], 0, atol=1e-6):
+            errors[contract_code] = cp.UNBALANCED_VOLUME_MESSAGE
+            continue
+        offset = (events['dates'][contract_slice][0] - first_date).astype(int)
+        contract_days['codes'].append(np.full(len(inventory), contract_code))
+        contract_days['days'].append(offset + np.arange(len(inventory)))
+        contract_days['inventory'].append(inventory)
+        contract_days['injected'].append(injections * injection_volumes_per_day)
+        contract_days['withdrawn'].append(withdrawals * withdrawal_volumes_per_day)
+    contract_days = {name: np.concatenate(arrays) if arrays else np.zeros(0, dtype=int if name in ('codes', 'days')
+                                                                           else float)
+                     for name, arrays in contract_days.items()}
+    return first_date, contract_days
+
+
+def contributing_contracts(violating_days, contract_days, contributions):
+    # For every violating day (sorted array of days), the codes of the contracts with a contribution above 0 on it.
+    # One pass: the contract days on violating days are sorted by day and split where the day changes.
+    is_violating_day = np.zeros(int(contract_days['days'].max()) + 1 if len(contract_days['days']) else 0, dtype=bool)
+    is_violating_day[violating_days] = True
+    selected = is_violating_day[contract_days['days']] & (contributions > 0)
+    days = contract_days['days'][selected]
+    codes = contract_days['codes'][selected]
+    order = np.lexsort((codes, days))
+    days, codes = days[order], codes[order]
+    split_positions = np.searchsorted(days, violating_days)
+    return np.split(codes, split_positions[1:])
+
+
+def check_facility_capacity(contracts, facility_max_capacity, facility_rate, rate_of_injection_or_withdrawal=None):
+    # Checks the combined inventory and daily flow of the contracts of a contract table (see
+    # portfolio_valuation.CONTRACT_COLUMNS, plus an optional 'site' column) per site. facility_max_capacity and
+    # facility_rate are the limits of the facility, either the same for every site or a dictionary per site.
+    # rate_of_injection_or_withdrawal is the rate each contract's own schedule is built with, unless the table has it.
+    # Returns one report per site: a dictionary with the combined daily timeline ('start_date', 'inventory',
+    # 'injection_volumes_per_day', 'withdrawal_volumes_per_day'), every violating day ('violations', dictionaries
+    # with the VIOLATION_COLUMNS) and the contracts left out ('excluded_contracts', contract_id: error).
+    columns = pv.contract_table_columns(contracts)
+    contract_ids, events, contract_starts, errors = pv.sort_portfolio_events(columns)
+    if len(contract_ids) == 0:
+        return []  # A table without rows has no site to report on.
+    first_event_rows = events['rows'][contract_starts]
+    rate = pv.contract_parameters(columns, first_event_rows,
+                                  {'rate_of_injection_or_withdrawal': rate_of_injection_or_withdrawal},
+                                  names=('rate_of_injection_or_withdrawal',))
+    pv.check_contract_parameters(rate, errors)
+    rate = rate['rate_of_injection_or_withdrawal']
+    contract_ends = np.r_[contract_starts[1:], len(events['contract_codes'])]
+    unbalanced = (np.add.reduceat(events['volumes'], contract_starts) != 0) & (errors == '')
+    errors[unbalanced] = cp.UNBALANCED_VOLUME_MESSAGE
+    sites = (columns['site'][first_event_rows].astype(str) if 'site' in columns
+             else np.full(len(contract_ids), '', dtype=str))
+
+    reports = []
+    for site in np.unique(sites).tolist():
+        site_contracts = np.flatnonzero((sites == site) & (errors == ''))
+        first_date, contract_days = schedule_site_contracts(events, contract_starts, contract_ends, site_contracts,
+                                                            rate, errors)
+        number_of_days = int(contract_days['days'].max()) + 1 if len(contract_days['days']) else 0
+        # The combined timeline of the site, every contract's days added to their calendar day.
+        net_volumes_per_day = np.bincount(contract_days['days'], weights=contract_days['injected'] -
+                                          contract_days['withdrawn'], minlength=number_of_days)
+        timeline = {
+            'inventory': np.cumsum(net_volumes_per_day),
+            'injection_volumes_per_day': np.bincount(contract_days['days'], weights=contract_days['injected'],
+                                                     minlength=number_of_days),
+            'withdrawal_volumes_per_day': np.bincount(contract_days['days'], weights=contract_days['withdrawn'],
+                                                      minlength=number_of_days),
+        }
+
+        # Every contract's own inventory stays at or above 0, so the combined one can only break the maximum.
+        checks = (('capacity', timeline['inventory'], site_limit(facility_max_capacity, site),
+                   contract_days['inventory']),
+                  ('injection_rate', timeline['injection_volumes_per_day'], site_limit(facility_rate, site),
+                   contract_days['injected']),
+                  ('withdrawal_rate', timeline['withdrawal_volumes_per_day'], site_limit(facility_rate, site),
+                   contract_days['withdrawn']))
+        violations = []
+        for violation, combined_volumes, limit, contributions in checks:
+            violating_days = np.flatnonzero(combined_volumes > limit)
+            for day, codes in zip(violating_days.tolist(),
+                                  contributing_contracts(violating_days, contract_days, contributions)):
+                date = (first_date + day).astype(object).strftime(cp.DATE_FORMAT)
+                violations.append({
+                    'site': site, 'date': date, 'violation': violation, 'volume': float(combined_volumes[day]),
+                    'limit': limit, 'contract_ids': contract_ids[codes].tolist(),
+                    'message': facility_violation_message(violation, date, combined_volumes[day], limit, len(codes)),
+                    'day': day,
+                })
+        violations.sort(key=lambda record: record.pop('day'))  # In date order, stable so the checks keep their order.
+
+        site_codes = np.flatnonzero(sites == site)
+        reports.append({
+            'site': site,
+            'start_date': first_date,
+            **timeline,
+            'violations': violations,
+            'excluded_contracts': {contract_ids[code]: errors[code] for code in site_codes if errors[code] != ''},
+        })
+    return reports
+
+
+def write_facility_violations(reports, path):
+    # Writes the violating days of every site to a CSV file, the contract ids separated by ';'.
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(VIOLATION_COLUMNS)
+        for report in reports:
+            for violation in report['violations']:
+                writer.writerow([';'.join(violation[name]) if name == 'contract_ids' else violation[name]
+                                 for name in VIOLATION_COLUMNS])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks the combined inventory and daily flow of a storage site.')
+    parser.add_argument('contracts', help='contract table (.csv, .parquet or .npy), optionally with a site column')
+    parser.add_argument('--capacity', type=float, default=cp.storage_max_capacity, help='facility maximum capacity')
+    parser.add_argument('--rate', type=float, default=cp.rate_of_injection_or_withdrawal, help='facility daily rate')
+    parser.add_argument('--output', default=None, help='CSV file for the violating days')
+    arguments = parser.parse_args()
+
+    facility_reports = check_facility_capacity(pv.load_contract_table(arguments.contracts), arguments.capacity,
+                                               arguments.rate,
+                                               rate_of_injection_or_withdrawal=cp.rate_of_injection_or_withdrawal)
+    for facility_report in facility_reports:
+        site_name = facility_report['site'] or 'the facility'
+        print(f'{site_name}: {len(facility_report["violations"])} violating days, peak inventory '
+              f'{pv.format_volume(round(float(facility_report["inventory"].max(initial=0)), 2))} MMBtu, '
+              f'{len(facility_report["excluded_contracts"])} contracts left out.')
+        for facility_violation in facility_report['violations']:
+            print(f'  {facility_violation["message"]} Contracts: {", ".join(facility_violation["contract_ids"])}')
+    if arguments.output:
+        write_facility_violations(facility_reports, arguments.output)
@@ -0,0 +1,190 @@
+"""
+Precomputed forward curve of the pricing model, looked up by date.
+
+Instead of asking the pricing model (price_predict.price_prediction) for every client action one date at a time, the
+model is evaluated once for every day of a daily grid and the prices are kept in one contiguous NumPy array. Looking up
+the prices of any number of dates is then an array index. The grid grows by itself (and only computes the new days)
+when dates outside of it are asked for.
+
+Several curves (e.g. different versions of the pricing model) can be loaded at once: load_forward_curve keeps the most
+recently used ones in memory and drops the least recently used one past MAX_LOADED_CURVES. Curves can also be saved to
+a cache directory so a restarted program does not need to evaluate the pricing model again. Both are keyed on the name
+and version of the curve and on the pricing model function itself (its module and name), so a curve is never handed
+back for another pricing model given the same name and version.
+"""
+
+# All imported and files/scripts libraries here.
+from collections import OrderedDict
+import os
+import re
+import numpy as np
+import instrumentation as inst
+
+# January 1st 2020 has date_month_index 0 in the pricing model, the grid starts there unless earlier dates are needed.
+CURVE_START_DATE = np.datetime64('2020-01-01', 'D')
+# Number of days the grid covers when first made, about 10 years.
+DEFAULT_HORIZON_DAYS = 3653
+# Number of forward curves kept in memory by load_forward_curve before the least recently used one is dropped.
+MAX_LOADED_CURVES = 4
+# The pricing model load_forward_curve uses when none is given, price_predict.price_prediction.
+DEFAULT_PRICE_MODEL = 'price_predict.price_prediction'
+
+_loaded_curves = OrderedDict()
+
+
+def date_month_indices(dates):
+    # Same month index as contract_pricing.date_month_index (the 'x' variable of the pricing model), for a whole array
+    # of datetime64[D] dates at once. January 1st 2020 has date_month_index 0. The terms are added in the same order as
+    # the single date version so both give exactly the same floats.
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    date_day = (dates - months.astype('datetime64[D]')).astype(int) + 1
+    days_in_month = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(int)
+    date_year = dates.astype('datetime64[Y]').astype(int) + 1970
+    date_month = (months - dates.astype('datetime64[Y]').astype('datetime64[M]')).astype(int) + 1
+    return (date_day / days_in_month) + (date_year - 2020) * 12 + (date_month - 1)
+
+
+def price_model_identity(price_model):
+    # Module and name of a pricing model function (e.g. 'price_predict.price_prediction'), None without a model. For a
+    # callable object, the name of its class.
+    if price_model is None:
+        return None
+    qualified_name = getattr(price_model, '__qualname__', type(price_model).__qualname__)
+    return f'{getattr(price_model, "__module__", type(price_model).__module__)}.{qualified_name}'
+
+
+def evaluate_price_model(price_model, month_indices):
+    # Prices $/MMBtu of the pricing model for every month index. The pricing model takes one month index at a time.
+    inst.count('pricing_model_calls', len(month_indices))
+    return np.array([price_model(month_index) for month_index in month_indices.tolist()], dtype=float)
+
+
+class ForwardCurve:
+    # Daily prices of one pricing model on a grid of consecutive days starting at start_date.
+
+    def __init__(self, price_model, name='price_predict', model_version='default', cache_directory=None,
+                 start_date=CURVE_START_DATE, horizon_days=DEFAULT_HORIZON_DAYS, prices=None):
+        self.price_model = price_model
+        self.model_identity = price_model_identity(price_model)
+        self.name = name
+        self.model_version = model_version
+        self.cache_directory = cache_directory
+        self.start_date = np.datetime64(start_date, 'D')
+        self.prices = np.zeros(0) if prices is None else np.ascontiguousarray(prices, dtype=float)
+
+        if prices is None and not self.load():
+            self.ensure_horizon(self.start_date, self.start_date + horizon_days - 1)
+
+    @property
+    def end_date(self):
+        # Last day of the grid.
+        return self.start_date + len(self.prices) - 1
+
+    @property
+    def cache_path(self):
+        if self.cache_directory is None:
+            return None
+        file_name = f'{self.name}_{self.model_version}'
+        if self.model_identity is not None:
+            # Names of functions defined inside other functions have '<locals>' in them, not usable in a file name.
+            file_name += '_' + re.sub(r'[^\w.-]', '_', self.model_identity)
+        return os.path.join(self.cache_directory, file_name + '.npz')
+
+    def ensure_horizon(self, first_date, last_date):
+        # Grows the grid so it covers first_date until last_date, only evaluating the pricing model on the new days.
+        # The grid at least doubles every time it grows, so asking for one more day at a time stays cheap.
+        first_date = np.datetime64(first_date, 'D')
+        last_date = np.datetime64(last_date, 'D')
+        if len(self.prices) and first_date >= self.start_date and last_date <= self.end_date:
+            return
+        if self.price_model is None:
+            raise ValueError(f'The forward curve {self.name} ({self.model_version}) covers {self.start_date} until '
+                             f'{self.end_date} and has no pricing model to extend it to {first_date} until '
+                             f'{last_date}.')
+
+        if not len(self.prices):
+            new_start_date, new_end_date = first_date, last_date
+        else:
+            grid_length = len(self.prices)
+            new_start_date = min(first_date, self.start_date - grid_length) if first_date < self.start_date \
+                else self.start_date
+            new_end_date = max(last_date, self.end_date + grid_length) if last_date > self.end_date else self.end_date
+
+        earlier_prices = np.zeros(0)
+        later_prices = np.zeros(0)
+        if not len(self.prices):
+            later_prices = self.evaluate(new_start_date, new_end_date)
+        else:
+            if new_start_date < self.start_date:
+                earlier_prices = self.evaluate(new_start_date, self.start_date - 1)
+            if new_end_date > self.end_date:
+                later_prices = self.evaluate(self.end_date + 1, new_end_date)
+        self.prices = np.ascontiguousarray(np.concatenate((earlier_prices, self.prices, later_prices)))
+        self.start_date = new_start_date
+        self.save()
+
+    def evaluate(self, first_date, last_date):
+        # Pricing model prices for every day from first_date until last_date (both included).
+        dates = np.arange(first_date, last_date + 1, dtype='datetime64[D]')
+        return evaluate_price_model(self.price_model, date_month_indices(dates))
+
+    def prices_at(self, dates):
+        # Prices $/MMBtu at every date of an array of dates (datetime64, or anything NumPy can turn into it).
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        inst.count('price_lookups', dates.size)
+        if dates.size:
+            self.ensure_horizon(dates.min(), dates.max())
+        return self.prices[(dates - self.start_date).astype(np.int64)]
+
+    def price_at(self, date):
+        # Price $/MMBtu at a single date.
+        return float(self.prices_at(np.array([date], dtype='datetime64[D]'))[0])
+
+    def save(self):
+        # Stores the grid in the cache directory, if there is one, for the next time this curve is loaded.
+        if self.cache_path is None:
+            return
+        os.makedirs(self.cache_directory, exist_ok=True)
+        temporary_path = self.cache_path + '.tmp.npz'
+        np.savez(temporary_path, start_date=self.start_date, prices=self.prices)
+        os.replace(temporary_path, self.cache_path)  # So a crash never leaves half a file behind.
+
+    def load(self):
+        # Reads the grid back from the cache directory. Returns False if there is nothing saved for this curve yet.
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return False
+        with np.load(self.cache_path) as saved_curve:
+            self.start_date = saved_curve['start_date'].astype('datetime64[D]')[()]
+            self.prices = np.ascontiguousarray(saved_curve['prices'], dtype=float)
+        return True
+
+
+def load_forward_curve(price_model=None, name='price_predict', model_version='default', cache_directory=None):
+    # The forward curve of a pricing model, made only once and then kept in memory. When more than MAX_LOADED_CURVES
+    # are loaded the least recently used one is dropped. Without a price_model, the price_predict model is used.
+    # Raises ValueError if another pricing model with the same module and name was already loaded under this name and
+    # version (e.g. a refitted model made by the same function), it needs its own model_version.
+    model_identity = DEFAULT_PRICE_MODEL if price_model is None else price_model_identity(price_model)
+    key = (name, model_version, model_identity)
+    if key in _loaded_curves:
+        curve = _loaded_curves[key]
+        if price_model is not None and curve.price_model is not price_model:
+            raise ValueError(f'Another {model_identity} pricing model is already loaded as the forward curve {name} '
+                             f'({model_version}), give this one a different model_version.')
+        _loaded_curves.move_to_end(key)
+        return curve
+
+    if price_model is None:
+        import price_predict as pp
+        price_model = pp.price_prediction
+    curve = ForwardCurve(price_model, name=name, model_version=model_version, cache_directory=cache_directory)
+    _loaded_curves[key] = curve
+    while len(_loaded_curves) > MAX_LOADED_CURVES:
+        _loaded_curves.popitem(last=False)
+    return curve
+
+
+def clear_loaded_curves():
+    # Drops every forward curve kept in memory, e.g. after the pricing model has been refitted.
+    _loaded_curves.clear()
@@ -0,0 +1,268 @@
+"""
+Optional stage timing, counters and profiling of valuation runs.
+
+The valuation code marks its stages (with stage('inventory_walk'): ...) and counts what it does (count('schedule_days',
+n)). Nothing is recorded unless recording was started, in which case every stage adds up its number of calls, wall
+time and CPU time, and every counter its total. When recording is off stage() hands back one shared do-nothing context
+manager and count() returns straight away, so the marks can stay in the code (and the recording can stay on in
+production, it only costs two clock reads and a lock per stage). The totals are updated under a lock, so the threads of
+valuation_service can record at the same time. Worker processes record their own totals and hand them back with their
+results (see parallel_valuation), which add_totals() adds to the recording of the main process.
+
+Recording is started with record_run() around the code to measure, or for a whole program by setting the environment
+variable CONTRACT_VALUATION_INSTRUMENTATION to a file path ('-' for stderr): the report is appended there on exit. The
+report is JSON lines, one line per stage, one line with the counters and one line for the whole run:
+
+    {"record": "stage", "label": "", "stage": "inventory_walk", "calls": 3, "wall_seconds": 0.01, "cpu_seconds": 0.01}
+
+profile_contract runs cProfile and tracemalloc over the valuation of a single contract, for a closer look at one slow
+contract.
+"""
+
+# All imported and files/scripts libraries here.
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+INSTRUMENTATION_VARIABLE = 'CONTRACT_VALUATION_INSTRUMENTATION'
+# Number of functions (cProfile) and allocation sites (tracemalloc) kept by profile_contract.
+PROFILE_TOP_ENTRIES = 20
+
+_NOT_RECORDING = nullcontext()
+_recorder = None
+
+
+class StageTimer:
+    # Adds the wall and CPU time of one run of a stage to its recorder.
+
+    def __init__(self, totals, lock):
+        self.totals = totals
+        self.lock = lock
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *exception):
+        wall_seconds = time.perf_counter() - self.wall_start
+        cpu_seconds = time.process_time() - self.cpu_start
+        with self.lock:
+            totals = self.totals
+            totals[0] += 1
+            totals[1] += wall_seconds
+            totals[2] += cpu_seconds
+        return False
+
+
+class StageRecorder:
+    # The stage totals ([calls, wall seconds, CPU seconds] per stage) and counters of one recorded run.
+
+    def __init__(self, label=''):
+        self.label = label
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.wall_seconds = None
+        self.cpu_seconds = None
+
+    def stage(self, name):
+        totals = self.stages.get(name)
+        if totals is None:
+            with self.lock:
+                totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+        return StageTimer(totals, self.lock)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def totals(self):
+        # The stage totals and counters recorded so far, as plain dictionaries that can be sent between processes.
+        with self.lock:
+            return {'stages': {name: list(totals) for name, totals in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+    def add_totals(self, totals):
+        # Adds the stage totals and counters of another recorder (see totals()), e.g. of a worker process.
+        with self.lock:
+            for name, (calls, wall_seconds, cpu_seconds) in totals['stages'].items():
+                stage_totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+                stage_totals[0] += calls
+                stage_totals[1] += wall_seconds
+                stage_totals[2] += cpu_seconds
+            for name, amount in totals['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self.wall_start
+        self.cpu_seconds = time.process_time() - self.cpu_start
+
+    def records(self):
+        # The report as a list of dictionaries, one per JSON line.
+        records = [{'record': 'stage', 'label': self.label, 'stage': name, 'calls': calls,
+                    'wall_seconds': round(wall_seconds, 6), 'cpu_seconds': round(cpu_seconds, 6)}
+                   for name, (calls, wall_seconds, cpu_seconds) in self.stages.items()]
+        records.append({'record': 'counters', 'label': self.label, **self.counters})
+        records.append({'record': 'run', 'label': self.label, 'started': self.started,
+                        'wall_seconds': None if self.wall_seconds is None else round(self.wall_seconds, 6),
+                        'cpu_seconds': None if self.cpu_seconds is None else round(self.cpu_seconds, 6)})
+        return records
+
+    def write(self, output):
+        # Appends the report to output (see write_json_lines).
+        write_json_lines(self.records(), output)
+
+
+def write_json_lines(records, output):
+    # Appends records (dictionaries) as JSON lines to output, a file path ('-' for stderr) or an open text stream.
+    lines = ''.join(json.dumps(record) + '\n' for record in records)
+    if output == '-':
+        sys.stderr.write(lines)
+    elif isinstance(output, str):
+        with open(output, 'a') as report_file:
+            report_file.write(lines)
+    else:
+        output.write(lines)
+
+
+def stage(name):
+    # Context manager timing one run of a stage, doing nothing when not recording.
+    if _recorder is None:
+        return _NOT_RECORDING
+    return _recorder.stage(name)
+
+
+def count(name, amount=1):
+    # Adds amount to a counter when recording.
+    if _recorder is not None:
+        _recorder.count(name, amount)
+
+
+def add_totals(totals):
+    # Adds the stage totals and counters recorded elsewhere (StageRecorder.totals()) when recording, None is ignored.
+    if _recorder is not None and totals is not None:
+        _recorder.add_totals(totals)
+
+
+def recording():
+    # True while recording, for counters that take some work to compute.
+    return _recorder is not None
+
+
+def start_recording(label=''):
+    # Starts recording every stage and counter from now on. Returns the recorder.
+    global _recorder
+    _recorder = StageRecorder(label)
+    return _recorder
+
+
+def stop_recording():
+    # Stops recording. Returns the recorder of the run that was recorded (None if there was none).
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.stop()
+    return recorder
+
+
+@contextmanager
+def record_run(label='', output=None):
+    # Records the stages and counters of the code inside the with block, writes the report to output (see
+    # StageRecorder.write) at the end if given. Yields the recorder. A run that was already being recorded (e.g. the
+    # whole program) is paused meanwhile and carries on afterwards.
+    global _recorder
+    previous_recorder = _recorder
+    recorder = start_recording(label)
+    try:
+        yield recorder
+    finally:
+        stop_recording()
+        _recorder = previous_recorder
+        if output is not None:
+            recorder.write(output)
+
+
+def profile_contract(injection_dates, withdrawal_dates, injected_natural_gas_volumes, withdrawn_natural_gas_volumes,
+                     rate_of_injection_or_withdrawal, storage_max_capacity, storage_facility_usage_cost,
+                     injection_withdrawal_cost, cost_of_transport, forward_curve=None, trace_memory=True,
+                     top_entries=PROFILE_TOP_ENTRIES, output=None):
+    # Values one contract (same inputs as contract_pricing.value_contract) under cProfile, and tracemalloc if
+    # trace_memory, with the stages recorded too. Returns a dictionary with the valuation (or the error), the stage
+    # report, the functions with the most cumulative time and, with trace_memory, the peak memory and the largest
+    # allocation sites. The same dictionary is appended to output as one JSON line if given.
+    import cProfile
+    import pstats
+    import tracemalloc
+    import contract_pricing as cp
+
+    profiler = cProfile.Profile()
+    if trace_memory:
+        tracemalloc.start()
+    error = ''
+    valuation = None
+    try:
+        with record_run('profile_contract') as recorder:
+            profiler.enable()
+            try:
+                valuation = cp.value_contract(injection_dates, withdrawal_dates, injected_natural_gas_volumes,
+                                              withdrawn_natural_gas_volumes, rate_of_injection_or_withdrawal,
+                                              storage_max_capacity, storage_facility_usage_cost,
+                                              injection_withdrawal_cost, cost_of_transport,
+                                              forward_curve=forward_curve)
+            except cp.ContractValidationError as validation_error:
+                error = str(validation_error)
+            finally:
+                profiler.disable()
+        if trace_memory:
+            memory_snapshot = tracemalloc.take_snapshot()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    profile_statistics = pstats.Stats(profiler)
+    functions = sorted(profile_statistics.stats.items(), key=lambda item: item[1][3], reverse=True)[:top_entries]
+    profile = {
+        'record': 'profile',
+        'contract_valuation': None if valuation is None else valuation['contract_valuation'],
+        'error': error,
+        'stages': recorder.records(),
+        'functions': [{'function': f'{file_name}:{line_number}({function_name})', 'calls': total_calls,
+                       'own_seconds': round(own_time, 6), 'cumulative_seconds': round(cumulative_time, 6)}
+                      for (file_name, line_number, function_name), (_, total_calls, own_time, cumulative_time, _)
+                      in functions],
+    }
+    if trace_memory:
+        profile['peak_memory_bytes'] = peak_memory
+        profile['allocations'] = [{'location': str(statistic.traceback), 'bytes': statistic.size,
+                                   'blocks': statistic.count}
+                                  for statistic in memory_snapshot.statistics('lineno')[:top_entries]]
+    if output is not None:
+        write_json_lines([profile], output)
+    return profile
+
+
+def record_from_environment():
+    # Records the whole program when CONTRACT_VALUATION_INSTRUMENTATION is set, the report is written on exit.
+    output = os.environ.get(INSTRUMENTATION_VARIABLE)
+    if not output or _recorder is not None:
+        return
+    recorder = start_recording(' '.join(sys.argv))
+
+    def write_report():
+        if _recorder is recorder:
+            stop_recording()
+        recorder.write(output)
+    atexit.register(write_report)
+
+
+record_from_environment()
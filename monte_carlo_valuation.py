@@ -0,0 +1,162 @@
+"""
+Monte Carlo valuation of a contract: a distribution of contract values instead of a single intrinsic value.
+
+contract_pricing values the client actions at one price per date, the forward curve of the pricing model. Here many
+possible price paths are simulated around that curve and the same (fixed) injection/withdrawal schedule is valued on
+every one of them. The log price follows a mean-reverting (Ornstein-Uhlenbeck) deviation from the forward curve, with
+a volatility that is higher in winter than in summer:
+
+    price(t) = forward(t) * exp(x(t) - variance(x(t)) / 2),    dx = -mean_reversion * x dt + volatility(t) dW
+
+so the average simulated price on every day is the forward price. The paths are made as (paths, days) NumPy matrices
+in blocks of block_size paths, each block is valued with one matrix product and only the contract values are kept, so
+100k paths over several years never need more memory than one block.
+"""
+
+# All imported and files/scripts libraries here.
+import sys
+import numpy as np
+import contract_pricing as cp
+import forward_curve as fc
+
+DAYS_PER_YEAR = 365.25
+# Default model parameters, per year.
+MEAN_REVERSION = 3.0
+VOLATILITY = 0.6
+# The volatility goes up and down by this fraction over the year, highest on SEASONAL_PEAK_DAY (day of the year).
+SEASONAL_AMPLITUDE = 0.3
+SEASONAL_PEAK_DAY = 15
+# Number of price paths simulated at once.
+BLOCK_SIZE = 5000
+# Percentiles of the contract value that are reported, and the tail used for the CVaR.
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+CVAR_LEVEL = 0.05
+
+
+def seasonal_volatility(dates, volatility=VOLATILITY, seasonal_amplitude=SEASONAL_AMPLITUDE,
+                        seasonal_peak_day=SEASONAL_PEAK_DAY):
+    # Yearly volatility on every date, following a cosine over the year that peaks on seasonal_peak_day.
+    day_of_year = (dates - dates.astype('datetime64[Y]').astype('datetime64[D]')).astype(int)
+    return volatility * (1 + seasonal_amplitude * np.cos(2 * np.pi * (day_of_year - seasonal_peak_day) / DAYS_PER_YEAR))
+
+
+def simulate_price_paths(forward_prices, daily_volatility, number_of_paths, mean_reversion=MEAN_REVERSION,
+                         block_size=BLOCK_SIZE, seed=None):
+    # Yields (paths, days) matrices of simulated daily prices, block_size paths at a time, for the days of
+    # forward_prices (the first day is today, its price is known). daily_volatility is the yearly volatility on every
+    # day. The same seed and block_size always give the same paths.
+    number_of_days = len(forward_prices)
+    time_step = 1 / DAYS_PER_YEAR
+    decay = np.exp(-mean_reversion * time_step)
+    # Exact standard deviation of one day of Ornstein-Uhlenbeck noise.
+    step_scale = np.sqrt((1 - decay ** 2) / (2 * mean_reversion)) if mean_reversion > 0 else np.sqrt(time_step)
+    step_volatility = daily_volatility * step_scale
+
+    # The variance of x on every day, to take it back out of the exponent so the mean price stays the forward price.
+    variance = np.zeros(number_of_days)
+    for day in range(1, number_of_days):
+        variance[day] = variance[day - 1] * decay ** 2 + step_volatility[day] ** 2
+    drift_correction = np.exp(-variance / 2) * forward_prices
+
+    number_of_blocks = -(-number_of_paths // block_size)
+    for block_number, block_seed in enumerate(np.random.SeedSequence(seed).spawn(number_of_blocks)):
+        random_generator = np.random.default_rng(block_seed)
+        paths_in_block = min(block_size, number_of_paths - block_number * block_size)
+        # Made as (days, paths) so every day is one contiguous row, the shocks are turned into the deviations, then the
+        # prices, in place to only ever hold one matrix per block.
+        price_paths = random_generator.standard_normal((number_of_days, paths_in_block))
+        price_paths[0] = 0
+        for day in range(1, number_of_days):
+            price_paths[day] *= step_volatility[day]
+            price_paths[day] += price_paths[day - 1] * decay
+        np.exp(price_paths, out=price_paths)
+        price_paths *= drift_correction[:, None]
+        yield price_paths.T
+
+
+def summarise_contract_values(contract_values, percentiles=PERCENTILES, cvar_level=CVAR_LEVEL):
+    # Mean, standard deviation, percentiles and CVaR (average of the worst cvar_level share of the values).
+    sorted_values = np.sort(contract_values)
+    tail_size = max(1, int(np.ceil(cvar_level * len(sorted_values))))
+    return {
+        'number_of_paths': len(sorted_values),
+        'mean': round(float(np.mean(sorted_values)), 2),
+        'standard_deviation': round(float(np.std(sorted_values)), 2),
+        'percentiles': {percentile: round(float(value), 2) for percentile, value in
+                        zip(percentiles, np.percentile(sorted_values, percentiles))},
+        'cvar_level': cvar_level,
+        'cvar': round(float(np.mean(sorted_values[:tail_size])), 2),
+    }
+
+
+def simulate_contract_values(sorted_dates, sorted_volumes, storage_cost, number_of_paths, forward_curve=None,
+                             mean_reversion=MEAN_REVERSION, volatility=VOLATILITY,
+                             seasonal_amplitude=SEASONAL_AMPLITUDE, block_size=BLOCK_SIZE, seed=None):
+    # Values the fixed schedule (dates and signed volumes of contract_pricing.value_contract) on number_of_paths price
+    # paths starting at the first date. Returns the contract value of every path.
+    if forward_curve is None:
+        forward_curve = fc.load_forward_curve()
+    action_dates = np.array(sorted_dates, dtype='datetime64[D]')
+    simulated_days = np.arange(action_dates[0], action_dates[-1] + 1, dtype='datetime64[D]')
+    forward_prices = forward_curve.prices_at(simulated_days)
+    daily_volatility = seasonal_volatility(simulated_days, volatility, seasonal_amplitude)
+    action_days = (action_dates - action_dates[0]).astype(int)
+
+    # Client actions on the same day are added together, so every block is valued with one matrix product.
+    volume_per_day = np.bincount(action_days, weights=np.asarray(sorted_volumes, dtype=float),
+                                 minlength=len(simulated_days))
+    contract_values = np.empty(number_of_paths)
+    paths_valued = 0
+    for price_paths in simulate_price_paths(forward_prices, daily_volatility, number_of_paths, mean_reversion,
+                                            block_size, seed):
+        block_values = -(price_paths @ volume_per_day) - storage_cost
+        contract_values[paths_valued:paths_valued + len(block_values)] = block_values
+        paths_valued += len(block_values)
+    return contract_values
+
+
+def value_contract_monte_carlo(injection_dates, withdrawal_dates, injected_natural_gas_volumes,
+                               withdrawn_natural_gas_volumes, rate_of_injection_or_withdrawal, storage_max_capacity,
+                               storage_facility_usage_cost, injection_withdrawal_cost, cost_of_transport,
+                               number_of_paths=10000, forward_curve=None, mean_reversion=MEAN_REVERSION,
+                               volatility=VOLATILITY, seasonal_amplitude=SEASONAL_AMPLITUDE, block_size=BLOCK_SIZE,
+                               seed=None):
+    # Same inputs as contract_pricing.value_contract plus the simulation settings. The contract is first checked and
+    # valued like before (raises ContractValidationError if it breaks its rules), then valued on the simulated paths.
+    # Returns the summary of summarise_contract_values with the intrinsic valuation added.
+    valuation = cp.value_contract(injection_dates, withdrawal_dates, injected_natural_gas_volumes,
+                                  withdrawn_natural_gas_volumes, rate_of_injection_or_withdrawal, storage_max_capacity,
+                                  storage_facility_usage_cost, injection_withdrawal_cost, cost_of_transport,
+                                  forward_curve=forward_curve)
+    contract_values = simulate_contract_values(valuation['sorted_dates'], valuation['sorted_volumes'],
+                                               valuation['storage_cost'], number_of_paths, forward_curve,
+                                               mean_reversion, volatility, seasonal_amplitude, block_size, seed)
+    summary = summarise_contract_values(contract_values)
+    summary['intrinsic_valuation'] = valuation['contract_valuation']
+    return summary
+
+
+if __name__ == '__main__':
+    # Usage: python monte_carlo_valuation.py [number of paths] [seed], for the contract at the top of contract_pricing.
+    simulated_paths = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random_seed = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    try:
+        value_distribution = value_contract_monte_carlo(cp.injection_dates, cp.withdrawal_dates,
+                                                        cp.injected_natural_gas_volumes,
+                                                        cp.withdrawn_natural_gas_volumes,
+                                                        cp.rate_of_injection_or_withdrawal, cp.storage_max_capacity,
+                                                        cp.storage_facility_usage_cost, cp.injection_withdrawal_cost,
+                                                        cp.cost_of_transport, number_of_paths=simulated_paths,
+                                                        seed=random_seed)
+    except cp.ContractValidationError as error:
+        print(error)
+        quit()
+
+    print(f'Contract valuation over {value_distribution["number_of_paths"]} simulated price paths:')
+    print(f'The intrinsic contract valuation (forward curve prices) is: {value_distribution["intrinsic_valuation"]}$.')
+    print(f'The mean contract valuation is: {value_distribution["mean"]}$ (standard deviation '
+          f'{value_distribution["standard_deviation"]}$).')
+    for percentile, value in value_distribution['percentiles'].items():
+        print(f'  Percentile {percentile}%: {value}$')
+    print(f'The CVaR (average of the worst {value_distribution["cvar_level"]:.0%} of contract valuations) is: '
+          f'{value_distribution["cvar"]}$.')
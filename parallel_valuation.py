@@ -0,0 +1,137 @@
+"""
+Parallel portfolio valuation over a pool of worker processes.
+
+The contracts of a contract table (see portfolio_valuation.CONTRACT_COLUMNS) are split into chunks of whole contracts
+and every chunk is valued by portfolio_valuation.value_portfolio in a concurrent.futures process pool. The forward
+curve is computed once in the main process and put in shared memory, every worker reads its prices from there instead
+of receiving a pickled copy with every chunk. The results are gathered back in the same order as a serial run, and as
+every contract is valued on its own the output is bit-identical to value_portfolio on the whole table.
+
+Usage: python parallel_valuation.py contracts.csv [results.csv] [--workers N] [--chunk-size N]
+"""
+
+# All imported and files/scripts libraries here.
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+import argparse
+import os
+import numpy as np
+import contract_pricing as cp
+import forward_curve as fc
+import instrumentation as inst
+import portfolio_valuation as pv
+
+# Number of contracts in one chunk of work sent to a worker process.
+DEFAULT_CHUNK_SIZE = 1000
+
+# The forward curve every worker process reads its prices from, set up by attach_shared_forward_curve.
+_worker_forward_curve = None
+_worker_shared_memory = None
+
+
+def share_forward_curve(forward_curve):
+    # Copies the prices of the forward curve into a new block of shared memory. Returns the block and what a worker
+    # needs to find it again: (shared memory name, start date of the grid, number of days in the grid).
+    shared_prices = shared_memory.SharedMemory(create=True, size=max(forward_curve.prices.nbytes, 1))
+    np.ndarray(forward_curve.prices.shape, dtype=float, buffer=shared_prices.buf)[:] = forward_curve.prices
+    return shared_prices, (shared_prices.name, str(forward_curve.start_date), len(forward_curve.prices))
+
+
+def attach_shared_forward_curve(shared_memory_name, start_date, number_of_days, name, model_version):
+    # Worker process initializer: a forward curve whose prices are a view of the shared memory, no copy is made.
+    global _worker_forward_curve, _worker_shared_memory
+    try:
+        _worker_shared_memory = shared_memory.SharedMemory(name=shared_memory_name, track=False)
+    except TypeError:  # Python < 3.13 has no track argument.
+        _worker_shared_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    prices = np.ndarray((number_of_days,), dtype=float, buffer=_worker_shared_memory.buf)
+    _worker_forward_curve = fc.ForwardCurve(None, name=name, model_version=model_version, start_date=start_date,
+                                            prices=prices)
+
+
+def value_chunk(chunk_columns, parameters, record_stages=False):
+    # Values one chunk of contracts inside a worker process. Returns the results and, with record_stages, the stage
+    # totals and counters of the chunk (see instrumentation.StageRecorder.totals), else None. The workers can not add
+    # them to the recording of the main process themselves, it adds them up as the chunks come back.
+    if not record_stages:
+        return pv.value_portfolio(chunk_columns, forward_curve=_worker_forward_curve, **parameters), None
+    with inst.record_run('value_chunk') as recorder:
+        results = pv.value_portfolio(chunk_columns, forward_curve=_worker_forward_curve, **parameters)
+    return results, recorder.totals()
+
+
+def split_into_chunks(columns, chunk_size):
+    # Splits a contract table into tables of at most chunk_size whole contracts each, in contract_id order so the
+    # gathered results come out in the same order as value_portfolio.
+    contract_ids, contract_codes = np.unique(columns['contract_id'], return_inverse=True)
+    contract_codes = contract_codes.reshape(-1)
+    rows_by_contract = np.argsort(contract_codes, kind='stable')  # Keeps the rows of a contract in their table order.
+    contract_starts = np.searchsorted(contract_codes[rows_by_contract], np.arange(0, len(contract_ids), chunk_size))
+    chunk_bounds = np.r_[contract_starts, len(rows_by_contract)]
+
+    for first_row, end_row in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+        chunk_rows = rows_by_contract[first_row:end_row]
+        yield {name: column[chunk_rows] for name, column in columns.items()}
+
+
+def concatenate_results(chunk_results):
+    # Joins the result columns of every chunk back together, in chunk order.
+    return {name: np.concatenate([results[name] for results in chunk_results]) for name in pv.RESULT_COLUMNS}
+
+
+def value_portfolio_parallel(contracts, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, forward_curve=None,
+                             **parameters):
+    # Same as portfolio_valuation.value_portfolio (same parameters and results), with the contracts valued in chunks of
+    # chunk_size contracts by a pool of worker processes. workers defaults to the number of CPUs, workers=1 values the
+    # whole table in this process without a pool.
+    columns = pv.contract_table_columns(contracts)
+    if forward_curve is None:
+        forward_curve = fc.load_forward_curve()
+    if len(columns['contract_id']) == 0:
+        return pv.empty_portfolio_results()
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return pv.value_portfolio(columns, forward_curve=forward_curve, **parameters)
+
+    # The workers can not extend the shared forward curve, so it is grown here to cover every date of the table first,
+    # including the placeholder that value_portfolio prices for the dates it could not read.
+    dates = pv.parse_contract_dates(columns['date'])
+    dates[np.isnat(dates)] = pv.UNREADABLE_DATE_PLACEHOLDER
+    forward_curve.ensure_horizon(dates.min(), dates.max())
+
+    shared_prices, shared_curve = share_forward_curve(forward_curve)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_shared_forward_curve,
+                                 initargs=(*shared_curve, forward_curve.name, forward_curve.model_version)) as pool:
+            chunks = split_into_chunks(columns, chunk_size)
+            chunk_results = []
+            for results, chunk_totals in pool.map(value_chunk, chunks, repeat(parameters), repeat(inst.recording())):
+                inst.add_totals(chunk_totals)
+                chunk_results.append(results)
+    finally:
+        shared_prices.close()
+        shared_prices.unlink()
+    return concatenate_results(chunk_results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Values a table of storage contracts over several processes.')
+    parser.add_argument('contracts', help='contract table (.csv, .parquet or .npy)')
+    parser.add_argument('results', nargs='?', default='portfolio_valuation_results.csv', help='results CSV file')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPUs)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='contracts per chunk')
+    arguments = parser.parse_args()
+
+    # The parameters at the top of contract_pricing are used for any contract without its own values in the table.
+    portfolio_results = value_portfolio_parallel(pv.load_contract_table(arguments.contracts),
+                                                 workers=arguments.workers, chunk_size=arguments.chunk_size,
+                                                 rate_of_injection_or_withdrawal=cp.rate_of_injection_or_withdrawal,
+                                                 storage_max_capacity=cp.storage_max_capacity,
+                                                 storage_facility_usage_cost=cp.storage_facility_usage_cost,
+                                                 injection_withdrawal_cost=cp.injection_withdrawal_cost,
+                                                 cost_of_transport=cp.cost_of_transport)
+    pv.write_portfolio_results(portfolio_results, arguments.results)
+    number_of_failed_contracts = int(np.count_nonzero(portfolio_results['error'] != ''))
+    print(f'Valued {len(portfolio_results["contract_id"])} contracts ({number_of_failed_contracts} with errors), '
+          f'results written to {arguments.results}.')
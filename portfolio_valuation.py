@@ -0,0 +1,441 @@
+"""
+Batch (portfolio) valuation of many natural gas storage contracts in one call.
+
+The contract_pricing script values a single contract given by its module level parameters. This file instead takes a
+table of client actions for many contracts, one row per injection or withdrawal, and values all of them together. The
+contract terms and results are held column-wise in NumPy arrays so the sorting, volume balance check, storage cost
+formula and month counting happen across all contracts at once. A contract breaking one of its rules gets an error
+message in its result row instead of stopping the whole batch.
+
+Usage: python portfolio_valuation.py contracts.csv [results.csv]
+"""
+
+# All imported and files/scripts libraries here.
+from datetime import datetime
+import csv
+import sys
+import numpy as np
+import contract_pricing as cp
+import daily_schedule as ds
+import forward_curve as fc
+import instrumentation as inst
+
+# The columns every contract table needs: one row per client action.
+#   contract_id: any label, all rows with the same label belong to the same contract.
+#   action: 'injection' or 'withdrawal'.
+#   date: date of the client action, either a string in the form %d/%m/%y or a NumPy datetime64.
+#   volume: volume injected or withdrawn, in MMBtu (always positive, the action decides the direction).
+CONTRACT_COLUMNS = ('contract_id', 'action', 'date', 'volume')
+# The contract parameters, same meaning as in contract_pricing. These can either be columns of the table (the first
+# row of a contract is used) or be given once for the entire portfolio to value_portfolio.
+PARAMETER_COLUMNS = ('rate_of_injection_or_withdrawal', 'storage_max_capacity', 'storage_facility_usage_cost',
+                     'injection_withdrawal_cost', 'cost_of_transport')
+# The columns of the valuation results, one row per contract.
+RESULT_COLUMNS = ('contract_id', 'contract_valuation', 'final_difference_in_price', 'storage_cost',
+                  'contract_start', 'contract_end', 'contract_length_in_days', 'error')
+
+# The parameters that must be above 0 (the costs only must not be negative).
+POSITIVE_PARAMETERS = ('rate_of_injection_or_withdrawal', 'storage_max_capacity')
+
+INJECTION_ACTIONS = ('injection', 'inject', 'i')
+WITHDRAWAL_ACTIONS = ('withdrawal', 'withdraw', 'w')
+# The date given to client actions whose date could not be read, so the batch can go on. Their contracts get an error
+# row, but the placeholder is still looked up on the forward curve with the other dates.
+UNREADABLE_DATE_PLACEHOLDER = np.datetime64('2020-01-01', 'D')
+
+
+def load_contract_table(path):
+    # Reads a contract table from a CSV (.csv), Parquet (.parquet) or NumPy structured array (.npy) file and returns it
+    # as a dictionary of column arrays.
+    if path.endswith('.csv'):
+        with open(path, newline='') as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        columns = {name: [row[name] for row in rows] for name in (rows[0].keys() if rows else CONTRACT_COLUMNS)}
+    elif path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Reading Parquet contract tables needs the pyarrow library (pip install pyarrow).')
+        columns = pq.read_table(path).to_pydict()
+    elif path.endswith('.npy'):
+        columns = np.load(path, allow_pickle=False)
+    else:
+        raise ValueError(f'Unknown contract table format for {path}, use a .csv, .parquet or .npy file.')
+    return contract_table_columns(columns)
+
+
+def contract_table_columns(contracts):
+    # Turns a contract table (dictionary of columns or NumPy structured array) into a dictionary of NumPy arrays.
+    if isinstance(contracts, np.ndarray):
+        names = contracts.dtype.names or ()
+        contracts = {name: contracts[name] for name in names}
+
+    missing_columns = [name for name in CONTRACT_COLUMNS if name not in contracts]
+    if missing_columns:
+        raise ValueError(f'The contract table is missing the column(s) {", ".join(missing_columns)}.')
+
+    columns = {name: np.asarray(column) for name, column in contracts.items()}
+    columns['contract_id'] = columns['contract_id'].astype(str)
+    columns['action'] = np.char.lower(np.char.strip(columns['action'].astype(str)))
+    columns['volume'], _ = parse_numeric_column(columns['volume'])
+    # Rows with a contract parameter that is not a number, their contract gets an error row.
+    unreadable_parameters = np.zeros(len(columns['volume']), dtype=bool)
+    for name in PARAMETER_COLUMNS:
+        if name in columns:  # Empty cells of a CSV file become NaN, meaning the portfolio default is used.
+            columns[name], is_unreadable = parse_numeric_column(columns[name])
+            unreadable_parameters |= is_unreadable
+    columns['unreadable_parameters'] = unreadable_parameters | columns.get('unreadable_parameters', False)
+    return columns
+
+
+def parse_numeric_column(column):
+    # Turns a column of volumes or contract parameters into floats. Strings are parsed once per distinct value, like
+    # the dates. Empty cells and cells that can not be read become NaN instead of stopping the whole batch. Returns the
+    # floats and which cells could not be read (not counting the empty ones).
+    column = np.asarray(column)
+    if column.dtype.kind in 'biuf':
+        return column.astype(float), np.zeros(len(column), dtype=bool)
+
+    unique_values, value_positions = np.unique(column.astype(str), return_inverse=True)
+    parsed_unique_values = np.empty(len(unique_values))
+    unreadable_unique_values = np.zeros(len(unique_values), dtype=bool)
+    for i, value in enumerate(unique_values):
+        try:
+            parsed_unique_values[i] = float(value)
+        except ValueError:
+            parsed_unique_values[i] = np.nan
+            unreadable_unique_values[i] = value.strip() not in ('', 'None')
+    value_positions = value_positions.reshape(-1)
+    return parsed_unique_values[value_positions], unreadable_unique_values[value_positions]
+
+
+def parse_contract_dates(dates):
+    # Turns the date column into datetime64[D]. Strings are parsed once per distinct date, as the same dates tend to
+    # come back across many contracts. Dates that can not be read become NaT.
+    dates = np.asarray(dates)
+    if dates.dtype.kind == 'M':
+        return dates.astype('datetime64[D]')
+
+    unique_dates, date_positions = np.unique(dates.astype(str), return_inverse=True)
+    parsed_unique_dates = np.empty(len(unique_dates), dtype='datetime64[D]')
+    for i, date in enumerate(unique_dates):
+        try:
+            parsed_unique_dates[i] = np.datetime64(datetime.strptime(date, cp.DATE_FORMAT).date(), 'D')
+        except ValueError:
+            parsed_unique_dates[i] = np.datetime64('NaT')
+    return parsed_unique_dates[date_positions.reshape(-1)]
+
+
+def contract_months_between(first_dates, last_dates):
+    # Same month count as contract_pricing.contract_months (relativedelta years * 12 + months + 1), for arrays of dates.
+    # relativedelta only counts a month as complete if the day of the month is reached, or if the later date is the
+    # last day of its month.
+    first_months = first_dates.astype('datetime64[M]')
+    last_months = last_dates.astype('datetime64[M]')
+    first_day = (first_dates - first_months.astype('datetime64[D]')).astype(int) + 1
+    last_day = (last_dates - last_months.astype('datetime64[D]')).astype(int) + 1
+    last_day_is_month_end = (last_dates + 1).astype('datetime64[M]') != last_months
+    incomplete_month = (last_day < first_day) & ~last_day_is_month_end
+    return (last_months - first_months).astype(int) - incomplete_month + 1
+
+
+def format_volume(volume):
+    # Volumes are stored as floats in the batch, shows them the way they would have been typed in (no trailing .0).
+    return int(volume) if float(volume).is_integer() else volume
+
+
+def contract_parameters(columns, first_event_rows, defaults, names=PARAMETER_COLUMNS):
+    # One value of every contract parameter (or only the given names) per contract, either from the table or from the
+    # portfolio wide defaults.
+    parameters = {}
+    for name in names:
+        if name in columns:
+            parameter = columns[name][first_event_rows]
+            if defaults.get(name) is not None:
+                parameter = np.where(np.isnan(parameter), defaults[name], parameter)
+        elif defaults.get(name) is not None:
+            parameter = np.full(len(first_event_rows), defaults[name], dtype=float)
+        else:
+            raise ValueError(f'No value given for {name}: add it as a column of the contract table or pass it to '
+                             f'value_portfolio.')
+        parameters[name] = parameter
+    return parameters
+
+
+def parameter_error(name, value):
+    # The error message for a contract parameter that can not be used, '' if it can. The rate and the maximum capacity
+    # must be above 0, the costs may be 0.
+    if np.isnan(value) or (value <= 0 if name in POSITIVE_PARAMETERS else value < 0):
+        return (f'The {name} of the contract is missing or not valid ({format_volume(value)}), it must be a number '
+                f'{"above" if name in POSITIVE_PARAMETERS else "of at least"} 0.')
+    return ''
+
+
+def check_contract_parameters(parameters, errors):
+    # Gives every contract with a parameter that can not be used (see parameter_error) an error, if it has none yet.
+    # Their parameters are replaced with a placeholder of 1, so the rest of the batch can go on without dividing by 0.
+    for name, parameter in parameters.items():
+        invalid = np.isnan(parameter) | (parameter <= 0 if name in POSITIVE_PARAMETERS else parameter < 0)
+        for contract_code in np.flatnonzero(invalid & (errors == '')):
+            errors[contract_code] = parameter_error(name, parameter[contract_code])
+        parameter[invalid] = 1
+
+
+def sort_portfolio_events(columns):
+    # Sorts all client actions by contract and then date, returning the sorted event arrays and where every contract
+    # starts. Within a contract the order is the same as contract_pricing.sort_client_actions: a stable sort by date
+    # of the injections followed by the withdrawals.
+    contract_ids, contract_codes = np.unique(columns['contract_id'], return_inverse=True)
+    contract_codes = contract_codes.reshape(-1)
+    is_withdrawal = np.isin(columns['action'], WITHDRAWAL_ACTIONS)
+    is_unknown_action = ~is_withdrawal & ~np.isin(columns['action'], INJECTION_ACTIONS)
+    dates = parse_contract_dates(columns['date'])
+    is_unreadable_date = np.isnat(dates)
+    dates[is_unreadable_date] = UNREADABLE_DATE_PLACEHOLDER
+    is_unreadable_volume = ~np.isfinite(columns['volume'])
+    volumes = np.where(is_unreadable_volume, 0., columns['volume'])  # Same placeholder for the volumes.
+
+    row_index = np.arange(len(dates))
+    order = np.lexsort((row_index, is_withdrawal, dates, contract_codes))
+    events = {
+        'contract_codes': contract_codes[order],
+        'dates': dates[order],
+        'volumes': np.where(is_withdrawal, -volumes, volumes)[order],  # - for removing volume.
+        'is_withdrawal': is_withdrawal[order],
+        'rows': order,
+    }
+    # A table without rows has no contracts to start.
+    contract_starts = np.flatnonzero(np.r_[len(order) > 0,
+                                           events['contract_codes'][1:] != events['contract_codes'][:-1]])
+
+    errors = np.full(len(contract_ids), '', dtype=object)
+    bad_action_contracts = np.unique(contract_codes[is_unknown_action])
+    errors[bad_action_contracts] = "Every client action must be either an 'injection' or a 'withdrawal'."
+    bad_date_contracts = np.unique(contract_codes[is_unreadable_date])
+    errors[bad_date_contracts] = 'Some client action dates could not be read, they must be in the form dd/mm/yy.'
+    bad_volume_contracts = np.unique(contract_codes[is_unreadable_volume])
+    errors[bad_volume_contracts] = 'Some client action volumes could not be read, they must be numbers.'
+    bad_parameter_contracts = np.unique(contract_codes[columns['unreadable_parameters']])
+    errors[bad_parameter_contracts] = 'Some contract parameters could not be read, they must be numbers.'
+    return contract_ids, events, contract_starts, errors
+
+
+def first_violation_per_contract(violations, contract_codes, number_of_contracts):
+    # For every contract the index of its first event where the violation mask is True, -1 if there is none.
+    first_violations = np.full(number_of_contracts, -1)
+    violating_events = np.flatnonzero(violations)
+    violating_contracts, first_positions = np.unique(contract_codes[violating_events], return_index=True)
+    first_violations[violating_contracts] = violating_events[first_positions]
+    return first_violations
+
+
+def contract_cumulative_sums(values, contract_starts):
+    # Running total of the values within every contract. Contracts with the same number of events are stacked into one
+    # matrix and summed along its rows, so every running total only depends on its own contract (and not on where it
+    # is in the portfolio, as subtracting from one portfolio wide cumulative sum would).
+    contract_lengths = np.diff(np.r_[contract_starts, len(values)])
+    cumulative_sums = np.empty(len(values))
+    for contract_length in np.unique(contract_lengths):
+        event_positions = contract_starts[contract_lengths == contract_length, None] + np.arange(contract_length)
+        cumulative_sums[event_positions] = np.cumsum(values[event_positions], axis=1)
+    return cumulative_sums
+
+
+def check_portfolio_cumulative_inventory(events, contract_starts, storage_max_capacity, errors, checked_contracts):
+    # The vectorised version of contract_pricing.check_cumulative_inventory, for all contracts without overlapping
+    # client actions at once.
+    codes = events['contract_codes']
+    volumes = events['volumes']
+    total_volumes = contract_cumulative_sums(volumes, contract_starts)
+
+    too_large = total_volumes > storage_max_capacity[codes]
+    too_small = total_volumes < 0
+    first_violations = first_violation_per_contract((too_large | too_small) & checked_contracts[codes], codes,
+                                                    len(contract_starts))
+    for contract_code in np.flatnonzero(first_violations >= 0):
+        event = first_violations[contract_code]
+        if too_large[event]:  # If injecting more than possible.
+            errors[contract_code] = cp.too_large_injection_message(format_volume(volumes[event]),
+                                                                   format_volume(storage_max_capacity[contract_code]))
+        else:  # If withdrawing more than the client has.
+            errors[contract_code] = cp.too_large_withdraw_message(format_volume(-volumes[event]))
+
+
+def contract_daily_schedule(events, contract_slice, rate_of_injection_or_withdrawal):
+    # The daily schedule of one contract of the sorted events (the 4 arrays of daily_schedule.build_daily_schedule, days
+    # counted from its first client action). Returns the contract length in days and the schedule.
+    dates = events['dates'][contract_slice]
+    volumes = events['volumes'][contract_slice]
+    is_withdrawal = events['is_withdrawal'][contract_slice]
+    action_days = (dates - dates[0]).astype(int)
+
+    with inst.stage('contract_length'):
+        contract_length_in_days = cp.overlap_contract_length(list(dates.astype(object)), list(volumes),
+                                                             list(dates[is_withdrawal].astype(object)),
+                                                             list(volumes[is_withdrawal]),
+                                                             rate_of_injection_or_withdrawal)
+    with inst.stage('schedule_build'):
+        daily_schedule = ds.build_daily_schedule(action_days[~is_withdrawal], volumes[~is_withdrawal],
+                                                 action_days[is_withdrawal], volumes[is_withdrawal],
+                                                 contract_length_in_days, rate_of_injection_or_withdrawal)
+    inst.count('schedule_days', contract_length_in_days)
+    return contract_length_in_days, daily_schedule
+
+
+def check_overlapping_contract(events, contract_slice, rate_of_injection_or_withdrawal, storage_max_capacity):
+    # Contracts with overlapping client actions need the daily schedule, one contract at a time. Returns the contract
+    # length in days, raises ContractValidationError if the contract breaks its rules.
+    contract_length_in_days, daily_schedule = contract_daily_schedule(events, contract_slice,
+                                                                      rate_of_injection_or_withdrawal)
+    with inst.stage('inventory_walk'):
+        cp.check_daily_inventory(*daily_schedule, events['dates'][contract_slice][0].astype(object),
+                                 storage_max_capacity)
+    return contract_length_in_days
+
+
+def price_portfolio_events(dates, forward_curve):
+    # Prices $/MMBtu from the pricing model, for every client action, looked up on the forward curve.
+    return forward_curve.prices_at(dates)
+
+
+def empty_portfolio_results():
+    # The result columns of a contract table without any rows.
+    return {
+        'contract_id': np.zeros(0, dtype=str),
+        'contract_valuation': np.zeros(0),
+        'final_difference_in_price': np.zeros(0),
+        'storage_cost': np.zeros(0),
+        'contract_start': np.zeros(0, dtype='datetime64[D]'),
+        'contract_end': np.zeros(0, dtype='datetime64[D]'),
+        'contract_length_in_days': np.zeros(0),
+        'error': np.zeros(0, dtype=str),
+    }
+
+
+def value_portfolio(contracts, rate_of_injection_or_withdrawal=None, storage_max_capacity=None,
+                    storage_facility_usage_cost=None, injection_withdrawal_cost=None, cost_of_transport=None,
+                    forward_curve=None):
+    # Values every contract of a contract table (see CONTRACT_COLUMNS). Parameters given here are used for every
+    # contract that does not have its own value in the table. Prices come from forward_curve, by default the curve of
+    # the price_predict model. Returns a dictionary of result columns (RESULT_COLUMNS),
+    # one row per contract ordered by contract_id. Contracts breaking one of their rules have NaN values and the reason
+    # in the 'error' column.
+    columns = contract_table_columns(contracts)
+    defaults = {'rate_of_injection_or_withdrawal': rate_of_injection_or_withdrawal,
+                'storage_max_capacity': storage_max_capacity,
+                'storage_facility_usage_cost': storage_facility_usage_cost,
+                'injection_withdrawal_cost': injection_withdrawal_cost,
+                'cost_of_transport': cost_of_transport}
+
+    with inst.stage('parsing_sorting'):
+        contract_ids, events, contract_starts, errors = sort_portfolio_events(columns)
+    inst.count('events_processed', len(events['volumes']))
+    number_of_contracts = len(contract_ids)
+    if number_of_contracts == 0:
+        return empty_portfolio_results()
+    parameters = contract_parameters(columns, events['rows'][contract_starts], defaults)
+    check_contract_parameters(parameters, errors)
+    rate = parameters['rate_of_injection_or_withdrawal']
+    codes = events['contract_codes']
+    dates = events['dates']
+    volumes = events['volumes']
+    contract_ends = np.r_[contract_starts[1:], len(codes)]
+    first_dates = dates[contract_starts]
+    last_dates = dates[contract_ends - 1]
+
+    # Checking if some volume of natural gas is remaining after contract end, this should be 0 at contract end.
+    unbalanced = (np.add.reduceat(volumes, contract_starts) != 0) & (errors == '')
+    errors[unbalanced] = cp.UNBALANCED_VOLUME_MESSAGE
+
+    # Checking if actions overlap, hence pushing back that action due to the injection/withdraw rate limit. Same rule
+    # as contract_pricing.detect_client_action_overlap, applied to every pair of successive actions in a contract.
+    with inst.stage('overlap_detection'):
+        same_contract = codes[1:] == codes[:-1]
+        action_durations = np.ceil(volumes[:-1] / rate[codes[:-1]])
+        number_of_days_between_successive_dates = (dates[1:] - dates[:-1]).astype(int)
+        overlapping_actions = same_contract & (action_durations >= number_of_days_between_successive_dates)
+        client_action_overlap = np.bincount(codes[:-1][overlapping_actions], minlength=number_of_contracts) > 0
+
+    with inst.stage('inventory_walk'):
+        check_portfolio_cumulative_inventory(events, contract_starts, parameters['storage_max_capacity'], errors,
+                                             ~client_action_overlap & (errors == ''))
+    contract_length_in_days = ((last_dates - first_dates).astype(int) +
+                               np.abs(volumes[contract_ends - 1]) / rate)
+
+    for contract_code in np.flatnonzero(client_action_overlap & (errors == '')):
+        contract_slice = slice(contract_starts[contract_code], contract_ends[contract_code])
+        try:
+            contract_length_in_days[contract_code] = check_overlapping_contract(
+                events, contract_slice, rate[contract_code], parameters['storage_max_capacity'][contract_code])
+        except cp.ContractValidationError as error:
+            errors[contract_code] = str(error)
+
+    # Since price from model is dollar per MMBtu.
+    with inst.stage('pricing'):
+        if forward_curve is None:
+            forward_curve = fc.load_forward_curve()
+        total_prices = price_portfolio_events(dates, forward_curve) * volumes
+        final_difference_in_price = np.round(np.add.reduceat(total_prices, contract_starts) * -1, 2)
+
+    with inst.stage('storage_cost'):
+        # Used for part of the storage costs.
+        total_handled_natural_gas_by_facility = np.add.reduceat(np.abs(volumes), contract_starts)
+        storage_cost = cp.contract_storage_cost(contract_months_between(first_dates, last_dates),
+                                                total_handled_natural_gas_by_facility, contract_ends - contract_starts,
+                                                parameters['storage_facility_usage_cost'],
+                                                parameters['injection_withdrawal_cost'],
+                                                parameters['cost_of_transport'])
+
+    failed = errors != ''
+    results = {
+        'contract_id': contract_ids,
+        'contract_valuation': np.round(final_difference_in_price - storage_cost, 2),
+        'final_difference_in_price': final_difference_in_price,
+        'storage_cost': storage_cost,
+        'contract_start': first_dates,
+        'contract_end': first_dates + np.floor(contract_length_in_days).astype(int),
+        'contract_length_in_days': contract_length_in_days,
+        'error': errors.astype(str),
+    }
+    for name in ('contract_valuation', 'final_difference_in_price', 'storage_cost', 'contract_length_in_days'):
+        results[name] = np.where(failed, np.nan, results[name])
+    for name in ('contract_start', 'contract_end'):
+        results[name] = np.where(failed, np.datetime64('NaT'), results[name])
+    return results
+
+
+def format_result_value(value):
+    # Dates in the form %d/%m/%y like the inputs, missing values (contracts with an error) as empty cells.
+    if isinstance(value, np.datetime64):
+        return '' if np.isnat(value) else value.astype(object).strftime(cp.DATE_FORMAT)
+    if isinstance(value, float) and np.isnan(value):
+        return ''
+    return value
+
+
+def write_portfolio_results(results, path):
+    # Writes the result columns of value_portfolio to a CSV file.
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(RESULT_COLUMNS)
+        for row in zip(*(results[name] for name in RESULT_COLUMNS)):
+            writer.writerow([format_result_value(value) for value in row])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(__doc__.strip().splitlines()[-1])
+        quit()
+
+    # The parameters at the top of contract_pricing are used for any contract without its own values in the table.
+    portfolio_results = value_portfolio(load_contract_table(sys.argv[1]),
+                                        rate_of_injection_or_withdrawal=cp.rate_of_injection_or_withdrawal,
+                                        storage_max_capacity=cp.storage_max_capacity,
+                                        storage_facility_usage_cost=cp.storage_facility_usage_cost,
+                                        injection_withdrawal_cost=cp.injection_withdrawal_cost,
+                                        cost_of_transport=cp.cost_of_transport)
+    results_path = sys.argv[2] if len(sys.argv) == 3 else 'portfolio_valuation_results.csv'
+    write_portfolio_results(portfolio_results, results_path)
+    number_of_failed_contracts = int(np.count_nonzero(portfolio_results['error'] != ''))
+    print(f'Valued {len(portfolio_results["contract_id"])} contracts ({number_of_failed_contracts} with errors), '
+          f'results written to {results_path}.')
@@ -0,0 +1,259 @@
+"""
+Incremental revaluation of a contract and bump-and-reprice sensitivities.
+
+contract_pricing.value_contract starts from scratch every time: parsing, sorting, building the daily schedule, checking
+the capacity and pricing. A ContractRevaluation keeps everything it worked out for the contract (sorted client actions,
+the injection/withdrawal queues of the daily schedule, the daily inventory and the storage cost) so that:
+
+    - a new forward curve only redoes the price dot product (revalue),
+    - amending one client action only rebuilds the queue it belongs to, from the first day it changes (amend_event),
+    - sensitivities bump the prices of one month bucket at a time on the cached schedule (bucket_sensitivities).
+"""
+
+# All imported and files/scripts libraries here.
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+import math as mt
+import numpy as np
+import contract_pricing as cp
+import daily_schedule as ds
+import forward_curve as fc
+
+# Size of the price bump, $/MMBtu, used for the sensitivities.
+PRICE_BUMP = 0.01
+# The two types of client action, in the order contract_pricing.sort_client_actions puts actions on the same date.
+CLIENT_ACTIONS = ('injection', 'withdrawal')
+
+
+class ContractRevaluation:
+    # A contract (same inputs as contract_pricing.value_contract) with its intermediate results kept for revaluation.
+
+    def __init__(self, injection_dates, withdrawal_dates, injected_natural_gas_volumes, withdrawn_natural_gas_volumes,
+                 rate_of_injection_or_withdrawal, storage_max_capacity, storage_facility_usage_cost,
+                 injection_withdrawal_cost, cost_of_transport, forward_curve=None):
+        self.client_actions = {'injection': (list(injection_dates), list(injected_natural_gas_volumes)),
+                               'withdrawal': (list(withdrawal_dates), list(withdrawn_natural_gas_volumes))}
+        self.rate = rate_of_injection_or_withdrawal
+        self.storage_max_capacity = storage_max_capacity
+        self.storage_facility_usage_cost = storage_facility_usage_cost
+        self.injection_withdrawal_cost = injection_withdrawal_cost
+        self.cost_of_transport = cost_of_transport
+        self.forward_curve = forward_curve if forward_curve is not None else fc.load_forward_curve()
+
+        self.sort_keys = []
+        self.client_action_overlap = False
+        self.contract_length_in_days = None
+        self.date_of_first_action = None
+        self.arrivals = {}
+        self.queues = {}
+        self.inventory = None
+        self.build()
+        self.revalue()
+
+    def sorted_client_actions(self, action=None):
+        # Dates and volumes (- for withdrawals) of all client actions, or of one type only, in the order of the sort
+        # keys: the same order as contract_pricing.sort_client_actions and sort_dates_and_volumes.
+        sorted_dates, sorted_volumes = [], []
+        for date, action_rank, position in self.sort_keys:
+            if action is not None and CLIENT_ACTIONS[action_rank] != action:
+                continue
+            volume = self.client_actions[CLIENT_ACTIONS[action_rank]][1][position]
+            sorted_dates.append(date)
+            sorted_volumes.append(-volume if action_rank else volume)
+        return sorted_dates, sorted_volumes
+
+    def move_client_action(self, action, position, date, volume):
+        # Changes the date and volume of one client action, moving its sort key instead of sorting every action again.
+        action_rank = CLIENT_ACTIONS.index(action)
+        dates, volumes = self.client_actions[action]
+        del self.sort_keys[bisect_left(self.sort_keys, (datetime.strptime(dates[position], cp.DATE_FORMAT),
+                                                        action_rank, position))]
+        insort(self.sort_keys, (datetime.strptime(date, cp.DATE_FORMAT), action_rank, position))
+        dates[position], volumes[position] = date, volume
+
+    def build(self, changed_action=None, changed_dates=()):
+        # Sorts and checks the client actions, and builds the daily schedule for overlapping contracts. Raises
+        # ContractValidationError if the contract breaks its rules. If only one client action changed (changed_action
+        # and its old and new date), only the queues of that type of action are rebuilt from the first changed day on.
+        if changed_action is None:
+            injection_dates, injected_volumes = self.client_actions['injection']
+            withdrawal_dates, withdrawn_volumes = self.client_actions['withdrawal']
+            sorted_dates, sorted_volumes = cp.sort_client_actions(injection_dates, withdrawal_dates,
+                                                                  injected_volumes, withdrawn_volumes)
+            # (date, 0 for injections or 1 for withdrawals, position in its list): sorted, these keys give the same
+            # order as the stable sort by date of contract_pricing, and amend_event only has to move one of them.
+            self.sort_keys = sorted((datetime.strptime(date, cp.DATE_FORMAT), action_rank, position)
+                                    for action_rank, action in enumerate(CLIENT_ACTIONS)
+                                    for position, date in enumerate(self.client_actions[action][0]))
+        else:
+            sorted_dates, sorted_volumes = self.sorted_client_actions()
+        cp.check_volume_balance(sorted_volumes)
+        client_action_overlap = cp.detect_client_action_overlap(sorted_dates, sorted_volumes, self.rate)
+
+        if client_action_overlap:
+            sorted_withdraw_dates, sorted_withdraw_volumes = self.sorted_client_actions('withdrawal')
+            contract_length_in_days = cp.overlap_contract_length(sorted_dates, sorted_volumes, sorted_withdraw_dates,
+                                                                 sorted_withdraw_volumes, self.rate)
+            # The days before the change can only be kept if the days of the schedule are still the same days.
+            if (changed_action is not None and self.client_action_overlap and
+                    contract_length_in_days == self.contract_length_in_days and
+                    sorted_dates[0] == self.date_of_first_action):
+                first_changed_day = self.reschedule(changed_action, changed_dates)
+            else:
+                self.date_of_first_action = sorted_dates[0]
+                self.contract_length_in_days = contract_length_in_days
+                self.arrivals, self.queues = {}, {}
+                for action in CLIENT_ACTIONS:
+                    self.schedule_action(action)
+                self.inventory = ds.daily_inventory(*self.daily_schedule())
+                first_changed_day = 0
+            # The days before the change were already checked.
+            cp.check_inventory(self.inventory[first_changed_day:],
+                               sorted_dates[0] + timedelta(days=first_changed_day), self.storage_max_capacity)
+        else:
+            cp.check_cumulative_inventory(sorted_volumes, self.storage_max_capacity)
+            contract_length_in_days = ((sorted_dates[-1] - sorted_dates[0]).days +
+                                       (abs(sorted_volumes[-1]) / self.rate))
+            self.date_of_first_action = sorted_dates[0]
+            self.arrivals, self.queues = {}, {}
+            self.inventory = None
+
+        self.client_action_overlap = client_action_overlap
+        self.contract_length_in_days = contract_length_in_days
+        self.sorted_dates = sorted_dates
+        self.sorted_volumes = sorted_volumes
+        self.action_dates = np.array(sorted_dates, dtype='datetime64[D]')
+        self.volumes = np.array(sorted_volumes, dtype=float)
+        self.months = cp.contract_months(sorted_dates[0], sorted_dates[-1])
+        self.storage_cost = cp.contract_storage_cost(self.months, mt.fsum(self.client_actions['injection'][1] +
+                                                                          self.client_actions['withdrawal'][1]),
+                                                     len(sorted_volumes), self.storage_facility_usage_cost,
+                                                     self.injection_withdrawal_cost, self.cost_of_transport)
+
+    def schedule_action(self, action):
+        # Builds the arrivals and the volume and action day queues of the injections or withdrawals from scratch.
+        sorted_action_dates, sorted_action_volumes = self.sorted_client_actions(action)
+        action_days = [(date - self.date_of_first_action).days for date in sorted_action_dates]
+        self.arrivals[action] = ds.action_arrivals(action_days, sorted_action_volumes, self.contract_length_in_days,
+                                                   self.rate)
+        self.queues[action] = tuple(ds.rate_limited_queue(arrived_per_day, rate)
+                                    for arrived_per_day, rate in zip(self.arrivals[action], (self.rate, 1)))
+
+    def reschedule(self, action, changed_dates):
+        # Updates the schedule in place after client actions of one type changed on some dates: the arrivals of those
+        # days, then the queues of that type of action and the inventory from the first of those days on. Returns that
+        # day.
+        arrived_volumes_per_day, arrived_days_per_day = self.arrivals[action]
+        action_rank = CLIENT_ACTIONS.index(action)
+        for date in changed_dates:
+            day = (date - self.date_of_first_action).days
+            if not 0 <= day < self.contract_length_in_days:
+                continue  # Actions starting after the contract length are left out, like in daily_schedule.
+            # Added up in the same order as the np.bincount of daily_schedule.action_arrivals, so no rounding differs.
+            arrived_volumes_per_day[day] = arrived_days_per_day[day] = 0.
+            for _, _, position in self.sort_keys[bisect_left(self.sort_keys, (date, action_rank)):
+                                                 bisect_left(self.sort_keys, (date, action_rank + 1))]:
+                volume = abs(float(self.client_actions[action][1][position]))
+                arrived_volumes_per_day[day] += volume
+                arrived_days_per_day[day] += np.ceil(volume / self.rate)
+
+        first_changed_day = min(max(0, (min(changed_dates) - self.date_of_first_action).days),
+                                self.contract_length_in_days)
+        volume_queue, day_queue = self.queues[action]
+        ds.rate_limited_queue(arrived_volumes_per_day, self.rate, volume_queue, first_changed_day)
+        ds.rate_limited_queue(arrived_days_per_day, 1, day_queue, first_changed_day)
+
+        # The running total from the day of the change, starting from the unchanged volume the day before.
+        injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day = self.daily_schedule(
+            first_changed_day)
+        volume_before = self.inventory[first_changed_day - 1] if first_changed_day else 0.
+        self.inventory[first_changed_day:] = np.cumsum(np.concatenate((
+            [volume_before], injections * injection_volumes_per_day - withdrawals * withdrawal_volumes_per_day)))[1:]
+        return first_changed_day
+
+    def daily_schedule(self, first_day=0):
+        # The 4 arrays of daily_schedule.build_daily_schedule from the cached queues, for the days from first_day on.
+        schedule = []
+        for action in CLIENT_ACTIONS:
+            for queue in self.queues[action][::-1]:  # The action days, then the volumes per day.
+                volumes_moved = queue['volumes_moved']
+                schedule.append(np.diff(volumes_moved[first_day:],
+                                        prepend=volumes_moved[first_day - 1] if first_day else 0.))
+        return tuple(schedule)
+
+    def amend_event(self, action, position, date=None, volume=None):
+        # Changes the date and/or volume of one client action ('injection' or 'withdrawal', position in the list of
+        # that type of action it was given in) and revalues the contract. If the amended contract breaks its rules,
+        # ContractValidationError is raised and the contract stays as it was.
+        dates, volumes = self.client_actions[action]
+        old_date, old_volume = dates[position], volumes[position]
+        new_date = old_date if date is None else date
+        new_volume = old_volume if volume is None else volume
+        changed_dates = (datetime.strptime(old_date, cp.DATE_FORMAT), datetime.strptime(new_date, cp.DATE_FORMAT))
+
+        # Only references: build replaces what it rebuilds, and what it changes in place is undone below.
+        saved_state = dict(self.__dict__)
+        self.move_client_action(action, position, new_date, new_volume)
+        try:
+            self.build(action, changed_dates)
+        except cp.ContractValidationError:
+            rescheduled_in_place = self.queues is saved_state['queues'] and action in self.queues
+            self.move_client_action(action, position, old_date, old_volume)
+            self.__dict__.update(saved_state)
+            if rescheduled_in_place:
+                self.reschedule(action, changed_dates)
+            raise
+        return self.revalue()
+
+    def revalue(self, forward_curve=None):
+        # Values the cached schedule on a (new) forward curve, only the prices of the client action dates are looked up.
+        if forward_curve is not None:
+            self.forward_curve = forward_curve
+        self.prices_at_dates = self.forward_curve.prices_at(self.action_dates)
+        total_prices = (self.prices_at_dates * self.volumes).tolist()  # Since price from model is dollar per MMBtu.
+        final_difference_in_price = round(mt.fsum(total_prices) * -1, 2)
+        return {
+            'final_difference_in_price': final_difference_in_price,
+            'storage_cost': self.storage_cost,
+            'contract_valuation': round(final_difference_in_price - self.storage_cost, 2),
+            'contract_length_in_days': self.contract_length_in_days,
+            'contract_start': self.sorted_dates[0],
+            'contract_end': self.sorted_dates[0] + timedelta(days=self.contract_length_in_days),
+        }
+
+    def bucket_sensitivities(self, price_bump=PRICE_BUMP):
+        # Change of the contract valuation when the forward curve of one month is bumped by price_bump $/MMBtu, for
+        # every month with client actions ('mm/yy': change). All bumps are repriced at once on the cached schedule and
+        # prices: one row of bumped prices per month bucket.
+        months = self.action_dates.astype('datetime64[M]')
+        bucket_months, action_buckets = np.unique(months, return_inverse=True)
+        bumped_prices = self.prices_at_dates + price_bump * (action_buckets.reshape(-1) ==
+                                                             np.arange(len(bucket_months))[:, None])
+        base_value = -(self.prices_at_dates @ self.volumes)
+        bumped_values = -(bumped_prices @ self.volumes)
+        return {month.astype(object).strftime('%m/%y'): float(change) for month, change in
+                zip(bucket_months, bumped_values - base_value)}
+
+
+if __name__ == '__main__':
+    # Example with the contract at the top of contract_pricing: valued once, then its last withdrawal moved a day later.
+    try:
+        contract = ContractRevaluation(cp.injection_dates, cp.withdrawal_dates, cp.injected_natural_gas_volumes,
+                                       cp.withdrawn_natural_gas_volumes, cp.rate_of_injection_or_withdrawal,
+                                       cp.storage_max_capacity, cp.storage_facility_usage_cost,
+                                       cp.injection_withdrawal_cost, cp.cost_of_transport)
+        valuation = contract.revalue()
+        print(f'The contract valuation with all extra costs taken into account is: {valuation["contract_valuation"]}$.')
+        print(f'Change in the contract valuation for a {PRICE_BUMP}$/MMBtu bump of the forward curve in every month:')
+        for month, change in contract.bucket_sensitivities().items():
+            print(f'  {month}: {round(change, 2)}$')
+
+        withdrawal_dates = contract.client_actions['withdrawal'][0]
+        amended_date = (datetime.strptime(withdrawal_dates[-1], cp.DATE_FORMAT) +
+                        timedelta(days=1)).strftime(cp.DATE_FORMAT)
+        valuation = contract.amend_event('withdrawal', len(withdrawal_dates) - 1, date=amended_date)
+        print(f'With the last withdrawal moved to the {amended_date}, the contract valuation is: '
+              f'{valuation["contract_valuation"]}$.')
+    except cp.ContractValidationError as error:
+        print(error)
+        quit()
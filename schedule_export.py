@@ -0,0 +1,198 @@
+"""
+Compact columnar, memory-mapped export of the daily schedules and inventory of every contract.
+
+The daily schedule (injections, withdrawals and the volumes moved every day) and the resulting inventory are otherwise
+only used to check the capacity and then thrown away. This writes them for a whole portfolio into one directory, one
+binary file per column with the days of every contract one after the other:
+
+    injections.bin, withdrawals.bin                  int8, 1 on the days an action is moving volume
+    injection_volumes_per_day.bin,
+    withdrawal_volumes_per_day.bin, inventory.bin    float32 (or int32 for whole MMBtu), in MMBtu
+    contract_ids.npy, offsets.npy, contract_starts.npy
+                                                     index: contract i has the days offsets[i]:offsets[i + 1] of every
+                                                     column, starting on contract_starts[i]
+    metadata.json                                    format version, column dtypes and number of days, written last
+
+A day of the schedule is 10 bytes (2 int8 flags and 2 four-byte volumes), 14 with the inventory, instead of 32 and 40
+as float64 arrays. ScheduleExport opens an export with np.memmap, so reading one contract only touches its own slice of
+every file, without loading the portfolio.
+
+Usage: python schedule_export.py contracts.csv schedules_directory [--int32]
+"""
+
+# All imported and files/scripts libraries here.
+import argparse
+import json
+import os
+import numpy as np
+import contract_pricing as cp
+import daily_schedule as ds
+import portfolio_valuation as pv
+
+EXPORT_FORMAT_VERSION = 1
+FLAG_COLUMNS = ('injections', 'withdrawals')
+VOLUME_COLUMNS = ('injection_volumes_per_day', 'withdrawal_volumes_per_day', 'inventory')
+SCHEDULE_COLUMNS = FLAG_COLUMNS + VOLUME_COLUMNS
+VOLUME_DTYPES = ('float32', 'int32')
+
+
+def compact_volumes(volumes, volume_dtype):
+    # The volumes in the volume dtype of the export. int32 is only possible for whole MMBtu that fit in it.
+    if volume_dtype == 'int32':
+        if np.any(volumes != np.round(volumes)) or np.any(np.abs(volumes) > np.iinfo(np.int32).max):
+            raise ValueError('The volumes are not all whole MMBtu within the int32 range, export them as float32.')
+        return volumes.astype(np.int32)
+    return volumes.astype(np.float32)
+
+
+class ScheduleExportWriter:
+    # Writes the daily schedules of contracts one at a time, appending to the column files, so the portfolio never
+    # needs to be held in memory. Use as a context manager, or call close() to write the index and metadata. When the
+    # with block raises, only the column files are closed: without metadata.json the export stays incomplete.
+
+    def __init__(self, directory, volume_dtype='float32'):
+        if volume_dtype not in VOLUME_DTYPES:
+            raise ValueError(f'The volume dtype must be one of {VOLUME_DTYPES}, not {volume_dtype}.')
+        os.makedirs(directory, exist_ok=True)
+        metadata_path = os.path.join(directory, 'metadata.json')
+        if os.path.exists(metadata_path):
+            os.remove(metadata_path)  # The export is incomplete until the metadata is written again.
+        self.directory = directory
+        self.volume_dtype = volume_dtype
+        self.column_files = {name: open(os.path.join(directory, f'{name}.bin'), 'wb') for name in SCHEDULE_COLUMNS}
+        self.contract_ids = []
+        self.offsets = [0]
+        self.contract_starts = []
+
+    def add_contract(self, contract_id, contract_start, injections, injection_volumes_per_day, withdrawals,
+                     withdrawal_volumes_per_day):
+        # Appends one contract: its id, first day (date or datetime64) and its 4 daily schedule arrays (as made by
+        # daily_schedule.build_daily_schedule). The inventory is worked out here.
+        inventory = ds.daily_inventory(injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day)
+        columns = {
+            'injections': np.asarray(injections).astype(np.int8),
+            'withdrawals': np.asarray(withdrawals).astype(np.int8),
+            'injection_volumes_per_day': compact_volumes(np.asarray(injection_volumes_per_day), self.volume_dtype),
+            'withdrawal_volumes_per_day': compact_volumes(np.asarray(withdrawal_volumes_per_day), self.volume_dtype),
+            'inventory': compact_volumes(inventory, self.volume_dtype),
+        }
+        for name, column in columns.items():
+            column.tofile(self.column_files[name])
+        self.contract_ids.append(str(contract_id))
+        self.offsets.append(self.offsets[-1] + len(inventory))
+        self.contract_starts.append(np.datetime64(contract_start, 'D'))
+
+    def close_column_files(self):
+        for column_file in self.column_files.values():
+            column_file.close()
+
+    def close(self):
+        self.close_column_files()
+        np.save(os.path.join(self.directory, 'contract_ids.npy'), np.array(self.contract_ids, dtype=str))
+        np.save(os.path.join(self.directory, 'offsets.npy'), np.array(self.offsets, dtype=np.int64))
+        np.save(os.path.join(self.directory, 'contract_starts.npy'),
+                np.array(self.contract_starts, dtype='datetime64[D]'))
+        metadata = {
+            'format_version': EXPORT_FORMAT_VERSION,
+            'number_of_contracts': len(self.contract_ids),
+            'number_of_days': self.offsets[-1],
+            'columns': {name: ('int8' if name in FLAG_COLUMNS else self.volume_dtype) for name in SCHEDULE_COLUMNS},
+        }
+        with open(os.path.join(self.directory, 'metadata.json'), 'w') as metadata_file:
+            json.dump(metadata, metadata_file, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, *exception):
+        if exception_type is None:
+            self.close()
+        else:
+            self.close_column_files()
+        return False
+
+
+class ScheduleExport:
+    # An export opened for reading. The columns are memory-mapped and every contract is a slice of them (no copy).
+
+    def __init__(self, directory):
+        metadata_path = os.path.join(directory, 'metadata.json')
+        if not os.path.exists(metadata_path):
+            raise ValueError(f'{directory} is not a complete schedule export (it has no metadata.json).')
+        with open(metadata_path) as metadata_file:
+            self.metadata = json.load(metadata_file)
+        if self.metadata['format_version'] != EXPORT_FORMAT_VERSION:
+            raise ValueError(f'Unknown schedule export format version {self.metadata["format_version"]}.')
+
+        self.contract_ids = np.load(os.path.join(directory, 'contract_ids.npy'))
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'), mmap_mode='r')
+        self.contract_starts = np.load(os.path.join(directory, 'contract_starts.npy'), mmap_mode='r')
+        number_of_days = self.metadata['number_of_days']
+        # np.memmap can not map an empty file, an export without any days gets empty columns.
+        self.columns = {name: (np.memmap(os.path.join(directory, f'{name}.bin'), dtype=dtype, mode='r',
+                                         shape=(number_of_days,)) if number_of_days else np.zeros(0, dtype=dtype))
+                        for name, dtype in self.metadata['columns'].items()}
+        self._contract_positions = None
+
+    def __len__(self):
+        return len(self.contract_ids)
+
+    def contract_position(self, contract_id):
+        # Position of a contract in the export (its row in the index), KeyError if it is not in the export.
+        if self._contract_positions is None:
+            self._contract_positions = {contract: position for position, contract in
+                                        enumerate(self.contract_ids.tolist())}
+        return self._contract_positions[str(contract_id)]
+
+    def contract(self, contract_id):
+        # The daily columns of one contract as read-only views of the memory-mapped files, plus its 'dates'.
+        position = self.contract_position(contract_id)
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        schedule = {name: column[start:end] for name, column in self.columns.items()}
+        schedule['dates'] = self.contract_starts[position] + np.arange(end - start)
+        return schedule
+
+
+def export_portfolio_schedules(contracts, directory, volume_dtype='float32', rate_of_injection_or_withdrawal=None,
+                               storage_max_capacity=None, storage_facility_usage_cost=None,
+                               injection_withdrawal_cost=None, cost_of_transport=None, forward_curve=None):
+    # Values a contract table (see portfolio_valuation.CONTRACT_COLUMNS) and exports the daily schedule and inventory of
+    # every contract without errors, in contract_id order. Returns the valuation results of value_portfolio.
+    columns = pv.contract_table_columns(contracts)
+    defaults = {'rate_of_injection_or_withdrawal': rate_of_injection_or_withdrawal,
+                'storage_max_capacity': storage_max_capacity,
+                'storage_facility_usage_cost': storage_facility_usage_cost,
+                'injection_withdrawal_cost': injection_withdrawal_cost,
+                'cost_of_transport': cost_of_transport}
+    results = pv.value_portfolio(columns, forward_curve=forward_curve, **defaults)
+
+    contract_ids, events, contract_starts, _ = pv.sort_portfolio_events(columns)
+    rate = pv.contract_parameters(columns, events['rows'][contract_starts], defaults)['rate_of_injection_or_withdrawal']
+    contract_ends = np.r_[contract_starts[1:], len(events['contract_codes'])]
+    with ScheduleExportWriter(directory, volume_dtype) as writer:
+        for contract_code in np.flatnonzero(results['error'] == ''):
+            contract_slice = slice(contract_starts[contract_code], contract_ends[contract_code])
+            # Every contract gets its daily schedule, also the ones without overlapping client actions.
+            _, daily_schedule = pv.contract_daily_schedule(events, contract_slice, rate[contract_code])
+            writer.add_contract(contract_ids[contract_code], events['dates'][contract_slice][0], *daily_schedule)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports the daily schedules and inventory of a contract table.')
+    parser.add_argument('contracts', help='contract table (.csv, .parquet or .npy)')
+    parser.add_argument('directory', help='directory to write the export to')
+    parser.add_argument('--int32', action='store_true', help='store the volumes as int32 (whole MMBtu only)')
+    arguments = parser.parse_args()
+
+    # The parameters at the top of contract_pricing are used for any contract without its own values in the table.
+    portfolio_results = export_portfolio_schedules(pv.load_contract_table(arguments.contracts), arguments.directory,
+                                                   'int32' if arguments.int32 else 'float32',
+                                                   rate_of_injection_or_withdrawal=cp.rate_of_injection_or_withdrawal,
+                                                   storage_max_capacity=cp.storage_max_capacity,
+                                                   storage_facility_usage_cost=cp.storage_facility_usage_cost,
+                                                   injection_withdrawal_cost=cp.injection_withdrawal_cost,
+                                                   cost_of_transport=cp.cost_of_transport)
+    export = ScheduleExport(arguments.directory)
+    print(f'Exported the daily schedules of {len(export)} contracts ({export.metadata["number_of_days"]} days) '
+          f'to {arguments.directory}.')
@@ -0,0 +1,166 @@
+"""
+Optimal storage dispatch: the injection/withdrawal schedule that maximises the (intrinsic) value of the facility.
+
+Instead of checking the dates and volumes a client gives, this finds the best ones for a facility (rate and maximum
+capacity), its costs and the forward curve. It is a dynamic program over the days of the horizon and a grid of
+inventory levels between empty and storage_max_capacity. Working backwards from the last day (where the storage must
+be empty again), the best value from every inventory level is
+
+    value(day, level) = max over moves within the daily rate of (cash flow of the move + value(day + 1, level + move))
+
+Buying (injecting) costs the forward price plus the injection/withdrawal cost, selling (withdrawing) earns the price
+minus that cost, and every day with a move pays the transport cost. As the cash flow is linear in the move, the best
+injection (or withdrawal) from every level is a sliding window maximum over the next day's values, which is done for
+all levels at once in NumPy with the van Herk/Gil-Werman block maxima. Every day is then a handful of array operations
+over the inventory grid, so a 2 year daily horizon with thousands of levels takes seconds.
+
+The result uses the same inputs as contract_pricing.value_contract (dates as %d/%m/%y strings and volumes), so it can be
+checked and valued by the existing logic. The monthly storage_facility_usage_cost does not depend on the daily moves
+and is left out of the dynamic program; it is charged by contract_pricing when the schedule is valued.
+"""
+
+# All imported and files/scripts libraries here.
+from datetime import datetime
+import sys
+import numpy as np
+import contract_pricing as cp
+import forward_curve as fc
+
+# Number of inventory levels between an empty and a full storage.
+INVENTORY_LEVELS = 2001
+
+
+def sliding_window_max(values, window):
+    # max(values[start:start + window]) for every start, values past the end count as -inf. Van Herk/Gil-Werman:
+    # running maxima forwards and backwards within blocks of the window size give every window maximum from 2 values.
+    number_of_values = len(values)
+    number_of_blocks = -(-(number_of_values + window - 1) // window)
+    padded_values = np.full(number_of_blocks * window, -np.inf)
+    padded_values[:number_of_values] = values
+    blocks = padded_values.reshape(number_of_blocks, window)
+    maxima_from_block_start = np.maximum.accumulate(blocks, axis=1).reshape(-1)
+    maxima_to_block_end = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1)
+    starts = np.arange(number_of_values)
+    return np.maximum(maxima_to_block_end[starts], maxima_from_block_start[starts + window - 1])
+
+
+def bellman_step(next_values, price, level_volumes, maximum_move, injection_withdrawal_cost, cost_of_transport):
+    # Best value from every inventory level today, given the best values from every level tomorrow.
+    cost_per_volume = injection_withdrawal_cost / 1000000  # Cost per 1m MMBtu.
+    injection_price = price + cost_per_volume
+    withdrawal_price = price - cost_per_volume
+
+    # Injecting from level i to j (i < j <= i + maximum_move) is worth next_values[j] - injection_price * volume(j - i),
+    # so the best injection is a window maximum of next_values[j] - injection_price * volume(j), shifted by one level.
+    best_injection = np.full(len(next_values), -np.inf)
+    best_injection[:-1] = sliding_window_max(next_values - injection_price * level_volumes, maximum_move)[1:]
+    best_injection += injection_price * level_volumes - cost_of_transport
+
+    # Withdrawing from level i to j (i - maximum_move <= j < i), same with the withdrawal price.
+    shifted_values = np.concatenate((np.full(maximum_move, -np.inf), next_values - withdrawal_price * level_volumes))
+    best_withdrawal = sliding_window_max(shifted_values, maximum_move)[:len(next_values)]
+    best_withdrawal += withdrawal_price * level_volumes - cost_of_transport
+
+    return np.maximum(next_values, np.maximum(best_injection, best_withdrawal))
+
+
+def best_move(level, next_values, price, inventory_step, maximum_move, injection_withdrawal_cost, cost_of_transport):
+    # The move (in inventory levels) the dynamic program chose from this level today, no move if it is as good.
+    cost_per_volume = injection_withdrawal_cost / 1000000
+    moves = np.arange(max(-maximum_move, -level), min(maximum_move, len(next_values) - 1 - level) + 1)
+    move_volumes = moves * inventory_step
+    cash_flows = (-price * move_volumes - cost_per_volume * np.abs(move_volumes) -
+                  cost_of_transport * (moves != 0))
+    move_values = cash_flows + next_values[level + moves]
+    best = int(np.argmax(move_values))
+    if next_values[level] >= move_values[best] - 1e-6 * max(1, abs(move_values[best])):
+        return 0
+    return int(moves[best])
+
+
+def solve_storage_dispatch(start_date, end_date, rate_of_injection_or_withdrawal, storage_max_capacity,
+                           injection_withdrawal_cost, cost_of_transport, inventory_levels=INVENTORY_LEVELS,
+                           forward_curve=None):
+    # Finds the value-maximising daily schedule between start_date and end_date (strings in the form %d/%m/%y), the
+    # storage being empty at the start and at the end. Returns a dictionary with the client action dates and volumes
+    # (same form as the inputs of contract_pricing.value_contract), the daily inventory and the optimal value.
+    if forward_curve is None:
+        forward_curve = fc.load_forward_curve()
+    first_date = np.datetime64(datetime.strptime(start_date, cp.DATE_FORMAT).date(), 'D')
+    last_date = np.datetime64(datetime.strptime(end_date, cp.DATE_FORMAT).date(), 'D')
+    days = np.arange(first_date, last_date + 1, dtype='datetime64[D]')
+    prices = forward_curve.prices_at(days)
+
+    # Whole MMBtu steps when the capacity allows it, so the volumes add up to exactly 0 at the end of the contract.
+    inventory_step = storage_max_capacity / (inventory_levels - 1)
+    if inventory_step >= 1:
+        inventory_step = float(np.floor(inventory_step))
+    level_volumes = np.arange(inventory_levels) * inventory_step
+    maximum_move = int(rate_of_injection_or_withdrawal // inventory_step)
+    if maximum_move < 1:
+        raise ValueError(f'The daily rate of {rate_of_injection_or_withdrawal} MMBtu is smaller than one inventory '
+                         f'step of {inventory_step} MMBtu, use more inventory levels.')
+
+    # Values after the last day: the storage must be empty, i.e. the volume balance of the contract.
+    values_by_day = np.empty((len(days) + 1, inventory_levels))
+    values_by_day[-1] = -np.inf
+    values_by_day[-1, 0] = 0
+    for day in range(len(days) - 1, -1, -1):
+        values_by_day[day] = bellman_step(values_by_day[day + 1], prices[day], level_volumes, maximum_move,
+                                          injection_withdrawal_cost, cost_of_transport)
+
+    # Following the best moves forwards from an empty storage gives the schedule.
+    schedule = {'injection_dates': [], 'withdrawal_dates': [], 'injected_natural_gas_volumes': [],
+                'withdrawn_natural_gas_volumes': []}
+    inventory = np.empty(len(days))
+    level = 0
+    for day, date in enumerate(days):
+        move = best_move(level, values_by_day[day + 1], prices[day], inventory_step, maximum_move,
+                         injection_withdrawal_cost, cost_of_transport)
+        action_date = date.astype(object).strftime(cp.DATE_FORMAT)
+        if move > 0:
+            schedule['injection_dates'].append(action_date)
+            schedule['injected_natural_gas_volumes'].append(move * inventory_step)
+        elif move < 0:
+            schedule['withdrawal_dates'].append(action_date)
+            schedule['withdrawn_natural_gas_volumes'].append(-move * inventory_step)
+        level += move
+        inventory[day] = level * inventory_step
+
+    schedule['inventory'] = inventory
+    schedule['optimal_value'] = float(values_by_day[0, 0])
+    return schedule
+
+
+def value_storage_dispatch(start_date, end_date, rate_of_injection_or_withdrawal, storage_max_capacity,
+                           storage_facility_usage_cost, injection_withdrawal_cost, cost_of_transport,
+                           inventory_levels=INVENTORY_LEVELS, forward_curve=None):
+    # Solves the dispatch and runs the resulting schedule through contract_pricing.value_contract, which checks it
+    # against the rate and capacity and values it. Returns (schedule, valuation).
+    schedule = solve_storage_dispatch(start_date, end_date, rate_of_injection_or_withdrawal, storage_max_capacity,
+                                      injection_withdrawal_cost, cost_of_transport, inventory_levels, forward_curve)
+    if not schedule['injection_dates']:
+        return schedule, None  # Moving no gas at all is the best the facility can do over this horizon.
+    valuation = cp.value_contract(schedule['injection_dates'], schedule['withdrawal_dates'],
+                                  schedule['injected_natural_gas_volumes'], schedule['withdrawn_natural_gas_volumes'],
+                                  rate_of_injection_or_withdrawal, storage_max_capacity, storage_facility_usage_cost,
+                                  injection_withdrawal_cost, cost_of_transport, forward_curve=forward_curve)
+    return schedule, valuation
+
+
+if __name__ == '__main__':
+    # Usage: python storage_dispatch.py [start date] [end date], with the facility parameters of contract_pricing.
+    horizon_start = sys.argv[1] if len(sys.argv) > 1 else '01/04/22'
+    horizon_end = sys.argv[2] if len(sys.argv) > 2 else '31/03/24'
+    optimal_schedule, optimal_valuation = value_storage_dispatch(horizon_start, horizon_end,
+                                                                 cp.rate_of_injection_or_withdrawal,
+                                                                 cp.storage_max_capacity,
+                                                                 cp.storage_facility_usage_cost,
+                                                                 cp.injection_withdrawal_cost, cp.cost_of_transport)
+    print(f'Optimal dispatch from the {horizon_start} until the {horizon_end}: '
+          f'{len(optimal_schedule["injection_dates"])} injection days and '
+          f'{len(optimal_schedule["withdrawal_dates"])} withdrawal days, worth '
+          f'{round(optimal_schedule["optimal_value"], 2)}$ before the monthly storage usage cost.')
+    if optimal_valuation is not None:
+        print(f'The contract valuation of this schedule with all extra costs taken into account is: '
+              f'{optimal_valuation["contract_valuation"]}$.')
@@ -0,0 +1,309 @@
+"""
+Streaming valuation of client actions arriving as a long JSONL or CSV feed.
+
+Instead of lists of dates and volumes held in memory, the client actions are read one line at a time. Every event is a
+line with the columns of portfolio_valuation.CONTRACT_COLUMNS (contract_id, action, date, volume, optionally the
+contract parameters). Events are grouped by contract_id and every open contract only keeps a few running totals: the
+volume balance, the cumulative inventory check, the overlap check, the daily storage queues and the priced cash flows.
+A contract closes on an event with the action 'close' (or when the feed ends) and its valuation record is yielded right
+away, so the memory used depends on the number of open contracts and not on the size of the feed.
+
+The events of one contract must arrive in chronological order, events on the same date may come in any order (the
+injections are applied first, like contract_pricing does).
+
+Usage: python streaming_valuation.py events.jsonl (or events.csv) > results.jsonl
+"""
+
+# All imported and files/scripts libraries here.
+from datetime import datetime, timedelta
+from functools import lru_cache
+import csv
+import json
+import sys
+import numpy as np
+import contract_pricing as cp
+import daily_schedule as ds
+import forward_curve as fc
+import portfolio_valuation as pv
+
+CLOSE_ACTIONS = ('close', 'end')
+
+
+@lru_cache(maxsize=4096)
+def parse_event_date(date):
+    # Dates repeat a lot in a feed, every distinct date string is only parsed once.
+    return datetime.strptime(date, cp.DATE_FORMAT)
+
+
+def read_events(lines, file_format='jsonl'):
+    # Turns the lines of a JSONL or CSV feed into event dictionaries, one line at a time.
+    if file_format == 'csv':
+        yield from csv.DictReader(lines)
+    else:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+class StreamingContract:
+    # The running state of one open contract.
+
+    def __init__(self, contract_id, parameters, forward_curve):
+        self.contract_id = contract_id
+        self.forward_curve = forward_curve
+        self.rate = parameters['rate_of_injection_or_withdrawal']
+        self.storage_max_capacity = parameters['storage_max_capacity']
+        self.parameters = parameters
+        self.error = ''
+
+        self.first_date = None
+        self.current_date = None
+        self.pending_events = []  # Events of current_date, applied once a later date (or the close) arrives.
+        self.number_of_client_actions = 0
+        self.volume_balance = 0
+        self.total_handled_natural_gas_by_facility = 0
+        self.total_prices = 0
+        self.previous_event = None  # (date, volume) of the previous client action, for the overlap check.
+        self.previous_withdrawal = None  # (date, volume) of the previous withdrawal, for the contract length.
+        self.client_action_overlap = False
+        self.extra_needed_days = 0
+        self.last_volume = 0
+
+        # Cumulative inventory check (contracts without overlap) and daily storage queues (contracts with overlap).
+        # Which of the two applies is only known once the contract closes, so the first problem of both is kept.
+        self.cumulative_volume = 0
+        self.cumulative_error = ''
+        self.day = 0  # Next day of the daily queues to move volume on, counted from the first date.
+        self.injection_backlog = 0
+        self.withdrawal_backlog = 0
+        self.daily_inventory = 0
+        self.daily_error = ''
+
+    def add_event(self, date, volume):
+        # Adds one client action (withdrawals have a negative volume).
+        if self.error:
+            return
+        if self.current_date is not None and date < self.current_date:
+            self.error = 'The client actions of a contract must arrive in chronological order.'
+            return
+        if date != self.current_date:
+            self.apply_pending_events()
+            self.current_date = date
+        self.pending_events.append(volume)
+
+    def apply_pending_events(self):
+        # Applies the events of current_date, injections first, to every running total.
+        if not self.pending_events:
+            return
+        date = self.current_date
+        if self.first_date is None:
+            self.first_date = date
+        day = (date - self.first_date).days
+        self.move_daily_volumes(day)
+        price_at_date = self.forward_curve.price_at(np.datetime64(date.date(), 'D'))
+
+        for volume in sorted(self.pending_events, key=lambda volume: volume < 0):
+            # Same overlap rule as contract_pricing.detect_client_action_overlap, with the previous client action.
+            if self.previous_event is not None:
+                previous_date, previous_volume = self.previous_event
+                if np.ceil(previous_volume / self.rate) >= (date - previous_date).days:
+                    self.client_action_overlap = True
+            self.previous_event = (date, volume)
+
+            # Same extra days past the final date as contract_pricing.overlap_contract_length, one withdrawal at a time.
+            if volume < 0:
+                if self.previous_withdrawal is not None:
+                    previous_date, previous_volume = self.previous_withdrawal
+                    allowed_days = (date - previous_date).days
+                    if abs(np.ceil(previous_volume / self.rate)) + self.extra_needed_days >= allowed_days:
+                        self.extra_needed_days += (abs(previous_volume) - allowed_days * self.rate) / self.rate
+                    else:
+                        self.extra_needed_days = 0
+                self.previous_withdrawal = (date, volume)
+                self.withdrawal_backlog += -volume
+            else:
+                self.injection_backlog += volume
+
+            # Same checks as contract_pricing.check_cumulative_inventory.
+            self.cumulative_volume += volume
+            if not self.cumulative_error:
+                if self.cumulative_volume > self.storage_max_capacity:
+                    self.cumulative_error = cp.too_large_injection_message(pv.format_volume(volume),
+                                                                           pv.format_volume(self.storage_max_capacity))
+                elif self.cumulative_volume < 0:
+                    self.cumulative_error = cp.too_large_withdraw_message(pv.format_volume(-volume))
+
+            self.number_of_client_actions += 1
+            self.volume_balance += volume
+            self.total_handled_natural_gas_by_facility += abs(volume)
+            self.total_prices += price_at_date * volume  # Since price from model is dollar per MMBtu.
+            self.last_volume = volume
+        self.pending_events = []
+
+    def move_daily_volumes(self, until_day):
+        # Moves the injection and withdrawal backlogs at the daily rate from self.day until (not including) until_day,
+        # checking the storage never goes over its capacity or below empty, like contract_pricing.check_daily_inventory.
+        # Only the days on which some volume is still moving are looked at, after that the inventory stays the same.
+        number_of_days = until_day - self.day
+        if number_of_days <= 0:
+            return
+        moving_days = min(number_of_days,
+                          int(np.ceil(max(self.injection_backlog, self.withdrawal_backlog) / self.rate)))
+        if moving_days > 0 and not self.daily_error:
+            days_moved = np.arange(1, moving_days + 1) * self.rate
+            inventory = (self.daily_inventory + np.minimum(self.injection_backlog, days_moved) -
+                         np.minimum(self.withdrawal_backlog, days_moved))
+            delta_day, violation = ds.first_inventory_violation(inventory, self.storage_max_capacity)
+            if violation is not None:
+                violation_date = (self.first_date + timedelta(days=self.day + delta_day)).strftime(cp.DATE_FORMAT)
+                self.daily_error = (cp.storage_overflow_message(violation_date) if violation == 'overflow'
+                                    else cp.storage_empty_message(violation_date))
+
+        injected = min(self.injection_backlog, number_of_days * self.rate)
+        withdrawn = min(self.withdrawal_backlog, number_of_days * self.rate)
+        self.injection_backlog -= injected
+        self.withdrawal_backlog -= withdrawn
+        self.daily_inventory += injected - withdrawn
+        self.day = until_day
+
+    def close(self):
+        # Finishes the contract and returns its valuation record (same fields as portfolio_valuation.RESULT_COLUMNS).
+        if not self.error:
+            self.apply_pending_events()
+        record = {'contract_id': self.contract_id, 'contract_valuation': None, 'final_difference_in_price': None,
+                  'storage_cost': None, 'contract_start': None, 'contract_end': None,
+                  'contract_length_in_days': None, 'error': self.error}
+        if self.error:
+            return record
+        if self.first_date is None:
+            record['error'] = 'The contract has no client actions.'
+            return record
+
+        last_date = self.current_date
+        if self.volume_balance != 0:
+            record['error'] = cp.UNBALANCED_VOLUME_MESSAGE
+            return record
+
+        if self.client_action_overlap:
+            # Days needed for last action (withdrawal).
+            extra_needed_days = self.extra_needed_days
+            if self.last_volume < 0:
+                extra_needed_days += abs(self.last_volume) / self.rate
+            contract_length_in_days = int(np.ceil((last_date - self.first_date).days + extra_needed_days))
+            # Same as contract_pricing.overlap_contract_length, at least until the volume of both queues is moved.
+            contract_length_in_days = max(contract_length_in_days, self.day + int(np.ceil(
+                max(self.injection_backlog, self.withdrawal_backlog) / self.rate)))
+            self.move_daily_volumes(contract_length_in_days)
+            error = self.daily_error
+        else:
+            contract_length_in_days = (last_date - self.first_date).days + abs(self.last_volume) / self.rate
+            error = self.cumulative_error
+        if error:
+            record['error'] = error
+            return record
+
+        final_difference_in_price = round(self.total_prices * -1, 2)
+        storage_cost = cp.contract_storage_cost(cp.contract_months(self.first_date, last_date),
+                                                self.total_handled_natural_gas_by_facility,
+                                                self.number_of_client_actions,
+                                                self.parameters['storage_facility_usage_cost'],
+                                                self.parameters['injection_withdrawal_cost'],
+                                                self.parameters['cost_of_transport'])
+        record.update({
+            'contract_valuation': round(final_difference_in_price - storage_cost, 2),
+            'final_difference_in_price': final_difference_in_price,
+            'storage_cost': storage_cost,
+            'contract_start': self.first_date.strftime(cp.DATE_FORMAT),
+            'contract_end': (self.first_date + timedelta(days=contract_length_in_days)).strftime(cp.DATE_FORMAT),
+            'contract_length_in_days': contract_length_in_days,
+        })
+        return record
+
+
+def event_parameters(event, defaults):
+    # The contract parameters from the first event of a contract, or the defaults for the ones it does not have.
+    # Returns the parameters and the error of the contract, '' unless a parameter is missing, can not be read or can
+    # not be used (see portfolio_valuation.parameter_error). Those get a placeholder of 1, the contract is not valued.
+    parameters = {}
+    error = ''
+    for name in pv.PARAMETER_COLUMNS:
+        value = event.get(name)
+        if value in (None, ''):
+            value = defaults.get(name)
+        try:
+            parameters[name] = np.nan if value is None else float(value)
+        except (TypeError, ValueError):
+            parameters[name] = np.nan
+            error = error or 'Some contract parameters could not be read, they must be numbers.'
+        parameter_error = pv.parameter_error(name, parameters[name])
+        if parameter_error:
+            error = error or parameter_error
+            parameters[name] = 1.
+    return parameters, error
+
+
+def value_event_stream(events, rate_of_injection_or_withdrawal=None, storage_max_capacity=None,
+                       storage_facility_usage_cost=None, injection_withdrawal_cost=None, cost_of_transport=None,
+                       forward_curve=None):
+    # Values the contracts of a stream of events (dictionaries, e.g. from read_events), yielding the valuation record
+    # of every contract as soon as it closes. Contracts still open when the stream ends are closed then.
+    defaults = {'rate_of_injection_or_withdrawal': rate_of_injection_or_withdrawal,
+                'storage_max_capacity': storage_max_capacity,
+                'storage_facility_usage_cost': storage_facility_usage_cost,
+                'injection_withdrawal_cost': injection_withdrawal_cost,
+                'cost_of_transport': cost_of_transport}
+    if forward_curve is None:
+        forward_curve = fc.load_forward_curve()
+
+    open_contracts = {}
+    for event in events:
+        contract_id = str(event['contract_id'])
+        action = str(event['action']).strip().lower()
+        contract = open_contracts.get(contract_id)
+        if contract is None:
+            parameters, error = event_parameters(event, defaults)
+            contract = StreamingContract(contract_id, parameters, forward_curve)
+            contract.error = error
+            open_contracts[contract_id] = contract
+
+        if action in CLOSE_ACTIONS:
+            yield open_contracts.pop(contract_id).close()
+            continue
+        try:
+            date = parse_event_date(event.get('date'))
+        except (TypeError, ValueError):  # Missing (None), not a string or not in the form dd/mm/yy.
+            contract.error = 'Some client action dates could not be read, they must be in the form dd/mm/yy.'
+            continue
+        try:
+            volume = float(event['volume'])
+        except (KeyError, TypeError, ValueError):
+            volume = np.nan
+        if not np.isfinite(volume):
+            contract.error = 'Some client action volumes could not be read, they must be numbers.'
+            continue
+        if action in pv.WITHDRAWAL_ACTIONS:
+            contract.add_event(date, -volume)  # - for removing volume.
+        elif action in pv.INJECTION_ACTIONS:
+            contract.add_event(date, volume)
+        else:
+            contract.error = "Every client action must be either an 'injection' or a 'withdrawal'."
+
+    for contract_id in list(open_contracts):
+        yield open_contracts.pop(contract_id).close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__.strip().splitlines()[-1])
+        quit()
+
+    with open(sys.argv[1], newline='') as event_file:
+        # The parameters at the top of contract_pricing are used for any contract without its own values.
+        for valuation_record in value_event_stream(read_events(event_file, 'csv' if sys.argv[1].endswith('.csv')
+                                                               else 'jsonl'),
+                                                   rate_of_injection_or_withdrawal=cp.rate_of_injection_or_withdrawal,
+                                                   storage_max_capacity=cp.storage_max_capacity,
+                                                   storage_facility_usage_cost=cp.storage_facility_usage_cost,
+                                                   injection_withdrawal_cost=cp.injection_withdrawal_cost,
+                                                   cost_of_transport=cp.cost_of_transport):
+            print(json.dumps(valuation_record))
@@ -0,0 +1,102 @@
+"""
+Checks the vectorised daily schedules of daily_schedule against the original loops of contract_pricing.
+
+Run with: python -m pytest test_daily_schedule.py
+"""
+
+# All imported and files/scripts libraries here.
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+import contract_pricing as cp
+import daily_schedule as ds
+
+DATE_OF_FIRST_ACTION = datetime(2021, 12, 11)
+# Number of random contracts compared with the loops, and the daily rates they are drawn with.
+NUMBER_OF_RANDOM_CONTRACTS = 2000
+RANDOM_RATES = (50000, 1000, 7, 333.5)
+
+# Overlapping contracts the vectorised schedules are checked against, as (injection days, injection volumes,
+# withdrawal days, withdrawal volumes, contract length in days, rate). The first one is the example contract at the top
+# of contract_pricing.
+REGRESSION_CONTRACTS = [
+    ([0, 2, 4, 6], [100002, 100003, 700000, 100000], [3, 5, 7], [300000, 600005, 100000], 24, 50000),
+    ([0, 1], [75000, 100000], [10], [175000], 14, 50000),
+    ([0, 1, 1, 3], [50000, 60000, 10, 120000], [5, 6, 6], [100000, 100000, 30010], 12, 50000),
+    ([0, 0, 2], [125000, 125000, 1], [4, 5, 8], [1, 200000, 50000], 13, 50000),
+    ([0, 3], [30000, 30000], [3, 4], [20000, 40000], 6, 25000),
+    ([0, 1, 2, 3, 4], [199999, 1, 99999, 100001, 50000], [30, 31], [250000, 200000], 40, 50000),
+]
+
+
+def loop_schedule(injection_days, injection_volumes, withdrawal_days, withdrawal_volumes, contract_length_in_days,
+                  rate):
+    # The daily schedule of the original loops, for action days counted from the first injection.
+    return cp.build_daily_schedule_loops(
+        [DATE_OF_FIRST_ACTION + timedelta(days=day) for day in injection_days], injection_volumes,
+        [DATE_OF_FIRST_ACTION + timedelta(days=day) for day in withdrawal_days],
+        [-volume for volume in withdrawal_volumes], contract_length_in_days, rate)
+
+
+def assert_same_schedule(contract):
+    loop_arrays = loop_schedule(*contract)
+    vectorised_arrays = ds.build_daily_schedule(*contract)
+    for loop_array, vectorised_array in zip(loop_arrays, vectorised_arrays):
+        np.testing.assert_array_equal(vectorised_array, loop_array)
+
+
+def random_contract(rng):
+    # A random contract with the first injection on day 0 (where the loops count the days from) and a length long
+    # enough for all of its volume to be moved, as contract_pricing.overlap_contract_length makes sure of.
+    rate = RANDOM_RATES[rng.integers(len(RANDOM_RATES))]
+    injection_days = np.sort(rng.integers(0, 21, rng.integers(1, 7)))
+    injection_days[0] = 0
+    withdrawal_days = np.sort(rng.integers(0, 31, rng.integers(1, 7)))
+    whole_rate = int(rate)
+    injection_volumes = [int(rng.choice([rng.integers(0, 5 * whole_rate + 1), whole_rate, 2 * whole_rate]))
+                         for _ in injection_days]
+    withdrawal_volumes = [int(rng.integers(0, 5 * whole_rate + 1)) for _ in withdrawal_days]
+    contract_length_in_days = max(int(rng.integers(max(injection_days.max(), withdrawal_days.max()) + 1, 61)),
+                                  ds.queue_end_day(injection_days, injection_volumes, rate),
+                                  ds.queue_end_day(withdrawal_days, withdrawal_volumes, rate))
+    return (injection_days.tolist(), injection_volumes, withdrawal_days.tolist(), withdrawal_volumes,
+            contract_length_in_days, rate)
+
+
+@pytest.mark.parametrize('contract', REGRESSION_CONTRACTS)
+def test_regression_contracts_match_loops(contract):
+    assert_same_schedule(contract)
+
+
+def test_random_contracts_match_loops():
+    rng = np.random.default_rng(20211211)
+    for _ in range(NUMBER_OF_RANDOM_CONTRACTS):
+        assert_same_schedule(random_contract(rng))
+
+
+def test_every_volume_is_moved():
+    # An injection queued behind earlier ones after the last withdrawal: the contract lasts until it has been moved.
+    dates = [datetime(2022, 5, 21), datetime(2022, 5, 30), datetime(2022, 6, 8), datetime(2022, 6, 8),
+             datetime(2022, 6, 9)]
+    volumes = [98760, 125000, 100000, -473760, 150000]
+    contract_length_in_days = cp.overlap_contract_length(dates, volumes, [dates[3]], [volumes[3]], 50000)
+    injection_days = [(date - dates[0]).days for date, volume in zip(dates, volumes) if volume > 0]
+    injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day = ds.build_daily_schedule(
+        injection_days, [volume for volume in volumes if volume > 0], [(dates[3] - dates[0]).days], [volumes[3]],
+        contract_length_in_days, 50000)
+    assert np.sum(injections * injection_volumes_per_day) == 473760
+    assert np.sum(withdrawals * withdrawal_volumes_per_day) == 473760
+
+
+def test_contract_length_is_kept_when_no_volume_is_cut_off():
+    # The action days of these withdrawals end a day after the last volume is moved, the original length of 17 days
+    # (until the 31/05/22) already moves every volume and must stay the same.
+    dates = [datetime(2022, 5, 14), datetime(2022, 5, 22), datetime(2022, 5, 26), datetime(2022, 5, 26),
+             datetime(2022, 5, 28)]
+    volumes = [100001, 75002, 50001, -158944, -66060]
+    assert cp.overlap_contract_length(dates, volumes, dates[3:], volumes[3:], 50000) == 17
+
+
+def test_too_short_contract_is_refused():
+    with pytest.raises(ValueError):
+        ds.build_daily_schedule([0, 1], [100000, 100000], [4], [200000], 4, 50000)
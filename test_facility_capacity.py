@@ -0,0 +1,128 @@
+"""
+Checks the combined site timelines and violating days of facility_capacity against the contracts added up one calendar
+day at a time, with the original schedule loops of contract_pricing.
+
+Run with: python -m pytest test_facility_capacity.py
+"""
+
+# All imported and files/scripts libraries here.
+import numpy as np
+import contract_pricing as cp
+import daily_schedule as ds
+import facility_capacity as fac
+import portfolio_valuation as pv
+from conftest import RATE_OF_INJECTION_OR_WITHDRAWAL, contract_table
+
+SITES = ('north', 'south')
+FACILITY_MAX_CAPACITY = {'north': 1500000, 'south': 2500000}
+FACILITY_RATE = 150000
+
+
+def loop_contract_days(contract):
+    # The calendar days of one contract as {date: (inventory, injected volume, withdrawn volume)}, or None if it can
+    # not be put on the site's timeline (unbalanced, withdrawing gas it does not have, or not ending empty).
+    sorted_dates, sorted_volumes = cp.sort_client_actions(contract['injection_dates'], contract['withdrawal_dates'],
+                                                          contract['injected_natural_gas_volumes'],
+                                                          contract['withdrawn_natural_gas_volumes'])
+    try:
+        cp.check_volume_balance(sorted_volumes)
+    except cp.ContractValidationError:
+        return None
+    sorted_injections = cp.sort_dates_and_volumes(contract['injection_dates'],
+                                                  contract['injected_natural_gas_volumes'])
+    sorted_withdrawals = cp.sort_dates_and_volumes(contract['withdrawal_dates'],
+                                                   [-volume for volume in contract['withdrawn_natural_gas_volumes']])
+    contract_length_in_days = cp.overlap_contract_length(sorted_dates, sorted_volumes, *sorted_withdrawals,
+                                                         RATE_OF_INJECTION_OR_WITHDRAWAL)
+    injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day = cp.build_daily_schedule_loops(
+        *sorted_injections, *sorted_withdrawals, contract_length_in_days, RATE_OF_INJECTION_OR_WITHDRAWAL)
+    inventory = ds.daily_inventory(injections, injection_volumes_per_day, withdrawals, withdrawal_volumes_per_day)
+    if inventory.min() < 0 or inventory[-1] != 0:
+        return None
+    first_date = np.datetime64(sorted_dates[0].date(), 'D')
+    return {first_date + day: (inventory[day], injections[day] * injection_volumes_per_day[day],
+                               withdrawals[day] * withdrawal_volumes_per_day[day])
+            for day in range(contract_length_in_days)}
+
+
+def loop_site_report(site_contracts, facility_max_capacity):
+    # The timeline, violating days (date, violation, contract ids) and left out contracts of one site, adding up the
+    # contracts one calendar day at a time.
+    net_volumes, injected, withdrawn, holding, injecting, withdrawing = {}, {}, {}, {}, {}, {}
+    excluded_contracts = set()
+    for contract in site_contracts:
+        contract_days = loop_contract_days(contract)
+        if contract_days is None:
+            excluded_contracts.add(contract['contract_id'])
+            continue
+        for date, (inventory, injected_volume, withdrawn_volume) in contract_days.items():
+            net_volumes[date] = net_volumes.get(date, 0) + injected_volume - withdrawn_volume
+            injected[date] = injected.get(date, 0) + injected_volume
+            withdrawn[date] = withdrawn.get(date, 0) + withdrawn_volume
+            for contributors, volume in ((holding, inventory), (injecting, injected_volume),
+                                         (withdrawing, withdrawn_volume)):
+                if volume > 0:
+                    contributors.setdefault(date, []).append(contract['contract_id'])
+
+    dates = np.arange(min(net_volumes), max(net_volumes) + 1, dtype='datetime64[D]')
+    timeline = {
+        'inventory': np.cumsum([net_volumes.get(date, 0) for date in dates]),
+        'injection_volumes_per_day': np.array([injected.get(date, 0) for date in dates], dtype=float),
+        'withdrawal_volumes_per_day': np.array([withdrawn.get(date, 0) for date in dates], dtype=float),
+    }
+    violations = []
+    for day, date in enumerate(dates):
+        for violation, volume, limit, contributors in (
+                ('capacity', timeline['inventory'][day], facility_max_capacity, holding),
+                ('injection_rate', timeline['injection_volumes_per_day'][day], FACILITY_RATE, injecting),
+                ('withdrawal_rate', timeline['withdrawal_volumes_per_day'][day], FACILITY_RATE, withdrawing)):
+            if volume > limit:
+                violations.append((date.astype(object).strftime(cp.DATE_FORMAT), violation,
+                                   sorted(contributors[date])))
+    return dates[0], timeline, violations, excluded_contracts
+
+
+def test_site_totals_match_loops(random_contracts):
+    table = contract_table(random_contracts)
+    contract_sites = {contract['contract_id']: SITES[position % len(SITES)]
+                      for position, contract in enumerate(random_contracts)}
+    table['site'] = [contract_sites[contract_id] for contract_id in table['contract_id']]
+
+    reports = fac.check_facility_capacity(table, FACILITY_MAX_CAPACITY, FACILITY_RATE,
+                                          rate_of_injection_or_withdrawal=RATE_OF_INJECTION_OR_WITHDRAWAL)
+    assert [report['site'] for report in reports] == list(SITES)
+    for report in reports:
+        start_date, timeline, violations, excluded_contracts = loop_site_report(
+            [contract for contract in random_contracts if contract_sites[contract['contract_id']] == report['site']],
+            FACILITY_MAX_CAPACITY[report['site']])
+        assert report['start_date'] == start_date
+        for name, combined_volumes in timeline.items():
+            np.testing.assert_array_equal(report[name], combined_volumes)
+        assert [(violation['date'], violation['violation'], sorted(violation['contract_ids']))
+                for violation in report['violations']] == violations
+        assert set(report['excluded_contracts']) == excluded_contracts
+        assert {violation['violation'] for violation in report['violations']} == {'capacity', 'injection_rate',
+                                                                                   'withdrawal_rate'}
+
+
+def test_empty_table():
+    assert fac.check_facility_capacity({name: [] for name in pv.CONTRACT_COLUMNS}, 2000000, 100000,
+                                       rate_of_injection_or_withdrawal=RATE_OF_INJECTION_OR_WITHDRAWAL) == []
+
+
+def test_unreadable_date_is_left_out(random_contracts):
+    table = contract_table(random_contracts[:20])
+    for name, value in (('contract_id', 'bad_date'), ('action', 'injection'), ('date', '31/02/22'),
+                        ('volume', 1000), ('storage_max_capacity', 2000000)):
+        table[name].append(value)
+    for name, value in (('contract_id', 'bad_date'), ('action', 'withdrawal'), ('date', '01/03/22'),
+                        ('volume', 1000), ('storage_max_capacity', 2000000)):
+        table[name].append(value)
+
+    report, = fac.check_facility_capacity(table, np.inf, np.inf,
+                                          rate_of_injection_or_withdrawal=RATE_OF_INJECTION_OR_WITHDRAWAL)
+    _, timeline, _, _ = loop_site_report(random_contracts[:20], np.inf)
+    assert report['excluded_contracts']['bad_date'] == ('Some client action dates could not be read, they must be in '
+                                                        'the form dd/mm/yy.')
+    assert report['violations'] == []
+    np.testing.assert_array_equal(report['inventory'], timeline['inventory'])
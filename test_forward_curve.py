@@ -0,0 +1,53 @@
+"""
+Checks that the in-memory and disk caches of forward_curve.load_forward_curve never mix up two pricing models.
+
+Run with: python -m pytest test_forward_curve.py
+"""
+
+# All imported and files/scripts libraries here.
+import pytest
+import forward_curve as fc
+from conftest import sine_price_model
+
+
+def flat_price_model(month_index):
+    # A pricing model of 10 $/MMBtu every month.
+    return 10.
+
+
+def shifted_price_model(shift):
+    # Pricing models made by the same function, so with the same module and name, e.g. a model refitted every day.
+    def price_model(month_index):
+        return sine_price_model(month_index) + shift
+    return price_model
+
+
+@pytest.fixture(autouse=True)
+def no_loaded_curves():
+    fc.clear_loaded_curves()
+    yield
+    fc.clear_loaded_curves()
+
+
+def test_models_with_the_same_name_and_version_are_kept_apart(tmp_path):
+    flat_curve = fc.load_forward_curve(flat_price_model, name='model', cache_directory=tmp_path)
+    sine_curve = fc.load_forward_curve(sine_price_model, name='model', cache_directory=tmp_path)
+    assert flat_curve is not sine_curve
+    assert flat_curve.price_at('2022-03-01') == 10.
+    assert sine_curve.price_at('2022-03-01') != 10.
+    assert fc.load_forward_curve(flat_price_model, name='model', cache_directory=tmp_path) is flat_curve
+
+    # After a restart, every model reads back its own saved curve.
+    fc.clear_loaded_curves()
+    assert flat_curve.cache_path != sine_curve.cache_path
+    reloaded_sine_curve = fc.load_forward_curve(sine_price_model, name='model', cache_directory=tmp_path)
+    assert reloaded_sine_curve.price_at('2022-03-01') == sine_curve.price_at('2022-03-01')
+
+
+def test_another_model_made_by_the_same_function_is_refused(tmp_path):
+    fc.load_forward_curve(shifted_price_model(0.), name='model', cache_directory=tmp_path)
+    with pytest.raises(ValueError):
+        fc.load_forward_curve(shifted_price_model(1.), name='model', cache_directory=tmp_path)
+    shifted_curve = fc.load_forward_curve(shifted_price_model(1.), name='model', model_version='shifted',
+                                          cache_directory=tmp_path)
+    assert shifted_curve.price_at('2022-03-01') == sine_price_model(fc.date_month_indices(['2022-03-01'])[0]) + 1.
@@ -0,0 +1,52 @@
+"""
+Checks that parallel_valuation gives bit-identical results to a serial portfolio_valuation.value_portfolio run.
+
+Run with: python -m pytest test_parallel_valuation.py
+"""
+
+# All imported and files/scripts libraries here.
+import numpy as np
+import forward_curve as fc
+import parallel_valuation as par
+import portfolio_valuation as pv
+from conftest import PARAMETERS, contract_table, sine_price_model
+
+
+def assert_same_results(parallel_results, serial_results):
+    assert set(parallel_results) == set(pv.RESULT_COLUMNS)
+    for name in pv.RESULT_COLUMNS:
+        np.testing.assert_array_equal(parallel_results[name], serial_results[name])
+
+
+def test_parallel_matches_serial(random_contract_table, forward_curve):
+    serial_results = pv.value_portfolio(random_contract_table, forward_curve=forward_curve, **PARAMETERS)
+    parallel_results = par.value_portfolio_parallel(random_contract_table, workers=2, chunk_size=37,
+                                                    forward_curve=forward_curve, **PARAMETERS)
+    assert_same_results(parallel_results, serial_results)
+
+
+def test_empty_table(forward_curve):
+    for workers in (1, 2):
+        results = par.value_portfolio_parallel({name: [] for name in pv.CONTRACT_COLUMNS}, workers=workers,
+                                               forward_curve=forward_curve, storage_max_capacity=2000000,
+                                               **PARAMETERS)
+        assert set(results) == set(pv.RESULT_COLUMNS)
+        assert all(len(column) == 0 for column in results.values())
+
+
+def test_unreadable_date_with_a_curve_starting_after_2020(random_contracts):
+    # Every readable date is on the curve, only the placeholder of the unreadable date is not. The workers can not
+    # extend the shared curve, so it must already be grown to cover it.
+    table = contract_table(random_contracts[:40])
+    for name, value in (('contract_id', 'bad_date'), ('action', 'injection'), ('date', '31/02/22'),
+                        ('volume', 1000), ('storage_max_capacity', 2000000)):
+        table[name].append(value)
+    serial_curve = fc.ForwardCurve(sine_price_model, name='sine_price_model', start_date='2021-01-01')
+    parallel_curve = fc.ForwardCurve(sine_price_model, name='sine_price_model', start_date='2021-01-01')
+
+    serial_results = pv.value_portfolio(table, forward_curve=serial_curve, **PARAMETERS)
+    parallel_results = par.value_portfolio_parallel(table, workers=2, chunk_size=7, forward_curve=parallel_curve,
+                                                    **PARAMETERS)
+    assert_same_results(parallel_results, serial_results)
+    errors = dict(zip(parallel_results['contract_id'].tolist(), parallel_results['error'].tolist()))
+    assert errors['bad_date'] == 'Some client action dates could not be read, they must be in the form dd/mm/yy.'
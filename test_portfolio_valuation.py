@@ -0,0 +1,80 @@
+"""
+Checks the batch valuation of portfolio_valuation against contract_pricing.value_contract, one contract at a time.
+
+Run with: python -m pytest test_portfolio_valuation.py
+"""
+
+# All imported and files/scripts libraries here.
+import numpy as np
+import contract_pricing as cp
+import portfolio_valuation as pv
+from conftest import PARAMETERS, contract_table
+
+
+def single_contract_result(contract, forward_curve):
+    # The valuation of contract_pricing for one random contract, or its error message.
+    try:
+        return cp.value_contract(contract['injection_dates'], contract['withdrawal_dates'],
+                                 contract['injected_natural_gas_volumes'], contract['withdrawn_natural_gas_volumes'],
+                                 storage_max_capacity=contract['storage_max_capacity'], forward_curve=forward_curve,
+                                 **PARAMETERS)
+    except cp.ContractValidationError as error:
+        return str(error)
+
+
+def assert_same_as_single_contracts(results, contracts, forward_curve):
+    positions = {contract_id: position for position, contract_id in enumerate(results['contract_id'].tolist())}
+    for contract in contracts:
+        position = positions[contract['contract_id']]
+        expected = single_contract_result(contract, forward_curve)
+        if isinstance(expected, str):
+            assert results['error'][position] == expected
+            assert np.isnan(results['contract_valuation'][position])
+            continue
+        assert results['error'][position] == ''
+        assert results['contract_valuation'][position] == expected['contract_valuation']
+        assert results['final_difference_in_price'][position] == expected['final_difference_in_price']
+        assert results['storage_cost'][position] == expected['storage_cost']
+        assert results['contract_length_in_days'][position] == expected['contract_length_in_days']
+        assert results['contract_start'][position] == np.datetime64(expected['contract_start'].date())
+        assert results['contract_end'][position] == np.datetime64(expected['contract_end'].date())
+
+
+def test_portfolio_matches_single_contracts(random_contracts, random_contract_table, forward_curve):
+    results = pv.value_portfolio(random_contract_table, forward_curve=forward_curve, **PARAMETERS)
+    assert len(results['contract_id']) == len(random_contracts)
+    assert np.count_nonzero(results['error'] == '') > 0
+    assert_same_as_single_contracts(results, random_contracts, forward_curve)
+
+
+def test_empty_table(forward_curve):
+    results = pv.value_portfolio({name: [] for name in pv.CONTRACT_COLUMNS}, forward_curve=forward_curve,
+                                 storage_max_capacity=2000000, **PARAMETERS)
+    assert set(results) == set(pv.RESULT_COLUMNS)
+    assert all(len(column) == 0 for column in results.values())
+
+
+def test_unreadable_cells_only_fail_their_contract(random_contracts, forward_curve):
+    readable_contracts = random_contracts[:20]
+    table = contract_table(readable_contracts)
+    for contract_id, date, volume, capacity in (('bad_date', '31/02/22', '1000', ''),
+                                                ('bad_volume', '01/03/22', 'abc', ''),
+                                                ('empty_volume', '01/03/22', '', ''),
+                                                ('bad_capacity', '01/03/22', '1000', 'abc'),
+                                                ('zero_capacity', '01/03/22', '1000', '0')):
+        for action in ('injection', 'withdrawal'):
+            table['contract_id'].append(contract_id)
+            table['action'].append(action)
+            table['date'].append(date)
+            table['volume'].append(volume)
+            table['storage_max_capacity'].append(capacity)
+    table = {name: [str(value) for value in column] for name, column in table.items()}  # As read from a CSV file.
+
+    results = pv.value_portfolio(table, forward_curve=forward_curve, **PARAMETERS)
+    errors = dict(zip(results['contract_id'].tolist(), results['error'].tolist()))
+    assert errors['bad_date'] == 'Some client action dates could not be read, they must be in the form dd/mm/yy.'
+    assert errors['bad_volume'] == 'Some client action volumes could not be read, they must be numbers.'
+    assert errors['empty_volume'] == 'Some client action volumes could not be read, they must be numbers.'
+    assert errors['bad_capacity'] == 'Some contract parameters could not be read, they must be numbers.'
+    assert errors['zero_capacity'] == pv.parameter_error('storage_max_capacity', 0.)
+    assert_same_as_single_contracts(results, readable_contracts, forward_curve)
@@ -0,0 +1,103 @@
+"""
+Checks that a contract amended with revaluation.ContractRevaluation.amend_event is the same as one built from scratch.
+
+Run with: python -m pytest test_revaluation.py
+"""
+
+# All imported and files/scripts libraries here.
+from datetime import datetime, timedelta
+import random
+import numpy as np
+import pytest
+import contract_pricing as cp
+import revaluation as rv
+from conftest import PARAMETERS
+
+# Number of contracts amended, and the number of amendments made to each of them one after the other.
+NUMBER_OF_AMENDED_CONTRACTS = 100
+AMENDMENTS_PER_CONTRACT = 6
+
+
+def contract_inputs(revaluation):
+    # The client actions of a contract, as contract_pricing.value_contract takes them.
+    return (list(revaluation.client_actions['injection'][0]), list(revaluation.client_actions['withdrawal'][0]),
+            list(revaluation.client_actions['injection'][1]), list(revaluation.client_actions['withdrawal'][1]))
+
+
+def fresh_revaluation(contract_inputs, storage_max_capacity, forward_curve):
+    # The contract built from scratch, or the error it is refused with.
+    try:
+        return rv.ContractRevaluation(*contract_inputs, storage_max_capacity=storage_max_capacity,
+                                      forward_curve=forward_curve, **PARAMETERS)
+    except cp.ContractValidationError as error:
+        return str(error)
+
+
+def assert_same_revaluation(revaluation, expected):
+    assert revaluation.revalue() == expected.revalue()
+    assert revaluation.bucket_sensitivities() == expected.bucket_sensitivities()
+    assert revaluation.sort_keys == expected.sort_keys
+    assert revaluation.client_action_overlap == expected.client_action_overlap
+    if not expected.client_action_overlap:
+        return
+    np.testing.assert_array_equal(revaluation.inventory, expected.inventory)
+    for action in rv.CLIENT_ACTIONS:
+        for arrived_per_day, expected_arrived_per_day in zip(revaluation.arrivals[action], expected.arrivals[action]):
+            np.testing.assert_array_equal(arrived_per_day, expected_arrived_per_day)
+        for queue, expected_queue in zip(revaluation.queues[action], expected.queues[action]):
+            for name in expected_queue:
+                np.testing.assert_array_equal(queue[name], expected_queue[name])
+
+
+def random_amendment(rng, revaluation):
+    # A new date and/or volume for a random client action: (action, position, date or None, volume or None).
+    action = rng.choice(rv.CLIENT_ACTIONS)
+    dates, volumes = revaluation.client_actions[action]
+    position = rng.randrange(len(dates))
+    date = None
+    if rng.random() < 0.5:
+        date = (datetime.strptime(dates[position], cp.DATE_FORMAT) +
+                timedelta(days=rng.randint(-3, 3))).strftime(cp.DATE_FORMAT)
+    volume = volumes[position] + rng.randint(-20000, 20000) if rng.random() < 0.7 or date is None else None
+    return action, position, date, volume
+
+
+def test_amended_contract_matches_fresh_build(random_contracts, forward_curve):
+    rng = random.Random(8)
+    contracts = [(contract, fresh_revaluation((contract['injection_dates'], contract['withdrawal_dates'],
+                                               contract['injected_natural_gas_volumes'],
+                                               contract['withdrawn_natural_gas_volumes']),
+                                              contract['storage_max_capacity'], forward_curve))
+                 for contract in random_contracts]
+    contracts = [(contract, revaluation) for contract, revaluation in contracts
+                 if not isinstance(revaluation, str)][:NUMBER_OF_AMENDED_CONTRACTS]
+    number_of_refused_amendments = number_of_amendments_in_place = 0
+
+    for contract, revaluation in contracts:
+        for _ in range(AMENDMENTS_PER_CONTRACT):
+            action, position, date, volume = random_amendment(rng, revaluation)
+            unamended_inputs = contract_inputs(revaluation)
+            amended_inputs = contract_inputs(revaluation)
+            # The dates of the injections and withdrawals come first, then their volumes.
+            if date is not None:
+                amended_inputs[rv.CLIENT_ACTIONS.index(action)][position] = date
+            if volume is not None:
+                amended_inputs[rv.CLIENT_ACTIONS.index(action) + 2][position] = volume
+            expected = fresh_revaluation(amended_inputs, contract['storage_max_capacity'], forward_curve)
+            queues = revaluation.queues
+
+            if isinstance(expected, str):
+                with pytest.raises(cp.ContractValidationError) as error:
+                    revaluation.amend_event(action, position, date=date, volume=volume)
+                assert str(error.value) == expected
+                number_of_refused_amendments += 1
+                # Left as it was before the amendment.
+                assert contract_inputs(revaluation) == unamended_inputs
+                expected = fresh_revaluation(unamended_inputs, contract['storage_max_capacity'], forward_curve)
+            else:
+                assert revaluation.amend_event(action, position, date=date, volume=volume) == expected.revalue()
+                number_of_amendments_in_place += bool(queues) and revaluation.queues is queues
+            assert_same_revaluation(revaluation, expected)
+
+    assert number_of_refused_amendments > 0
+    assert number_of_amendments_in_place > 0
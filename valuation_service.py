@@ -0,0 +1,187 @@
+"""
+Local valuation service that keeps the pricing model and forward curve warm between requests.
+
+Running contract_pricing.py for every valuation pays for starting Python, importing NumPy and fitting/evaluating the
+pricing model each time. This service does all of that once, then values contracts sent to it over a Unix socket (or a
+localhost TCP port) with asyncio. Connections are served concurrently, the valuations themselves run in a pool of
+threads so a large batch on one connection does not hold up the others.
+
+The forward curve is grown at start-up to cover every date a %d/%m/%y string can hold (1969 to 2068), so requests never
+have to evaluate the pricing model and the curve is never changed while it is being read by several threads.
+
+Protocol: one JSON object per line in each direction. A request is
+
+    {"id": 1, "contracts": [{"injection_dates": [...], "withdrawal_dates": [...], "injected_natural_gas_volumes": [...],
+                             "withdrawn_natural_gas_volumes": [...], "storage_max_capacity": 2000000, ...}, ...],
+     "parameters": {"rate_of_injection_or_withdrawal": 50000, ...}}
+
+where every contract may have its own parameters (portfolio_valuation.PARAMETER_COLUMNS), otherwise the ones of the
+request, otherwise the ones at the top of contract_pricing. The reply has the same id and one result per contract with
+the fields of portfolio_valuation.RESULT_COLUMNS (error is the message of a contract that breaks its rules, else '').
+
+Usage: python valuation_service.py [--socket PATH | --port N] [--workers N] [--cache-directory DIR]
+"""
+
+# All imported and files/scripts libraries here.
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import socket
+import time
+import numpy as np
+import contract_pricing as cp
+import forward_curve as fc
+import portfolio_valuation as pv
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# First and last dates a %d/%m/%y string can hold, the forward curve of the service covers them all.
+FIRST_SERVICE_DATE = np.datetime64('1969-01-01', 'D')
+LAST_SERVICE_DATE = np.datetime64('2068-12-31', 'D')
+# Longest request line accepted, in bytes.
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+CONTRACT_INPUTS = ('injection_dates', 'withdrawal_dates', 'injected_natural_gas_volumes',
+                   'withdrawn_natural_gas_volumes')
+DEFAULT_PARAMETERS = {name: getattr(cp, name) for name in pv.PARAMETER_COLUMNS}
+
+
+def warm_forward_curve(model_version='default', cache_directory=None):
+    # Loads the pricing model and its forward curve over every date the service can be asked for.
+    forward_curve = fc.load_forward_curve(model_version=model_version, cache_directory=cache_directory)
+    forward_curve.ensure_horizon(FIRST_SERVICE_DATE, LAST_SERVICE_DATE)
+    cp.contract_months(datetime(2020, 1, 1), datetime(2020, 2, 1))  # Imports dateutil before the first request.
+    return forward_curve
+
+
+def valuation_record(contract, parameters, forward_curve):
+    # Values one contract of a request. Returns a dictionary with the fields of portfolio_valuation.RESULT_COLUMNS.
+    record = {'contract_id': contract.get('contract_id') if isinstance(contract, dict) else None,
+              'contract_valuation': None, 'final_difference_in_price': None, 'storage_cost': None,
+              'contract_start': None, 'contract_end': None, 'contract_length_in_days': None, 'error': ''}
+    try:
+        contract_parameters = {name: float(contract.get(name, parameters.get(name, DEFAULT_PARAMETERS[name])))
+                               for name in pv.PARAMETER_COLUMNS}
+        for name, value in contract_parameters.items():
+            record['error'] = record['error'] or pv.parameter_error(name, value)
+        if record['error']:
+            return record
+        valuation = cp.value_contract(*(list(contract[name]) for name in CONTRACT_INPUTS), **contract_parameters,
+                                      forward_curve=forward_curve)
+    except cp.ContractValidationError as error:
+        record['error'] = str(error)
+        return record
+    except (AttributeError, KeyError, TypeError, ValueError) as error:
+        record['error'] = f'The contract could not be read: {error!r}.'
+        return record
+    except Exception as error:  # Anything else only fails this contract, the rest of the request is still valued.
+        record['error'] = f'The contract could not be valued: {error!r}.'
+        return record
+
+    record.update({
+        'contract_valuation': valuation['contract_valuation'],
+        'final_difference_in_price': valuation['final_difference_in_price'],
+        'storage_cost': valuation['storage_cost'],
+        'contract_start': valuation['contract_start'].strftime(cp.DATE_FORMAT),
+        'contract_end': valuation['contract_end'].strftime(cp.DATE_FORMAT),
+        'contract_length_in_days': valuation['contract_length_in_days'],
+    })
+    return record
+
+
+def value_request(request, forward_curve):
+    # Values every contract of one request. Returns the reply.
+    start_time = time.perf_counter()
+    parameters = request.get('parameters') or {}
+    contracts = request.get('contracts', [])
+    if not isinstance(contracts, list) or not isinstance(parameters, dict):
+        raise ValueError("'contracts' must be a list and 'parameters' an object")
+    results = [valuation_record(contract, parameters, forward_curve) for contract in contracts]
+    return {'id': request.get('id'), 'results': results,
+            'elapsed_milliseconds': round((time.perf_counter() - start_time) * 1000, 3)}
+
+
+class ValuationService:
+    # The asyncio server: every connection sends request lines and gets reply lines back, in the same order.
+
+    def __init__(self, forward_curve, workers=None):
+        self.forward_curve = forward_curve
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.requests_served = 0
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('a request must be a JSON object')
+                except ValueError as error:
+                    reply = {'id': None, 'error': f'The request could not be read: {error}.'}
+                else:
+                    try:
+                        reply = await loop.run_in_executor(self.executor, value_request, request, self.forward_curve)
+                    except Exception as error:  # E.g. 'contracts' not being a list, the connection stays open.
+                        reply = {'id': request.get('id'), 'error': f'The request could not be valued: {error!r}.'}
+                    self.requests_served += 1
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        # Serves on the Unix socket socket_path if given, otherwise on host:port, until cancelled.
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path, limit=MAX_REQUEST_SIZE)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port, limit=MAX_REQUEST_SIZE)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+
+
+def request_valuations(contracts, parameters=None, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                       request_id=None):
+    # Client side: sends one batch of contracts (dictionaries with the inputs of contract_pricing.value_contract) to a
+    # running service and returns its reply. For many batches, keep one connection open instead.
+    request = {'id': request_id, 'contracts': contracts, 'parameters': parameters or {}}
+    if socket_path is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path)
+    else:
+        connection = socket.create_connection((host, port))
+    with connection, connection.makefile('rwb') as stream:
+        stream.write(json.dumps(request).encode() + b'\n')
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local contract valuation service with a warm pricing model.')
+    parser.add_argument('--socket', default=None, help='Unix socket path (default: localhost TCP)')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='TCP host to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='TCP port to listen on')
+    parser.add_argument('--workers', type=int, default=None, help='threads valuing requests')
+    parser.add_argument('--model-version', default='default', help='version of the pricing model curve')
+    parser.add_argument('--cache-directory', default=None, help='directory to keep the forward curve in')
+    arguments = parser.parse_args()
+
+    service = ValuationService(warm_forward_curve(arguments.model_version, arguments.cache_directory),
+                               arguments.workers)
+    print(f'Valuation service ready on {arguments.socket or f"{arguments.host}:{arguments.port}"}.', flush=True)
+    try:
+        asyncio.run(service.serve(arguments.socket, arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        print(f'Valuation service stopped after {service.requests_served} requests.')